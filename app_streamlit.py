@@ -9,44 +9,65 @@
 # - FIX: id_lead autoincremental continuo (L0001, L0002, …)
 # - FIX: celular/teléfono se guardan y buscan sin espacios
 # - Respaldo diario automático (CSV) y snapshot de “Exportar/respaldar CSV”
+# - PERF: respaldo en un hilo aparte, gzip direccionado por hash (sin copia si no cambió) y manifiesto
 # - HARDENED: rutas absolutas, guardado atómico, lock de archivo y “autosanación” color/etapa
 # - UPGRADE: hora local del usuario (no del servidor)
+# - PERF: bitácora append-only de cambios (data/leads.journal.jsonl) con compactación a leads.csv
+# - PERF: backend de almacenamiento intercambiable (CSV o SQLite indexado, CRM_STORAGE=sqlite)
+# - PERF: snapshot Arrow de leads.csv (data/.snapshots) que solo se reconstruye si cambia el archivo
+# - PERF: búsqueda por índice de trigramas (sin acentos; teléfonos solo dígitos)
+# - PERF: historial como eventos append-only (data/lead_events.jsonl) indexados por lead
+# - PERF: dashboard sobre agregados materializados que se actualizan por delta en cada guardado
+# - PERF: lista de Seguimiento paginada (orden en servidor, solo la página viaja al navegador)
+# - FIX: escrituras por lead con versión de fila (compare-and-swap): no se pisan cambios concurrentes
+# - FIX: id_lead desde una secuencia persistente con lock (O(1), reservable en bloque, sin duplicados)
+# - Importación masiva CSV/XLSX (UI y `python app_streamlit.py importar archivo.csv`) en una sola escritura
+# - Detección de duplicados por teléfono (últimos 10 dígitos) / correo y fusión conservando el id más antiguo
+# - PERF: trazas por rerun (spans, espera/retención de locks, bytes) en data/perf/trace.jsonl + panel Admin
+# - PERF: benchmark con leads sintéticos (`python -m crm bench`) → data/perf/bench_*.json
+# - PERF: núcleo sin interfaz en crm/ (importación perezosa, sin efectos); este archivo es solo la UI
+#         y `python -m crm …` corre importar/duplicados/respaldo/bench sin el runtime de Streamlit
+# - PERF: mantenimiento nocturno (`python -m crm mantenimiento`): recolor por bloques, colas del día por
+#         responsable en data/queues (Seguimiento las lee en vez de recalcular toda la tabla)
+# - PERF: proyecciones de columnas (lista / dashboard / completo): los textos de historial heredados
+#         solo se leen para la ficha de un lead
+# - PERF: tabla tipada para dashboard/cohortes (category, Int64, datetime64; texto original intacto al guardar)
+# - PERF: instantánea compartida entre sesiones (copias superficiales; solo se copian las columnas editadas);
+#         cada guardado publica la nueva versión (la anterior + sus operaciones) sin releer la tabla
+# - PERF: sin TTLs: las cachés dependen de la huella de los datos y las sesiones abiertas ven los
+#         cambios de otros usuarios en segundos (CRM_WATCH_SECONDS, un stat por sesión)
 # ──────────────────────────────────────────────────────────────────────────────
 
 from __future__ import annotations
-import re
-import os
-import hashlib
-import shutil
-from pathlib import Path
 from datetime import datetime, date, timedelta
-from contextlib import contextmanager
-from typing import Optional
 
 import altair as alt
+import numpy as np
 import pandas as pd
 import streamlit as st
-
-# ===================== Config & Paths (rutas absolutas + carpeta data/) =====================
+import streamlit.components.v1 as components
+from streamlit import runtime
+
+from crm.aggregates import COHORT_FREQS, COHORT_GROUPS, check_aggregates, compute_cohorts, get_aggregates, rebuild_aggregates
+from crm.backup import EXPORT_FORMATS, backup_status, export_snapshot_to_file, export_table
+from crm.boot import bootstrap, bootstrap_timings
+from crm.config import WATCH_SECONDS, set_clock, timestamp_pair, today, ts_now
+from crm.dedup import dedup_report, merge_all_duplicates
+from crm.domain import (CAT_COMO, CAT_CURSOS, CONTACT_OUTCOMES, FUNNEL_YELLOW, OUTCOME_RULES, STAGE_COLORS, STAGE_DESC,
+                        _to_int, add_attention, apply_outcome, clean_space_only, enrich, list_to_str, make_event,
+                        parse_date_safe, str_to_list)
+from crm.history import append_events, history_df
+from crm.importer import import_leads
+from crm.maintenance import current_queue, queue_ids
+from crm.search import FILTER_COLORS, apply_filters, find_duplicates, get_search_index, search_ids
+from crm.storage import (LeadConflictError, allocate_lead_ids, commit_ops, data_version, get_lead, lead_version,
+                         load_data, load_rows, load_typed, peek_lead_id, write_lead)
+from crm.tracing import read_traces, span, trace_rerun, trace_summary, trace_tag, traced
+from crm.users import try_login
+
+# ===================== Config de página =====================
 st.set_page_config(page_title="CRM Leads", page_icon="🧑‍💼", layout="wide")
 
-def _base_dir():
-    try:
-        return Path(__file__).resolve().parent
-    except NameError:
-        return Path.cwd()
-
-BASE_DIR  = _base_dir()
-DATA_DIR  = (BASE_DIR / "data")
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-DATA_PATH   = DATA_DIR / "leads.csv"
-USERS_PATH  = DATA_DIR / "users.csv"
-BACKUP_DIR  = DATA_DIR / "backups"           # Respaldos dentro de /data
-BACKUP_TAG  = DATA_DIR / ".last_backup_tag"  # Marca de respaldo diario
-EXPORT_DIR  = DATA_DIR / "exports"           # Snapshots tipo "Exportar CSV"
-EXPORT_DIR.mkdir(parents=True, exist_ok=True)
-
 # ===================== Hora local del usuario (cliente) =====================
 # Detecta zona horaria del navegador con JS; si no, usa UTC
 try:
@@ -91,251 +112,27 @@ def timestamp_pair_local():
     dt = now_client()
     return dt.date().isoformat(), dt.strftime("%H:%M:%S")
 
-# Enrutamos utilidades a hora local
-def today() -> date: return today_client()
-def ts_now() -> str: return ts_now_local()
-def timestamp_pair(): return timestamp_pair_local()
-
-# ===================== Bloqueo de archivo (best-effort) =====================
-@contextmanager
-def file_lock(lock_path: Path):
-    lock_file = lock_path.with_suffix(lock_path.suffix + ".lock")
-    fd = None
-    try:
-        fd = os.open(str(lock_file), os.O_CREAT | os.O_RDWR)
-        try:
-            import fcntl
-            fcntl.flock(fd, fcntl.LOCK_EX)
-        except Exception:
-            pass
-        yield
-    finally:
-        try:
-            if fd is not None:
-                try:
-                    import fcntl
-                    fcntl.flock(fd, fcntl.LOCK_UN)
-                except Exception:
-                    pass
-                os.close(fd)
-        except Exception:
-            pass
-
-# ===================== Usuarios (default + helpers) =====================
-DEFAULT_USER_ROWS = [
-    ["admin","Admin","Admin","ba26148e3bc77341163135d123a4dc26664ff0497da04c0b3e83218c97f70c45"],
-    ["director","Director","Director","c34926c2783dca6cf34d1160ed5a04e1615cb813d3b5798efc29cc590cce4c91"],
-    ["subdirector","Subdirector","Subdirector","58845944d08671209339de539469a100c8e9d6e17dcee9a447c7751937f7cb48"],
-    ["favio","Favio","Ventas","e28ebb5d991f9ebbc5f2d26b199586e9bfb8fffd3b76dca200efd75eb68e999d"],
-    ["nancy","Nancy","Ventas","64b1bce63509372952ad7191af86bddcb9939772404c236ff67b89d0442496d0"],
-    ["rosario","Rosario","Ventas","706f42010b29d6376c768d717a19b49dc50b8b7133bffa1ae36d0fbbc32d59bc"],
-    ["haydee","Haydee","Comunicación","6b90d996f7c98698cd95d0d86f1298dbb9df89df34f16136b259a4efcaba04d8"],
-    ["nora","Nora","Comunicación","f54fd67046eeca39cd1f760730d3b48b1c00d3830f0c5b9fa5ace0a7683a22058"],
-]
-USER_COLUMNS = ["username","name","role","password_hash"]
-
-def sha256_hex(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
-
-def ensure_users_csv():
-    USERS_PATH.parent.mkdir(parents=True, exist_ok=True)
-    if not USERS_PATH.exists():
-        with file_lock(USERS_PATH):
-            pd.DataFrame(DEFAULT_USER_ROWS, columns=USER_COLUMNS).to_csv(USERS_PATH, index=False, encoding="utf-8")
-    else:
-        dfu = pd.read_csv(USERS_PATH, dtype=str).fillna("")
-        for c in USER_COLUMNS:
-            if c not in dfu.columns:
-                dfu[c] = ""
-        dfu = dfu[USER_COLUMNS]
-        with file_lock(USERS_PATH):
-            dfu.to_csv(USERS_PATH, index=False, encoding="utf-8")
-
-@st.cache_data(ttl=60)
-def load_users() -> pd.DataFrame:
-    ensure_users_csv()
-    return pd.read_csv(USERS_PATH, dtype=str).fillna("")
-
-def try_login(username: str, password: str):
-    users = load_users()
-    row = users[users["username"].str.lower() == (username or "").strip().lower()]
-    if row.empty: return None
-    ok = (row.iloc[0]["password_hash"] == sha256_hex(password or ""))
-    if not ok: return None
-    return {"username": row.iloc[0]["username"], "name": row.iloc[0]["name"], "role": row.iloc[0]["role"]}
+# Enrutamos el reloj del núcleo (today/ts_now/timestamp_pair) a la hora local de la sesión
+set_clock(now_client)
 
+# ===================== Sesión y componentes de lead =====================
 def logout():
     for k in ["user","selected_lead_id","filters"]:
         if k in st.session_state: del st.session_state[k]
 
-# ===================== Constantes & Catálogos =====================
-COLUMNS_BASE = [
-    "id_lead","fecha_registro","hora_registro","nombre/alias","apellidos","genero","edad","celular",
-    "telefono","correo","interes_curso(puede sellecionar varios)","como_enteraste","funnel_etapas",
-    "fecha_ultimo_contacto","observaciones","atendido_por","proxima_accion_fecha","proxima_accion_desc"
-]
-COLUMNS_EXTRA = [
-    "estado_color","fecha_cambio_color","amarillo_contador",
-    "historial_color","historial_atenciones","total_atenciones"
-]
-CAT_CURSOS = [
-    "IA profesionales inmobiliarios","IA educación básica","IA educación universitaria",
-    "IA empresas","IA para gobierno","Inglés","Polivirtual Bach.","Polivirtual Lic."
-]
-CAT_COMO = [
-    "Facebook","Instagram","WhatsApp","Correo electrónico","Sitio web",
-    "Recomendación","Volante/Impreso","Evento/Conferencia","Otro",
-]
-FUNNEL_YELLOW = [
-    "Follow-up (Seguimiento)","Materials (Materiales/flyer/videos)","Bank details (Datos bancarios)",
-    "Proposal (Propuesta)","Negotiation (Negociación)","Nurturing (Nutrición)",
-]
-STAGE_DESC = {
-    "Follow-up (Seguimiento)": "Primeras interacciones y agendar siguiente contacto.",
-    "Materials (Materiales/flyer/videos)": "Se enviaron temarios, flyers o videos.",
-    "Bank details (Datos bancarios)": "Se compartieron datos para pago/inscripción.",
-    "Proposal (Propuesta)": "Propuesta formal enviada.",
-    "Negotiation (Negociación)": "Ajustes/condiciones finales.",
-    "Nurturing (Nutrición)": "Aún no listo; nutrir con contenido.",
-    "Won (Ganado)": "Cerrado con pago.",
-    "Lost (Perdido)": "Descartado o sin interés.",
-    "Contacted (Contactado)": "Contacto inicial.",
-}
-STAGE_COLORS = {
-    "Follow-up (Seguimiento)": "#3b82f6","Materials (Materiales/flyer/videos)": "#10b981","Bank details (Datos bancarios)": "#f59e0b",
-    "Proposal (Propuesta)": "#8b5cf6","Negotiation (Negociación)": "#ef4444","Nurturing (Nutrición)": "#6b7280",
-    "Won (Ganado)": "#22c55e","Lost (Perdido)": "#ef4444","Contacted (Contactado)": "#eab308",
-}
-CONTACT_OUTCOMES = [
-    "📵 No responde","ℹ️ Pide información","✅ Interesado (propuesta)","💳 Envió comprobante","🚫 No interesado",
-]
-OUTCOME_RULES = {
-    "📵 No responde": ("🟡","Follow-up (Seguimiento)",2,"Reintentar contacto"),
-    "ℹ️ Pide información": ("🟡","Materials (Materiales/flyer/videos)",1,"Enviar materiales"),
-    "✅ Interesado (propuesta)": ("🟡","Bank details (Datos bancarios)",1,"Enviar datos bancarios"),
-    "💳 Envió comprobante": ("🟢","Won (Ganado)",0,"Pago confirmado"),
-    "🚫 No interesado": ("🔴","Lost (Perdido)",0,"Cierre por no interés"),
-}
+def seen_lead(slot: str, rec: dict) -> dict:
+    # Copia del lead tal como se mostró al abrirlo en `slot` (página): base del compare-and-swap
+    seen = st.session_state.setdefault("seen_leads", {})
+    if str((seen.get(slot) or {}).get("id_lead","")) != str(rec["id_lead"]):
+        seen[slot] = dict(rec)
+    return seen[slot]
 
-# ===================== Utilidades =====================
-def parse_date_safe(s):
-    if s is None: return None
-    s_str = str(s).strip()
-    if not s_str: return None
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%d-%m-%Y"):
-        try:
-            return datetime.strptime(s_str, fmt).date()
-        except ValueError:
-            pass
-    ts = pd.to_datetime(s_str, dayfirst=True, errors="coerce")
-    return ts.date() if pd.notna(ts) else None
-
-def str_to_list(s: str) -> list[str]:
-    if not s or pd.isna(s): return []
-    return [x.strip() for x in str(s).split("|") if x.strip()]
-
-def list_to_str(vals: list[str]) -> str:
-    return " | ".join([v for v in vals if v])
-
-def clean_space_only(s: str) -> str:
-    if s is None: return ""
-    return re.sub(r"\s+", "", str(s))
-
-# ===================== IO CSV Leads (asegurar columnas + guardado atómico) =====================
-def _atomic_to_csv(df: pd.DataFrame, path: Path):
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    with file_lock(path):
-        df.to_csv(tmp, index=False, encoding="utf-8")
-        Path(tmp).replace(path)
-
-def ensure_csv():
-    DATA_PATH.parent.mkdir(parents=True, exist_ok=True)
-    if not DATA_PATH.exists():
-        with file_lock(DATA_PATH):
-            pd.DataFrame(columns=COLUMNS_BASE + COLUMNS_EXTRA).to_csv(DATA_PATH, index=False, encoding="utf-8")
-    else:
-        df = pd.read_csv(DATA_PATH, dtype=str).fillna("")
-        changed = False
-        for c in COLUMNS_BASE + COLUMNS_EXTRA:
-            if c not in df.columns:
-                df[c] = "" if c not in ("amarillo_contador","total_atenciones") else "0"
-                changed = True
-        df = df[COLUMNS_BASE + COLUMNS_EXTRA]
-        if changed:
-            _atomic_to_csv(df, DATA_PATH)
-
-@st.cache_data(ttl=10)
-def load_data() -> pd.DataFrame:
-    ensure_csv()
-    return pd.read_csv(DATA_PATH, dtype=str).fillna("")
-
-def save_data(df: pd.DataFrame):
-    for c in COLUMNS_BASE + COLUMNS_EXTRA:
-        if c not in df.columns:
-            df[c] = "" if c not in ("amarillo_contador","total_atenciones") else "0"
-    df = df[COLUMNS_BASE + COLUMNS_EXTRA].copy().fillna("")
-    _atomic_to_csv(df, DATA_PATH)
-    load_data.clear()
-
-# ---------- ID autoincremental ----------
-def next_lead_id(df: pd.DataFrame) -> str:
-    if df.empty: return "L0001"
-    ids = df["id_lead"].astype(str).tolist()
-    nums = []
-    for s in ids:
-        m = re.search(r"(\d+)$", s)
-        if m:
-            try:
-                nums.append(int(m.group(1)))
-            except Exception:
-                pass
-    n = (max(nums) + 1) if nums else (len(ids) + 1)
-    return f"L{n:04d}"
-
-# ===================== Lógica de estado/orden =====================
-def etapa_is_won(etapa: str) -> bool:
-    e = str(etapa or "")
-    return ("Ganado" in e) or e.startswith("Won")
-
-def etapa_is_lost(etapa: str) -> bool:
-    e = str(etapa or "")
-    return ("Perdido" in e) or e.startswith("Lost")
-
-def compute_color(row) -> str:
-    color = str(row.get("estado_color","")).strip()
-    if color in {"🔴","🟡","🟢"}:
-        return color
-    etapa = str(row.get("funnel_etapas","")).strip()
-    ult = parse_date_safe(row.get("fecha_ultimo_contacto",""))
-    if etapa_is_won(etapa): return "🟢"
-    if etapa_is_lost(etapa): return "🔴"
-    if ult and (today() - ult).days > 30: return "🔴"
-    return "🟡"
-
-def enrich(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty: return df
-    df = df.copy()
-    df["estado_color"] = df.apply(compute_color, axis=1)
-    df["_prox"] = df["proxima_accion_fecha"].apply(parse_date_safe)
-    df["_reg"]  = df["fecha_registro"].apply(parse_date_safe)
-    df["_ord"]  = df["estado_color"].map({"🔴":0,"🟡":1,"🟢":2}).fillna(9)
-    df = df.sort_values(by=["_ord","_prox","_reg"], ascending=[True,True,False])
-    return df
-
-def add_attention(base: pd.DataFrame, idx: int, old_c: str, new_c: str, nota: str, user: str):
-    ts = ts_now()
-    if old_c != new_c:
-        hist = str(base.loc[idx,"historial_color"] or "")
-        base.loc[idx,"historial_color"] = (hist + ("\n" if hist else "") + f"{ts} | {old_c} → {new_c}")
-        base.loc[idx,"fecha_cambio_color"] = ts
-    cnt = int(str(base.loc[idx,"amarillo_contador"] or "0") or 0)
-    if new_c == "🟡": cnt += 1
-    base.loc[idx,"amarillo_contador"] = str(cnt)
-    hist_att = str(base.loc[idx,"historial_atenciones"] or "")
-    base.loc[idx,"historial_atenciones"] = (hist_att + ("\n" if hist_att else "") + f"{ts} | {user or 'sin usuario'} | {nota or 'sin nota'}")
-    total = int(str(base.loc[idx,"total_atenciones"] or "0") or 0)
-    base.loc[idx,"total_atenciones"] = str(total + 1)
-    return base
+def forget_lead(slot: str):
+    st.session_state.get("seen_leads", {}).pop(slot, None)
+
+def conflict_error(e: LeadConflictError):
+    campos = ", ".join(e.fields) if e.fields else "el lead ya no existe"
+    st.error(f"⚠️ Otro usuario modificó este lead mientras lo editabas ({campos}). Se recargaron los datos; revisa y vuelve a guardar.")
 
 def sla_badges(row):
     prox = parse_date_safe(row.get("proxima_accion_fecha",""))
@@ -346,44 +143,11 @@ def sla_badges(row):
     elif not prox:
         st.info("📭 Sin próxima acción programada")
 
-def apply_outcome(row, outcome: str, nota: str, user: str):
-    color, stage, delta, desc = OUTCOME_RULES[outcome]
-    next_date = today() + timedelta(days=delta) if delta > 0 else None
-    next_desc = (row.get("proxima_accion_desc","") or desc)
-    nota_final = nota or outcome
-    return color, stage, next_date, next_desc, nota_final
-
-# ===================== Autosanación color/etapa =====================
-def heal_and_persist(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty: return df
-    df2 = df.copy()
-    changed = False
-    for i, row in df2.iterrows():
-        etapa = str(row.get("funnel_etapas",""))
-        color = str(row.get("estado_color",""))
-        if etapa_is_won(etapa) and color != "🟢":
-            df2.at[i, "estado_color"] = "🟢"; changed = True
-        elif etapa_is_lost(etapa) and color != "🔴":
-            df2.at[i, "estado_color"] = "🔴"; changed = True
-    mask_empty = (~df2["estado_color"].isin(["🔴","🟡","🟢"]))
-    if mask_empty.any():
-        df2.loc[mask_empty, "estado_color"] = df2[mask_empty].apply(compute_color, axis=1)
-        changed = True
-    if changed:
-        save_data(df2)
-        return df2
-    return df2
-
-# ===================== Exportaciones (snapshot = “Exportar/respaldar CSV”) =====================
-def export_dataframe_current() -> pd.DataFrame:
-    return load_data().copy()
-
-def export_snapshot_to_file(prefix: str = "leads_export") -> Path:
-    stamp = now_client().strftime("%Y%m%d_%H%M%S")
-    out = EXPORT_DIR / f"{prefix}_{stamp}.csv"
-    df = export_dataframe_current()
-    df.to_csv(out, index=False, encoding="utf-8")
-    return out
+# ===================== Cachés de sesión sobre el núcleo =====================
+@st.cache_data(max_entries=8, show_spinner="Generando archivo…")
+def export_bytes(version, ext: str, filters: tuple | None = None) -> bytes:
+    """Archivo a descargar por (versión de datos, formato, filtros): se genera solo cuando se pide."""
+    return export_table(ext, filters)
 
 def _on_export_click():
     # Guarda un snapshot físico adicional como “respaldo” cada vez que se exporta
@@ -393,58 +157,9 @@ def _on_export_click():
     except Exception as e:
         st.warning(f"No se pudo guardar el respaldo local del export: {e}")
 
-# ===================== Respaldo diario (AUTO) =====================
-def _backup_one(src: Path, date_str: str) -> Path | None:
-    if not src.exists(): return None
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    dst = BACKUP_DIR / f"{src.stem}_{date_str}{src.suffix}"
-    if not dst.exists():
-        shutil.copy2(src, dst)
-    return dst
-
-def daily_backup(keep_days: int = 60) -> list[Path]:
-    """
-    Una vez por día guarda:
-      - data/leads.csv
-      - data/users.csv
-      - data/exports/leads_export_YYYY-MM-DD.csv (snapshot tipo Exportar/respaldar)
-    """
-    today_str = today().isoformat()
-    last = BACKUP_TAG.read_text().strip() if BACKUP_TAG.exists() else ""
-    paths: list[Path] = []
-
-    if last != today_str:
-        for p in (DATA_PATH, USERS_PATH):
-            out = _backup_one(p, today_str)
-            if out: paths.append(out)
-        export_day = EXPORT_DIR / f"leads_export_{today_str}.csv"
-        if not export_day.exists():
-            snap = export_snapshot_to_file(prefix=f"leads_export_{today_str}")
-            shutil.copy2(snap, export_day)
-            paths.append(export_day)
-        BACKUP_TAG.write_text(today_str, encoding="utf-8")
-
-    # Limpieza simple por antigüedad
-    for f in BACKUP_DIR.glob("*.csv"):
-        try:
-            parts = f.stem.split("_")
-            if len(parts) >= 2:
-                d = parse_date_safe(parts[-1])
-                if d and (today() - d).days > keep_days:
-                    f.unlink(missing_ok=True)
-        except Exception:
-            pass
-
-    for f in EXPORT_DIR.glob("leads_export_*.csv"):
-        stem = f.stem.replace("leads_export_", "")
-        d = parse_date_safe(stem.split("_")[0])
-        try:
-            if d and (today() - d).days > keep_days:
-                f.unlink(missing_ok=True)
-        except Exception:
-            pass
-
-    return paths
+@st.cache_data(max_entries=64, show_spinner=False)
+def cohort_table(version, start: date, end: date, freq: str, by: str | None) -> pd.DataFrame:
+    return compute_cohorts(load_typed("dashboard"), start, end, freq, by)
 
 # ===================== Estado global (UI) =====================
 if "selected_lead_id" not in st.session_state: st.session_state.selected_lead_id = None
@@ -453,35 +168,15 @@ if "filters" not in st.session_state: st.session_state.filters = {"q":"", "resp"
 def set_selected(lead_id: str | None):
     if lead_id: st.session_state.selected_lead_id = str(lead_id)
 
-# ===================== Componentes UI Reutilizables =====================
+
 def ui_filtros(df: pd.DataFrame) -> pd.DataFrame:
     with st.expander("🔎 Filtros", expanded=False):
         c1,c2,c3 = st.columns(3)
         q  = c1.text_input("Buscar (nombre/correo/teléfono):", st.session_state.filters["q"]).strip().lower()
         rp = c2.text_input("Responsable:", st.session_state.filters["resp"]).strip().lower()
-        opt = ["(Todos)","🔴 Rojo","🟡 Amarillo","🟢 Verde"]
-        col = c3.selectbox("Estado:", opt, index=st.session_state.filters["color_idx"])
-    st.session_state.filters = {"q":q,"resp":rp,"color_idx":opt.index(col)}
-
-    if q:
-        q_norm = q.replace(" ", "")
-        def _match_row(r):
-            campos_texto = [
-                str(r.get("nombre/alias","")).lower(),
-                str(r.get("apellidos","")).lower(),
-                str(r.get("correo","")).lower(),
-            ]
-            cel_norm = clean_space_only(str(r.get("celular",""))).lower()
-            tel_norm = clean_space_only(str(r.get("telefono",""))).lower()
-            return (
-                any(q in campo for campo in campos_texto) or
-                (q_norm and (q_norm in cel_norm or q_norm in tel_norm))
-            )
-        df = df[df.apply(_match_row, axis=1)]
-
-    if rp: df = df[df["atendido_por"].str.lower().str.contains(rp, na=False)]
-    if col != "(Todos)": df = df[df["estado_color"] == col.split(" ")[0]]
-    return df
+        col = c3.selectbox("Estado:", FILTER_COLORS, index=st.session_state.filters["color_idx"])
+    st.session_state.filters = {"q":q,"resp":rp,"color_idx":FILTER_COLORS.index(col)}
+    return apply_filters(df, q, rp, FILTER_COLORS.index(col))
 
 # >>>>>>>>>>>>>>>>>>>>> CAMBIO AQUÍ: incluir fecha_registro y hora_registro en Consultar <<<<<<<<<<<<<<<<<<<<<<
 def ui_tabla(df: pd.DataFrame, height=420):
@@ -500,103 +195,131 @@ def ui_tabla(df: pd.DataFrame, height=420):
     cols = [c for c in cols if c in df.columns]
     st.dataframe(df[cols], use_container_width=True, height=height)
 
-def ui_lead_radio(df: pd.DataFrame) -> str | None:
+# ---------- Lista paginada de leads ----------
+# Orden del lado del servidor y solo la página visible viaja al navegador (etiquetas incluidas).
+# La selección vive en session_state, así que cambiar de página u orden no la pierde.
+LIST_SORTS = {
+    "Color · próxima acción": (["_ord","_prox","_reg"], [True, True, False]),
+    "Próxima acción":         (["_prox","_ord"], [True, True]),
+    "Registro (recientes)":   (["_reg","id_lead"], [False, False]),
+}
+LIST_PAGE_SIZES = [10, 25, 50, 100]
+
+# PageUp / PageDown cambian de página (fuera de campos de texto): se hace clic en ◀ / ▶ de ESTE
+# paginador. Los botones se buscan dentro del contenedor marcado con PAGER_MARK (primero ◀, último ▶),
+# no por su texto; si no hay exactamente un paginador en pantalla, la tecla no hace nada.
+PAGER_MARK = "crm-lead-pager"
+_PAGER_KEYS_JS = """
+<script>
+const doc = window.parent.document;
+if (!window.parent.__crmPagerKeysV2) {
+  window.parent.__crmPagerKeysV2 = true;
+  doc.addEventListener("keydown", (e) => {
+    const tag = (e.target.tagName || "").toLowerCase();
+    if (tag === "input" || tag === "textarea" || e.target.isContentEditable) return;
+    if (e.key !== "PageDown" && e.key !== "PageUp") return;
+    const marks = doc.querySelectorAll("span.%s");
+    if (marks.length !== 1) return;
+    const box = marks[0].closest('[data-testid="stVerticalBlock"]');
+    const btns = box ? box.querySelectorAll('[data-testid="stHorizontalBlock"] button') : [];
+    if (btns.length < 2) return;
+    const btn = e.key === "PageDown" ? btns[btns.length - 1] : btns[0];
+    if (!btn.disabled) { e.preventDefault(); btn.click(); }
+  });
+}
+</script>
+""" % PAGER_MARK
+
+def _list_page_step(delta: int):
+    st.session_state["list_page"] = st.session_state.get("list_page", 0) + delta
+
+def ui_lead_list(df: pd.DataFrame, ranked: bool = False, scope: tuple = ()) -> str | None:
+    # `scope`: vista/filtros que produjeron `df`; si cambian, la paginación vuelve a empezar
     if df.empty:
         st.info("Sin leads con los filtros actuales."); return None
-    df = df.copy(); df["id_lead"] = df["id_lead"].astype(str)
-    def label(r):
-        prox = r.get("proxima_accion_fecha","—") or "—"
-        return f"🧑 {r.get('estado_color','')}  {r.get('nombre/alias','')} {r.get('apellidos','')} • {prox}"
-    ids = df["id_lead"].tolist()
-    labels = {r["id_lead"]: label(r) for _,r in df.iterrows()}
-    pre = ids.index(st.session_state.selected_lead_id) if st.session_state.selected_lead_id in ids else 0
-    choice = st.radio("Selecciona un lead:", options=ids, index=pre, format_func=lambda k: labels.get(k,k), key="lead_radio")
-    yc = int(str(df[df["id_lead"]==choice].iloc[0].get("amarillo_contador","0") or 0))
-    st.metric("Veces en 🟡", yc)
-    set_selected(choice)
-    return choice
-
-# ---------- Historial unificado ----------
-_TS = r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})"
-def _rows_color(t):
-    out=[]
-    for s in (t or "").splitlines():
-        s=s.strip()
-        if not s: continue
-        m=re.match(rf"^{_TS}\s*\|\s*(.+)$",s)
-        if m:
-            ts,rest=m.groups(); m2=re.search(r"([🔴🟡🟢])\s*→\s*([🔴🟡🟢])",rest)
-            out.append({"Fecha":ts,"Tipo":"Cambio de color","Usuario":"","Detalle":rest,"De":(m2.group(1) if m2 else ""),"A":(m2.group(2) if m2 else "")})
-        else:
-            out.append({"Fecha":"","Tipo":"Cambio de color","Usuario":"","Detalle":s,"De":"","A":""})
-    return out
-
-def _rows_att(t):
-    out=[]
-    for s in (t or "").splitlines():
-        s=s.strip()
-        if not s: continue
-        m=re.match(rf"^{_TS}\s*\|\s*([^|]+)\|\s*(.*)$",s)
-        if m:
-            ts,u,nota=m.groups()
-            out.append({"Fecha":ts,"Tipo":"Atención","Usuario":u.strip(),"Detalle":nota.strip(),"De":"","A":""})
-        else:
-            out.append({"Fecha":"","Tipo":"Atención","Usuario":"","Detalle":s,"De":"","A":""})
-    return out
-
-def _rows_obs(t):
-    out=[]; first=True
-    for s in (t or "").splitlines():
-        s=s.rstrip()
-        if not s: continue
-        if first and not re.match(rf"^{_TS}",s):
-            out.append({"Fecha":"","Tipo":"Observación","Usuario":"","Detalle":s,"De":"","A":""}); first=False; continue
-        first=False
-        m=re.match(rf"^{_TS}\s*\|\s*([^|]+)\|\s*(.*)$",s)
-        if m:
-            ts,u,obs=m.groups()
-            out.append({"Fecha":ts,"Tipo":"Observación","Usuario":u.strip(),"Detalle":obs.strip(),"De":"","A":""})
-        else:
-            out.append({"Fecha":"","Tipo":"Observación","Usuario":"","Detalle":s,"De":"","A":""})
-    return out
-
-def history_df(row: pd.Series) -> pd.DataFrame:
-    rows = _rows_color(row.get("historial_color","")) + _rows_att(row.get("historial_atenciones","")) + _rows_obs(row.get("observaciones",""))
-    dfh = pd.DataFrame(rows, columns=["Fecha","Tipo","Usuario","Detalle","De","A"])
-    if dfh.empty: return dfh
-    dfh["Fecha"] = pd.to_datetime(dfh["Fecha"], errors="coerce")
-    order = {"Atención":0,"Cambio de color":1,"Observación":2}
-    dfh["__ord"] = dfh["Tipo"].map(order).fillna(9).astype(int)
-    dfh = dfh.sort_values(["Fecha","__ord"], ascending=[False,True], na_position="last").drop(columns="__ord")
-    return dfh
+    c1, c2 = st.columns([2,1])
+    sorts = (["Coincidencia"] if ranked else []) + list(LIST_SORTS)
+    sort = c1.selectbox("Ordenar por", sorts, key="list_sort")
+    size = c2.selectbox("Por página", LIST_PAGE_SIZES, index=1, key="list_size")
+    if sort in LIST_SORTS:
+        by, asc = LIST_SORTS[sort]
+        df = df.sort_values(by=by, ascending=asc, na_position="last", kind="stable")
+
+    ids = df["id_lead"].astype(str).to_numpy()
+    sel = st.session_state.selected_lead_id
+    hit = np.flatnonzero(ids == sel) if sel else np.array([], dtype=int)
+    pages = (len(ids) - 1) // size + 1
+    sig = (sort, size, scope, len(ids))
+    if st.session_state.get("list_sig") != sig:  # otros filtros/orden/tamaño: abrir en la página del seleccionado
+        st.session_state["list_sig"] = sig
+        st.session_state["list_page"] = int(hit[0]) // size if len(hit) else 0
+    page = min(max(st.session_state.get("list_page", 0), 0), pages - 1)
+    st.session_state["list_page"] = page
+
+    view = df.iloc[page * size:(page + 1) * size]
+    labels = dict(zip(view["id_lead"].astype(str),
+                      "🧑 " + view["estado_color"].fillna("") + "  " + view["nombre/alias"].fillna("") + " " +
+                      view["apellidos"].fillna("") + " • " + view["proxima_accion_fecha"].fillna("").replace("", "—")))
+    options = list(labels)
+    choice = st.radio("Selecciona un lead:", options=options, index=options.index(sel) if sel in labels else (None if sel else 0),
+                      format_func=lambda k: labels.get(k, k), key=f"lead_radio_{page}_{sort}_{size}")
+
+    with st.container():  # contenedor propio: el marcador ubica a estos botones para RePág/AvPág
+        st.markdown(f"<span class='{PAGER_MARK}'></span>", unsafe_allow_html=True)
+        b1, b2, b3 = st.columns([1,2,1])
+        b1.button("◀", on_click=_list_page_step, args=(-1,), disabled=page == 0, use_container_width=True, key="list_prev")
+        b2.caption(f"{page * size + 1}–{page * size + len(view)} de {len(ids)} · pág. {page + 1}/{pages} (RePág/AvPág)")
+        b3.button("▶", on_click=_list_page_step, args=(1,), disabled=page >= pages - 1, use_container_width=True, key="list_next")
+    components.html(_PAGER_KEYS_JS, height=0)
+
+    if choice: set_selected(choice)
+    sel = st.session_state.selected_lead_id
+    if sel in labels:
+        st.metric("Veces en 🟡", _to_int(view.loc[view["id_lead"].astype(str) == sel, "amarillo_contador"].iloc[0]))
+    elif len(hit):
+        st.caption(f"Seleccionado: {sel} (en la pág. {int(hit[0]) // size + 1})")
+    return choice or (sel if len(hit) else None)
 
 # ===================== Páginas: Leads / Seguimiento / Dashboard =====================
+@traced()
 def page_leads():
     st.title("🧑‍💼 Leads")
-    sub = st.radio("Menú:", ["Consultar","Agregar","Editar"], horizontal=True)
+    opciones = ["Consultar","Agregar","Editar"]
+    if st.session_state.user["role"] in ("Admin","Director"): opciones += ["Importar","Duplicados"]
+    sub = st.radio("Menú:", opciones, horizontal=True)
 
     if sub == "Consultar":
-        df = ui_filtros(enrich(load_data()))
+        st.session_state.live_view = True
+        df = ui_filtros(enrich(load_data("lista")))
         ui_tabla(df)
 
-        # Botón Exportar/respaldar CSV (descarga + guarda snapshot en /data/exports)
-        export_df = export_dataframe_current()
-        st.download_button(
-            "⬇️ Exportar/respaldar CSV",
-            data=export_df.to_csv(index=False).encode("utf-8"),
-            file_name=f"leads_export_{now_client().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            use_container_width=True,
-            on_click=_on_export_click
-        )
+        # Exportar/respaldar (descarga + guarda snapshot en /data/exports): el archivo se arma al pedirlo
+        with st.expander("⬇️ Exportar/respaldar", expanded=False):
+            c1, c2, c3 = st.columns([1,1,1])
+            fmt = c1.selectbox("Formato", list(EXPORT_FORMATS))
+            alcance = c2.radio("Alcance", ["Todos los leads","Vista filtrada"], horizontal=True)
+            f = st.session_state.filters
+            filters = (f["q"], f["resp"], f["color_idx"]) if alcance == "Vista filtrada" else None
+            key = (data_version(), EXPORT_FORMATS[fmt][0], filters)
+            if c3.button("Preparar archivo", use_container_width=True):
+                st.session_state["export_key"] = key
+            if st.session_state.get("export_key") == key:
+                ext, mime = EXPORT_FORMATS[fmt]
+                st.download_button(
+                    f"⬇️ Descargar {fmt}",
+                    data=export_bytes(*key),
+                    file_name=f"leads_export_{now_client().strftime('%Y%m%d_%H%M%S')}.{ext}",
+                    mime=mime,
+                    use_container_width=True,
+                    on_click=_on_export_click
+                )
 
     elif sub == "Agregar":
         st.subheader("➕ Agregar")
-        df = load_data()
         with st.form("form_new"):
             ctop = st.columns([1,1,1,1])
             with ctop[0]:
-                st.caption(f"Siguiente ID asignado: **{next_lead_id(df)}**")
+                st.caption(f"Siguiente ID asignado: **{peek_lead_id()}**")
             c1,c2,c3,c4 = st.columns(4)
             nombre = c1.text_input("👤 Nombre / alias")
             apellidos = c2.text_input("👥 Apellidos")
@@ -614,10 +337,17 @@ def page_leads():
             c10,c11 = st.columns(2)
             prox_fecha = c10.date_input("📅 Próxima acción", value=today()+timedelta(days=3))
             prox_desc  = c11.text_input("📝 Descripción próxima acción")
+            forzar = st.checkbox("Guardar aunque parezca duplicado", value=False)
             ok = st.form_submit_button("Guardar")
 
-        if ok:
-            fid = next_lead_id(df)
+        dups = find_duplicates({"celular": celular, "telefono": telefono, "correo": correo}) if ok else []
+        if dups and not forzar:
+            docs = get_search_index().docs
+            st.warning("⚠️ Posible duplicado (mismo teléfono o correo): " +
+                       " · ".join(f"{d} {docs.get(d, {}).get('nombre/alias','')} {docs.get(d, {}).get('apellidos','')}".strip() for d in dups[:5]) +
+                       ". Revisa el lead existente o marca «Guardar aunque parezca duplicado».")
+        elif ok:
+            fid = allocate_lead_ids(1)[0]
             f_fecha, f_hora = timestamp_pair()
             row = {
                 "id_lead": fid, "fecha_registro": f_fecha, "hora_registro": f_hora,
@@ -632,22 +362,61 @@ def page_leads():
                 "proxima_accion_fecha": prox_fecha.isoformat(),
                 "proxima_accion_desc": prox_desc,
                 "estado_color": "🟡","fecha_cambio_color": ts_now(),
-                "amarillo_contador": "1","historial_color": f"{ts_now()} | ∅ → 🟡",
+                "amarillo_contador": "1","historial_color": "",
                 "historial_atenciones": "","total_atenciones": "0",
             }
-            save_data(pd.concat([df, pd.DataFrame([row])], ignore_index=True))
+            commit_ops([{"op":"insert","row":row}])
+            append_events([make_event(fid, ts_now(), "color", detail="∅ → 🟡", de="∅", a="🟡")])
             st.success(f"✅ Lead creado: {fid}")
             st.experimental_rerun()
 
+    elif sub == "Importar":
+        st.subheader("📥 Importar (CSV / XLSX)")
+        st.caption("Exportaciones de campañas: se reconocen encabezados como nombre, apellidos, celular/phone, "
+                   "correo/email, interés/curso, canal/platform y fecha/created_time. Todo el archivo se guarda en una sola escritura.")
+        up = st.file_uploader("Archivo", type=["csv","xlsx"])
+        como_def = st.selectbox("🧭 Canal cuando el archivo no lo indica", CAT_COMO, index=0)
+        if up is not None and st.button("📥 Importar leads", use_container_width=True):
+            try:
+                with st.spinner("Importando…"):
+                    res = import_leads(up, up.name, st.session_state.user["name"], como_def, now=now_client())
+            except (ValueError, RuntimeError) as e:
+                st.error(f"No se pudo importar: {e}")
+            else:
+                if res["importados"]:
+                    st.success(f"✅ {res['importados']} leads importados ({res['ids'][0]} … {res['ids'][1]}) en {res['segundos']} s.")
+                else:
+                    st.warning("No se importó ningún lead.")
+                st.caption("Columnas reconocidas: " + ", ".join(f"{k} → {v}" for k, v in res["mapeo"].items()))
+                bad = res["rechazados"]
+                if not bad.empty:
+                    st.warning(f"⚠️ {len(bad)} filas rechazadas.")
+                    st.dataframe(bad.head(500), use_container_width=True, height=260)
+                    st.download_button("⬇️ Descargar filas rechazadas", bad.to_csv(index=False).encode("utf-8"),
+                                       file_name=f"rechazados_{up.name.rsplit('.', 1)[0]}.csv", mime="text/csv")
+
+    elif sub == "Duplicados":
+        st.subheader("🧬 Duplicados (mismo teléfono o correo)")
+        rep_df = dedup_report()
+        if rep_df.empty:
+            st.success("✅ No se encontraron leads duplicados."); return
+        st.caption(f"{rep_df['grupo'].nunique()} grupos · {len(rep_df)} leads. Al fusionar se conserva el id más antiguo "
+                   "(conservar = True), se completan sus campos vacíos y se le pasa el historial de los demás.")
+        st.dataframe(rep_df, use_container_width=True, height=420)
+        if st.button("🔗 Fusionar todos los grupos", use_container_width=True):
+            n = merge_all_duplicates(st.session_state.user["name"], ts_now())
+            st.success(f"✅ {n} leads duplicados fusionados.")
+            st.experimental_rerun()
+
     else:  # Editar
         st.subheader("✏️ Editar")
-        df = load_data()
+        df = load_data("lista")
         if df.empty:
             st.info("No hay leads."); return
         df["_label"] = "🧑 " + df["id_lead"].astype(str) + " | " + df["nombre/alias"].fillna("") + " " + df["apellidos"].fillna("")
         pick = st.selectbox("Lead", options=df["_label"].tolist())
         sel_id = pick.split(" | ")[0].replace("🧑","").strip()
-        rec = df[df["id_lead"].astype(str)==sel_id].iloc[0].to_dict()
+        rec = get_lead(sel_id) or df[df["id_lead"].astype(str)==sel_id].iloc[0].to_dict()  # ficha completa, solo este lead
 
         with st.form(f"form_edit_{sel_id}"):
             c1,c2,c3,c4 = st.columns(4)
@@ -673,8 +442,8 @@ def page_leads():
             prox_desc  = c11.text_input("📝 Descripción próxima acción", rec.get("proxima_accion_desc",""))
             ok = st.form_submit_button("Guardar cambios")
 
+        seen = seen_lead("editar", rec)
         if ok:
-            idx = df.index[df["id_lead"].astype(str) == sel_id][0]
             updates = {
                 "nombre/alias":nombre,"apellidos":apellidos,"genero":genero,"edad":str(edad).strip(),
                 "celular": clean_space_only(celular),
@@ -685,69 +454,83 @@ def page_leads():
                 "atendido_por":atendido_por_name,
                 "proxima_accion_fecha": prox_fecha.isoformat(),"proxima_accion_desc":prox_desc
             }
-            for k,v in updates.items(): df.loc[idx,k]=v
-            save_data(df)
-            st.success("💾 Lead actualizado.")
-            st.experimental_rerun()
+            sets = {k: v for k, v in updates.items() if str(v) != str(seen.get(k,"") or "")}
+            try:
+                write_lead(sel_id, lead_version(seen), {"set": sets}, base=seen)
+            except LeadConflictError as e:
+                forget_lead("editar"); load_data.clear()
+                conflict_error(e)
+            else:
+                forget_lead("editar")
+                st.success("💾 Lead actualizado.")
+                st.experimental_rerun()
 
 # ---------- Seguimiento ----------
 def filter_by_mode(base: pd.DataFrame, mode: str, ref: date | None = None) -> pd.DataFrame:
-    if mode == "Hoy": return base[base["_prox"].apply(lambda d: d is not None and d == today())]
+    if mode == "Hoy": return base[base["_prox"] == today()]
+    if mode == "Vencidos": return base[[d is not None and d < today() for d in base["_prox"]]]
     if mode == "Por fecha":
         if not isinstance(ref, date): return base.iloc[0:0].copy()
-        return base[base["_prox"].apply(lambda d: d is not None and d == ref)]
+        return base[base["_prox"] == ref]
     return base  # "Todos"
 
+@traced()
 def page_seguimiento():
     st.title("🎯 Seguimiento")
     st.caption("🟢 Won (Ganado) · 🟡 In progress (En curso) · 🔴 Lost (Perdido)")
 
-    base_all = enrich(load_data())
-    if base_all.empty:
-        st.info("No hay leads."); return
-
-    cnt = base_all["estado_color"].value_counts()
+    # Con la cola del mantenimiento al día, Hoy/Vencidos y los totales salen de ella sin enriquecer
+    # toda la tabla; si no hay cola (o quedó vieja) se recalcula como siempre.
+    q = current_queue(today())
+    base_all = None
+    if q is not None:
+        cnt = q["colors"]
+        if not sum(cnt.values()):
+            st.info("No hay leads."); return
+    else:
+        base_all = enrich(load_data("lista"))
+        if base_all.empty:
+            st.info("No hay leads."); return
+        cnt = base_all["estado_color"].value_counts()
     tot_md = f"**Totales — 🟢 {cnt.get('🟢',0)} · 🟡 {cnt.get('🟡',0)} · 🔴 {cnt.get('🔴',0)}**"
     _, right = st.columns([3,1])
     with right:
         st.markdown(f"<div style='text-align:right'>{tot_md}</div>", unsafe_allow_html=True)
 
-    vista = st.radio("Vista:", ["Hoy","Por fecha","Todos"], horizontal=True)
+    if q is not None:
+        mine = q["owners"].get(st.session_state.user["name"], {})
+        st.caption(f"📬 Tu cola de hoy: {len(mine.get('today', []))} hoy · {len(mine.get('overdue', []))} vencidos "
+                   f"(mantenimiento {q['at']})")
+
+    vista = st.radio("Vista:", ["Hoy","Vencidos","Por fecha","Todos"], horizontal=True)
     fecha_sel = st.date_input("Selecciona fecha", value=today()) if vista=="Por fecha" else None
-    df = filter_by_mode(base_all, vista, fecha_sel)
+    if q is not None and vista in ("Hoy","Vencidos"):
+        df = enrich(load_rows(queue_ids(q, "today" if vista == "Hoy" else "overdue")))
+    else:
+        if base_all is None: base_all = enrich(load_data("lista"))
+        df = filter_by_mode(base_all, vista, fecha_sel)
 
+    qlist = ""
     if vista == "Todos":
         qlist = st.text_input("Filtro rápido (nombre / correo / teléfono):").strip().lower()
         if qlist:
-            q_norm = qlist.replace(" ", "")
-            def _match_row_fast(r):
-                campos_texto = [
-                    str(r.get("nombre/alias","")).lower(),
-                    str(r.get("apellidos","")).lower(),
-                    str(r.get("correo","")).lower(),
-                ]
-                cel_norm = clean_space_only(str(r.get("celular",""))).lower()
-                tel_norm = clean_space_only(str(r.get("telefono",""))).lower()
-                return (
-                    any(qlist in campo for campo in campos_texto) or
-                    (q_norm and (q_norm in cel_norm or q_norm in tel_norm))
-                )
-            df = df[df.apply(_match_row_fast, axis=1)]
+            rank = {lid: i for i, lid in enumerate(search_ids(qlist))}
+            df = df[df["id_lead"].astype(str).isin(rank)]
+            df = df.iloc[df["id_lead"].astype(str).map(rank).argsort()]  # mejor coincidencia primero
 
     left, right = st.columns([1,2], gap="large")
     with left:
         st.subheader("👥 Lista")
-        sel = ui_lead_radio(df)
+        sel = ui_lead_list(df, ranked=bool(vista == "Todos" and qlist), scope=(vista, str(fecha_sel or ""), qlist))
         if sel: set_selected(sel)
 
     with right:
         st.subheader("⚡ Acción rápida")
-        base3 = load_data()  # trabajar sobre CSV real
-        ids = base3["id_lead"].astype(str).tolist()
-        if st.session_state.selected_lead_id not in ids:
+        rec = get_lead(st.session_state.selected_lead_id) if st.session_state.selected_lead_id else None
+        if rec is None:
             st.info("Selecciona un lead en la lista."); return
-        i3 = base3.index[base3["id_lead"].astype(str)==st.session_state.selected_lead_id][0]
-        row = base3.loc[i3]
+        row = pd.Series(rec)  # solo el lead seleccionado (lectura por id en el backend)
+        seen = seen_lead("seguimiento", rec)
 
         c1,c2,c3 = st.columns(3)
         with c1:
@@ -810,30 +593,35 @@ def page_seguimiento():
             if manual_date: next_date = manual_date
             if manual_desc and manual_desc.strip(): next_desc = manual_desc.strip()
 
-            old = str(base3.loc[i3,"estado_color"] or "")
-            base3 = add_attention(base3, i3, old, new_color, nota_final, usuario)
-            updates = {
+            old = str(seen.get("estado_color","") or "")
+            patch, events = add_attention(row["id_lead"], old, new_color, nota_final, usuario)
+            patch["set"].update({
                 "estado_color":new_color,"funnel_etapas":new_stage,
                 "proxima_accion_fecha": next_date.isoformat() if next_date else "",
                 "proxima_accion_desc": next_desc or "",
                 "fecha_ultimo_contacto": today().isoformat(),
                 "atendido_por":usuario
-            }
-            for k,v in updates.items(): base3.loc[i3,k]=v
+            })
             if nota_final:
-                obs = str(base3.loc[i3,"observaciones"] or "")
-                base3.loc[i3,"observaciones"] = (obs + ("\n" if obs else "") + f"{ts_now()} | {usuario or 'sin usuario'} | {nota_final}")
+                events.append(make_event(row["id_lead"], ts_now(), "observacion", usuario or "sin usuario", nota_final))
 
-            base3 = heal_and_persist(base3)
-            save_data(base3)
-            st.success("✅ Seguimiento actualizado.")
-            st.experimental_rerun()
+            # Color y etapa ya quedan consistentes (🟢↔Won, 🔴↔Lost): basta persistir este lead
+            try:
+                write_lead(row["id_lead"], lead_version(seen), patch, base=seen)
+            except LeadConflictError as e:
+                forget_lead("seguimiento"); load_data.clear()
+                conflict_error(e)
+            else:
+                forget_lead("seguimiento")
+                append_events(events)
+                st.success("✅ Seguimiento actualizado.")
+                st.experimental_rerun()
 
         st.markdown("---")
         if st.toggle("👀 Mostrar historial completo del lead", value=False, key=f"h_{row['id_lead']}"):
-            info = load_data(); info = info[info["id_lead"].astype(str)==st.session_state.selected_lead_id]
-            if not info.empty:
-                rf = info.iloc[0]
+            info = get_lead(st.session_state.selected_lead_id)
+            if info:
+                rf = pd.Series(info)
                 # >>>>>>>>>>>>>> CAMBIO AQUÍ: mostrar hora_registro en la ficha <<<<<<<<<<<<<<
                 ficha = rf[["id_lead","nombre/alias","apellidos","atendido_por","funnel_etapas",
                             "estado_color","total_atenciones","amarillo_contador",
@@ -847,12 +635,10 @@ def page_seguimiento():
                     st.dataframe(dfh, use_container_width=True, height=520)
 
 # ---------- Dashboard ----------
-def _explode_intereses(df):
-    if df.empty: return df.iloc[0:0].copy()
-    tmp = df[["id_lead","interes_curso(puede sellecionar varios)"]].copy()
-    tmp["interes"] = tmp["interes_curso(puede sellecionar varios)"].apply(lambda s: [x for x in str_to_list(s) if x])
-    tmp = tmp.explode("interes")
-    return tmp[tmp["interes"].notna() & (tmp["interes"]!="")]
+
+def _chart(target, ch):
+    with span("altair"):
+        target.altair_chart(ch, use_container_width=True)
 
 def _bar(df, x, y, color_field=None, domain=None, range_colors=None, title="", h=220):
     enc = dict(x=alt.X(x, sort='-y'), y=alt.Y(y), tooltip=[x, y])
@@ -860,22 +646,29 @@ def _bar(df, x, y, color_field=None, domain=None, range_colors=None, title="", h
         enc["color"] = alt.Color(color_field, scale=alt.Scale(domain=domain, range=range_colors), legend=None)
     return alt.Chart(df).mark_bar().encode(**enc).properties(height=h, title=title)
 
+def _counts_df(d: dict, key: str, val: str = "qty") -> pd.DataFrame:
+    out = pd.DataFrame(list(d.items()), columns=[key, val])
+    return out.sort_values(val, ascending=False, kind="stable").reset_index(drop=True)
+
+@traced()
 def page_dashboard():
     st.title("📊 Dashboard / Tablero")
+    st.session_state.live_view = True  # solo lectura: los cambios de otros se muestran solos
 
-    df = enrich(load_data())
-    if df.empty:
+    agg = get_aggregates()  # cuesta O(cubetas), no O(leads)
+    if not agg["total"]:
         st.info("No hay datos.")
         return
 
-    total=len(df)
-    won=((df["funnel_etapas"]=="Won (Ganado)") | (df["funnel_etapas"]=="Ganado")).sum()
-    lost=((df["funnel_etapas"]=="Lost (Perdido)") | (df["funnel_etapas"]=="Perdido")).sum()
-    in_prog= total-won-lost
-    hoy = df["_prox"].apply(lambda d:d==today()).sum()
-    venc = df["_prox"].apply(lambda d: d is not None and d<today()).sum()
-    sinp = df["_prox"].isna().sum()
-    prom_att = pd.to_numeric(df["total_atenciones"].replace("", "0")).mean().round(2)
+    hoy_iso = today().isoformat()
+    total = agg["total"]
+    won = agg["stage"].get("Won (Ganado)", 0)
+    lost = agg["stage"].get("Lost (Perdido)", 0)
+    in_prog = total-won-lost
+    hoy = agg["prox"].get(hoy_iso, 0)
+    venc = sum(n for d, n in agg["prox"].items() if d and d < hoy_iso)
+    sinp = agg["prox"].get("", 0)
+    prom_att = round(agg["touches_total"] / max(total, 1), 2)
 
     c1,c2,c3,c4,c5,c6 = st.columns(6)
     c1.metric("👥 Leads (Total)", total)
@@ -887,87 +680,79 @@ def page_dashboard():
     st.caption(f"📭 Sin próxima acción: {sinp} • 🧮 Promedio de atenciones/lead: {prom_att}")
     st.markdown("---")
 
-    etapas = df["funnel_etapas"].replace("", "Contacted (Contactado)").replace({
-        "Ganado":"Won (Ganado)","Perdido":"Lost (Perdido)","Contactado":"Contacted (Contactado)"
-    }).value_counts().rename_axis("stage").reset_index(name="qty")
+    etapas = _counts_df(agg["stage"], "stage")
     dom_all = [e for e in STAGE_COLORS.keys() if e in etapas["stage"].tolist()]
     rng_all = [STAGE_COLORS[k] for k in dom_all]
     ch_etapas = _bar(etapas, "stage:N","qty:Q","stage:N", dom_all, rng_all, "Funnel stages (Etapas del embudo)")
-    st.altair_chart(ch_etapas, use_container_width=True)
-
-    amar = df.copy()
-    amar["funnel_etapas"] = amar["funnel_etapas"].replace({
-        "Ganado":"Won (Ganado)","Perdido":"Lost (Perdido)","Contactado":"Contacted (Contactado)"
-    })
-    amar = amar[amar["funnel_etapas"].isin(FUNNEL_YELLOW)]
-    if not amar.empty:
-        etapas_y = amar["funnel_etapas"].value_counts().rename_axis("stage").reset_index(name="qty")
+    _chart(st, ch_etapas)
+
+    etapas_y = etapas[etapas["stage"].isin(FUNNEL_YELLOW)]
+    if not etapas_y.empty:
         dom_y = [e for e in FUNNEL_YELLOW if e in etapas_y["stage"].tolist()]
         rng_y = [STAGE_COLORS[k] for k in dom_y]
         ch_y = _bar(etapas_y, "stage:N","qty:Q","stage:N", dom_y, rng_y, "Yellow-state detail (Detalle 🟡)")
-        st.altair_chart(ch_y, use_container_width=True)
+        _chart(st, ch_y)
     st.markdown("---")
 
-    r0,r1 = today()-timedelta(days=30), today()
-    df30 = df[(df["_reg"]>=r0) & (df["_reg"]<=r1)].copy()
+    r0,r1 = (today()-timedelta(days=30)).isoformat(), hoy_iso
+    reg30 = [(d, n, w) for d, (n, w) in agg["reg"].items() if r0 <= d <= r1]
+    df30 = pd.DataFrame(reg30, columns=["_reg","id_lead","won"]).sort_values("_reg")
+    df30["_reg"] = pd.to_datetime(df30["_reg"]).dt.date
     a,b,c = st.columns(3)
 
-    reg = df30.groupby("_reg")["id_lead"].count().reset_index()
+    reg = df30[["_reg","id_lead"]]
     a.subheader("🗓️ Leads nuevos (30 días)")
     if not reg.empty:
         ch_reg = alt.Chart(reg).mark_line(point=True).encode(x="_reg:T", y="id_lead:Q").properties(height=200)
-        a.altair_chart(ch_reg, use_container_width=True)
+        _chart(a, ch_reg)
     else:
         a.info("Sin datos")
 
-    prox = df.dropna(subset=["_prox"]).groupby("_prox")["id_lead"].count().reset_index()
+    prox = pd.DataFrame([(d, n) for d, n in sorted(agg["prox"].items()) if d], columns=["_prox","id_lead"])
+    prox["_prox"] = pd.to_datetime(prox["_prox"]).dt.date
     b.subheader("📅 Próximas acciones")
     if not prox.empty:
         ch_prox = _bar(prox,"_prox:T","id_lead:Q", title="")
-        b.altair_chart(ch_prox, use_container_width=True)
+        _chart(b, ch_prox)
     else:
         b.info("Sin datos")
 
-    canal = df["como_enteraste"].replace("", "No indicado").value_counts().rename_axis("channel").reset_index(name="qty")
+    canal = _counts_df(agg["channel"], "channel")
     c.subheader("🧭 Canales de adquisición")
     if not canal.empty:
         ch_canal = _bar(canal,"channel:N","qty:Q", title="")
-        c.altair_chart(ch_canal, use_container_width=True)
+        _chart(c, ch_canal)
     else:
         c.info("Sin datos")
 
     st.markdown("---")
 
     d,e,f = st.columns(3)
-    users = (pd.DataFrame({"user": df["atendido_por"].replace("", "Sin asignar"),
-                           "touches": pd.to_numeric(df["total_atenciones"].replace("", "0"))})
-             .groupby("user", dropna=False)["touches"].sum().sort_values(ascending=False).reset_index())
+    users = _counts_df({u: agg["touches"].get(u, 0) for u in agg["owner"]}, "user", "touches")
     d.subheader("👨‍💼 Atenciones por responsable")
     if not users.empty:
         ch_users = _bar(users,"user:N","touches:Q", title="")
-        d.altair_chart(ch_users, use_container_width=True)
+        _chart(d, ch_users)
     else:
         d.info("Sin datos")
 
     e.subheader("📈 Conversión semanal")
     if not df30.empty:
-        conv = df30.assign(week=df30["_reg"].apply(lambda d: pd.to_datetime(d).to_period("W").start_time))
-        conv = conv.groupby("week").apply(
-            lambda g: ((g["funnel_etapas"]=="Won (Ganado)") | (g["funnel_etapas"]=="Ganado")).sum()/len(g)
-        ).reset_index(name="rate")
+        conv = df30.assign(week=pd.to_datetime(df30["_reg"]).dt.to_period("W").dt.start_time)
+        conv = conv.groupby("week")[["won","id_lead"]].sum()
+        conv = (conv["won"] / conv["id_lead"]).reset_index(name="rate")
         ch_conv = alt.Chart(conv).mark_line(point=True).encode(
             x="week:T", y=alt.Y("rate:Q", axis=alt.Axis(format='%'))
         ).properties(height=200)
-        e.altair_chart(ch_conv, use_container_width=True)
+        _chart(e, ch_conv)
     else:
         e.info("Sin datos")
 
-    inter = _explode_intereses(df)
+    top = _counts_df(agg["interest"], "interest")
     f.subheader("📚 Intereses (Top)")
-    if not inter.empty:
-        top = inter["interes"].value_counts().rename_axis("interest").reset_index(name="qty")
+    if not top.empty:
         ch_inter = _bar(top, "interest:N", "qty:Q", title="")
-        f.altair_chart(ch_inter, use_container_width=True)
+        _chart(f, ch_inter)
     else:
         f.info("Sin datos")
 
@@ -976,7 +761,7 @@ def page_dashboard():
     t1,t2 = st.columns(2)
     etapas_tbl = etapas.copy(); etapas_tbl["color_hex"] = etapas_tbl["stage"].map(STAGE_COLORS).fillna("#999")
     t1.markdown("**Por etapa**"); t1.dataframe(etapas_tbl, use_container_width=True, height=240)
-    resp_tbl = df["atendido_por"].replace("","Sin asignar").value_counts().rename_axis("owner").reset_index(name="qty")
+    resp_tbl = _counts_df(agg["owner"], "owner")
     t2.markdown("**Por responsable**"); t2.dataframe(resp_tbl, use_container_width=True, height=240)
 
     t3,t4 = st.columns(2)
@@ -990,6 +775,49 @@ def page_dashboard():
                              "Tasa de conversión":[round(won/max(total,1),3)]})
     st.dataframe(conv_gen, use_container_width=True, height=120)
 
+    st.markdown("---")
+    st.subheader("📆 Cohortes de registro (conversión por periodo)")
+    k1,k2,k3 = st.columns([2,1,1])
+    rango = k1.date_input("Rango de registro", value=(today()-timedelta(days=365), today()), key="coh_rango")
+    gran = k2.selectbox("Granularidad", list(COHORT_FREQS), index=2, key="coh_gran")
+    grp = k3.selectbox("Agrupar por", list(COHORT_GROUPS), index=0, key="coh_grp")
+    if isinstance(rango, (tuple, list)) and len(rango) == 2:
+        coh = cohort_table(data_version(), rango[0], rango[1], COHORT_FREQS[gran], COHORT_GROUPS[grp])
+        if coh.empty:
+            st.info("Sin registros en el rango.")
+        else:
+            enc = dict(x=alt.X("periodo:T", title=gran), y=alt.Y("conversion:Q", axis=alt.Axis(format='%')),
+                       tooltip=list(coh.columns))
+            if "grupo" in coh.columns: enc["color"] = alt.Color("grupo:N")
+            _chart(st, alt.Chart(coh).mark_line(point=True).encode(**enc).properties(height=260))
+            st.dataframe(coh, use_container_width=True, height=280)
+
+    if st.session_state.user["role"] in ("Admin","Director"):
+        with st.expander("🧮 Agregados (verificación)", expanded=False):
+            if st.button("Verificar contra recálculo completo"):
+                diff = check_aggregates()
+                if diff:
+                    st.warning(f"Diferencias en: {', '.join(diff)}. Se reconstruyeron los agregados.")
+                    rebuild_aggregates()
+                else:
+                    st.success("✅ Agregados consistentes con la tabla.")
+
+# ===================== Cambios de otros usuarios =====================
+# Cada rerun completo anota la versión de datos al terminar (ya con los guardados de la propia
+# sesión); este fragmento (un stat) la revisa cada WATCH_SECONDS sin correr el resto de la página.
+# Si se movió: en vistas de solo lectura se rerunea la app; con un formulario abierto solo se avisa,
+# para no perder lo que se está escribiendo.
+def watch_data():
+    seen = st.session_state.get("data_seen")
+    if seen is None or data_version() == seen: return
+    if st.session_state.get("live_view"): st.rerun()
+    st.caption("🔄 Otro usuario guardó cambios.")
+    if st.button("Actualizar", key="watch_refresh", use_container_width=True):
+        st.rerun()
+
+if WATCH_SECONDS > 0:
+    watch_data = st.experimental_fragment(run_every=WATCH_SECONDS)(watch_data)
+
 # ===================== Login Page =====================
 def page_login():
     st.title("🔐 Inicio de sesión")
@@ -1007,26 +835,49 @@ def page_login():
             st.error("Usuario o contraseña incorrectos.")
 
 # ===================== Router con sesión =====================
-ensure_users_csv()
-ensure_csv()
-df_boot = heal_and_persist(load_data())
-daily_backup()  # AUTO diario: CSVs + snapshot equivalente a export
-
-if "user" not in st.session_state:
-    page_login()
-else:
-    with st.sidebar:
-        st.markdown(f"**👤 {st.session_state.user['name']}**  \n`{st.session_state.user['role']}`")
-        if st.button("Cerrar sesión", use_container_width=True):
-            logout()
-            st.rerun()
-        st.markdown("---")
-        page = st.radio("Ir a:", ["🧑‍💼 Leads","🎯 Seguimiento","📊 Dashboard / Tablero"], index=0)
-        st.caption("CSV: data/leads.csv • data/users.csv • data/exports/*.csv • data/backups/*.csv")
-
-    if page.startswith("🧑‍💼"):
-        page_leads()
-    elif page.startswith("🎯"):
-        page_seguimiento()
-    else:
-        page_dashboard()
+def main():
+    with trace_rerun(page="login"):
+        bootstrap()
+        st.session_state.data_seen, st.session_state.live_view = data_version(), False
+        if "user" not in st.session_state:
+            page_login()
+            return
+        with st.sidebar:
+            st.markdown(f"**👤 {st.session_state.user['name']}**  \n`{st.session_state.user['role']}`")
+            if st.button("Cerrar sesión", use_container_width=True):
+                logout()
+                st.rerun()
+            st.markdown("---")
+            page = st.radio("Ir a:", ["🧑‍💼 Leads","🎯 Seguimiento","📊 Dashboard / Tablero"], index=0)
+            trace_tag(page=page.split(" ", 1)[1], user=st.session_state.user["name"])
+            watch_data()
+            st.caption("CSV: data/leads.csv • data/users.csv • data/exports/*.csv • data/backups/objects/*.gz")
+            if st.session_state.user["role"] == "Admin":
+                with st.expander("⚙️ Arranque (último por paso)", expanded=False):
+                    for name, t in bootstrap_timings().items():
+                        st.caption(f"{name}: {t['ms']} ms · {t['at']}")
+                    bk = backup_status()
+                    if bk["running"]: st.caption("💾 Respaldo en curso…")
+                    elif bk["error"]: st.caption(f"💾 Respaldo con error: {bk['error']}")
+                    elif bk["last"]: st.caption(f"💾 Respaldo {bk['last']['at']} · nuevos: {', '.join(bk['last']['new']) or 'ninguno (sin cambios)'}")
+                with st.expander("⏱️ Rendimiento (trazas por rerun)", expanded=False):
+                    if st.checkbox("Ver p50/p95 por span", key="trace_panel"):
+                        per, slow = trace_summary(read_traces())
+                        st.dataframe(per, use_container_width=True, hide_index=True)
+                        st.caption("Reruns más lentos (recientes)")
+                        st.dataframe(slow, use_container_width=True, hide_index=True)
+
+        if page.startswith("🧑‍💼"):
+            page_leads()
+        elif page.startswith("🎯"):
+            page_seguimiento()
+        else:
+            page_dashboard()
+        # Tras la página: sus propios guardados (Importar, atención sin rerun…) no cuentan como ajenos
+        st.session_state.data_seen = data_version()
+
+if runtime.exists():       # `streamlit run app_streamlit.py`
+    main()
+elif __name__ == "__main__":  # `python app_streamlit.py importar leads.csv` (igual que `python -m crm importar …`)
+    from crm.cli import cli
+    raise SystemExit(cli())
@@ -0,0 +1,60 @@
+# crm — núcleo del CRM de Leads sin interfaz (almacenamiento, reglas, historial, agregados)
+# ──────────────────────────────────────────────────────────────────────────────
+# `import crm` no importa pandas ni Streamlit, no crea carpetas y no lee datos: cada nombre se
+# resuelve al primer acceso desde su submódulo (`crm.compute_color` → crm.domain). La UI
+# (app_streamlit.py), la CLI (`python -m crm …`) y los scripts usan las mismas funciones.
+#   crm.config      rutas, variables de entorno y reloj (set_clock)
+#   crm.tracing     spans por rerun y lock de archivo
+#   crm.domain      catálogos, fechas, color/etapa, OUTCOME_RULES, eventos (puro, sin E/S)
+#   crm.schema      tabla tipada en memoria (category / Int64 / datetime64) y vuelta a texto
+#   crm.storage     backends CSV/SQLite, bitácora, escrituras por lead, secuencia de ids
+#   crm.search      índice de trigramas, llaves de duplicado, filtros
+#   crm.aggregates  agregados del dashboard y cohortes
+#   crm.history     historial heredado + almacén de eventos
+#   crm.maintenance mantenimiento nocturno: recolor por bloques y colas del día por responsable
+#   crm.bench       benchmark con leads sintéticos y paridad de enrich (vectorizado vs. fila por fila)
+#   crm.dedup / crm.importer / crm.backup / crm.users / crm.boot / crm.cli
+# ──────────────────────────────────────────────────────────────────────────────
+from __future__ import annotations
+import importlib
+
+_EXPORTS = {
+    "config": ("BASE_DIR", "DATA_DIR", "DATA_PATH", "USERS_PATH", "STORAGE_BACKEND", "set_clock", "now", "today",
+               "ts_now", "timestamp_pair"),
+    "tracing": ("span", "traced", "trace_rerun", "trace_tag", "read_traces", "trace_summary", "file_lock"),
+    "domain": ("COLUMNS_BASE", "COLUMNS_EXTRA", "CAT_CURSOS", "CAT_COMO", "FUNNEL_YELLOW", "STAGE_DESC", "STAGE_COLORS",
+               "CONTACT_OUTCOMES", "OUTCOME_RULES", "parse_date_safe", "parse_dates_vec", "str_to_list", "list_to_str",
+               "clean_space_only", "fold_text", "digits_only", "format_lead_id", "max_lead_number", "make_event",
+               "etapa_is_won", "etapa_is_lost", "compute_color", "compute_colors", "recolor_targets", "enrich",
+               "add_attention", "apply_outcome", "STALE_DAYS", "PROJECTIONS", "HEAVY_COLUMNS"),
+    "storage": ("CsvLeadStore", "SqliteLeadStore", "get_store", "ensure_csv", "compact_journal", "migrate_csv_to_sqlite",
+                "LeadConflictError", "lead_version", "commit_ops", "insert_leads", "write_lead", "data_version",
+                "get_lead", "load_data", "load_rows", "load_typed", "save_data", "allocate_lead_ids", "peek_lead_id",
+                "heal_and_persist"),
+    "schema": ("CATEGORY_COLUMNS", "DATE_COLUMNS", "to_typed", "to_strings", "is_typed"),
+    "search": ("LeadSearchIndex", "get_search_index", "search_ids", "find_duplicates", "FILTER_COLORS", "apply_filters"),
+    "aggregates": ("build_aggregates", "get_aggregates", "rebuild_aggregates", "check_aggregates", "compute_cohorts"),
+    "history": ("EVENT_TYPES", "history_df", "read_events", "append_events", "migrate_history_to_events"),
+    "dedup": ("dedup_report", "merge_leads", "merge_all_duplicates"),
+    "importer": ("import_mapping", "import_leads"),
+    "maintenance": ("run_maintenance", "read_queue", "current_queue", "queue_ids"),
+    "backup": ("EXPORT_FORMATS", "export_table", "export_snapshot_to_file", "run_backup", "verify_backups",
+               "restore_backup", "start_backup_worker", "backup_status"),
+    "users": ("load_users", "try_login"),
+    "boot": ("bootstrap", "bootstrap_timings"),
+    "bench": ("synthetic_leads", "bench_run", "run_benchmarks", "enrich_reference", "enrich_parity", "run_parity"),
+    "cli": ("cli",),
+}
+_WHERE = {name: mod for mod, names in _EXPORTS.items() for name in names}
+__all__ = sorted(_WHERE)
+
+def __getattr__(name: str):
+    mod = _WHERE.get(name)
+    if mod is None:
+        raise AttributeError(f"module 'crm' has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{mod}", __name__), name)
+    globals()[name] = value  # siguientes accesos sin pasar por aquí
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,4 @@
+# `python -m crm importar leads.csv` / `respaldo` / `duplicados` / `bench` …
+from .cli import cli
+
+raise SystemExit(cli())
@@ -0,0 +1,180 @@
+# crm/aggregates.py — agregados del dashboard y cohortes
+from __future__ import annotations
+import functools
+import json
+import threading
+from datetime import date
+
+import pandas as pd
+
+from .config import SNAPSHOT_DIR
+from .domain import PROJECTIONS, parse_date_safe, str_to_list, _to_int
+from .schema import to_typed
+from .storage import data_version, get_store, load_typed, _row_transitions, _version_key
+from .tracing import traced, file_lock
+
+# ===================== Agregados del dashboard (materializados) =====================
+# Contadores por cubeta (etapa, canal, responsable, fecha de registro, próxima acción, interés) en
+# data/.snapshots/aggregates.json. Cada escritura por lead aplica el delta (resta la fila anterior,
+# suma la nueva); un guardado completo o una versión desconocida reconstruye desde la tabla.
+AGG_PATH = SNAPSHOT_DIR / "aggregates.json"
+AGG_STAGE_ALIASES = {"": "Contacted (Contactado)", "Ganado": "Won (Ganado)", "Perdido": "Lost (Perdido)", "Contactado": "Contacted (Contactado)"}
+WON_STAGES = {"Won (Ganado)", "Ganado"}
+
+def _agg_empty() -> dict:
+    return {"version": None, "total": 0, "touches_total": 0, "stage": {}, "channel": {}, "owner": {},
+            "touches": {}, "reg": {}, "prox": {}, "interest": {}}
+
+def _bump(d: dict, key, delta):
+    v = d.get(key, 0) + delta
+    if v: d[key] = v
+    else: d.pop(key, None)
+
+def _agg_add_row(agg: dict, r: dict, sign: int):
+    etapa = str(r.get("funnel_etapas","") or "")
+    owner = str(r.get("atendido_por","") or "") or "Sin asignar"
+    touches = _to_int(r.get("total_atenciones"))
+    agg["total"] += sign
+    agg["touches_total"] += sign * touches
+    _bump(agg["stage"], AGG_STAGE_ALIASES.get(etapa, etapa), sign)
+    _bump(agg["channel"], str(r.get("como_enteraste","") or "") or "No indicado", sign)
+    _bump(agg["owner"], owner, sign)
+    _bump(agg["touches"], owner, sign * touches)
+    reg = parse_date_safe(r.get("fecha_registro",""))
+    if reg:
+        cell = agg["reg"].setdefault(reg.isoformat(), [0, 0])
+        cell[0] += sign
+        cell[1] += sign * (etapa in WON_STAGES)
+        if cell == [0, 0]: agg["reg"].pop(reg.isoformat())
+    prox = parse_date_safe(r.get("proxima_accion_fecha",""))
+    _bump(agg["prox"], prox.isoformat() if prox else "", sign)
+    for it in str_to_list(r.get("interes_curso(puede sellecionar varios)","")):
+        _bump(agg["interest"], it, sign)
+
+def _counts(s: pd.Series, blank: str = "", alias: dict | None = None) -> dict:
+    # value_counts sobre los códigos de la categoría; los alias/vacíos se fusionan ya sobre las cubetas
+    out = {}
+    for k, v in s.value_counts(sort=False).items():
+        if not v: continue
+        k = (alias or {}).get(k, k) or blank
+        out[k] = out.get(k, 0) + int(v)
+    return out
+
+def build_aggregates(df: pd.DataFrame) -> dict:
+    # Reconstrucción completa sobre la tabla tipada (misma semántica que _agg_add_row)
+    agg = _agg_empty()
+    if df.empty: return agg
+    df = to_typed(df)
+    etapa, owner = df["funnel_etapas"], df["atendido_por"]
+    touches = df["total_atenciones"].fillna(0)
+    agg["total"] = int(len(df))
+    agg["touches_total"] = int(touches.sum())
+    agg["stage"] = _counts(etapa, alias=AGG_STAGE_ALIASES)
+    agg["channel"] = _counts(df["como_enteraste"], "No indicado")
+    agg["owner"] = _counts(owner, "Sin asignar")
+    for k, v in touches.groupby(owner, observed=True).sum().items():
+        if v: agg["touches"][k or "Sin asignar"] = agg["touches"].get(k or "Sin asignar", 0) + int(v)
+    reg = df["fecha_registro"]
+    won = etapa.isin(WON_STAGES)
+    g = won[reg.notna()].groupby(reg[reg.notna()]).agg(["size","sum"])
+    agg["reg"] = {k.date().isoformat(): [int(n), int(w)] for k, (n, w) in g.iterrows()}
+    prox = df["proxima_accion_fecha"].value_counts(dropna=False)
+    agg["prox"] = {("" if pd.isna(k) else k.date().isoformat()): int(v) for k, v in prox.items()}
+    for combo, n in df["interes_curso(puede sellecionar varios)"].value_counts(sort=False).items():
+        for it in str_to_list(combo):
+            if n: agg["interest"][it] = agg["interest"].get(it, 0) + int(n)
+    return agg
+
+@functools.cache
+def _agg_holder() -> dict:
+    return {"lock": threading.Lock(), "agg": None}
+
+def _agg_save(agg: dict):
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = AGG_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(agg, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(AGG_PATH)
+
+def _agg_load() -> dict | None:
+    try:
+        return json.loads(AGG_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def rebuild_aggregates(df: pd.DataFrame | None = None) -> dict:
+    holder = _agg_holder()
+    with holder["lock"], file_lock(AGG_PATH):
+        ver = _version_key(data_version())
+        agg = build_aggregates(load_typed("dashboard") if df is None else df)
+        agg["version"] = ver
+        _agg_save(agg)
+        holder["agg"] = agg
+    return agg
+
+@traced()
+def get_aggregates() -> dict:
+    holder = _agg_holder()
+    ver = _version_key(data_version())
+    agg = holder["agg"]
+    if agg is not None and agg["version"] == ver: return agg
+    agg = _agg_load()
+    if agg is not None and agg.get("version") == ver:
+        holder["agg"] = agg
+        return agg
+    return rebuild_aggregates()
+
+def check_aggregates() -> dict:
+    """Compara los contadores incrementales contra una reconstrucción completa (sin guardar)."""
+    cur = get_aggregates()
+    fresh = build_aggregates(get_store().read(PROJECTIONS["dashboard"]))
+    return {k: {"incremental": cur.get(k), "completo": fresh[k]} for k in fresh if k != "version" and cur.get(k) != fresh[k]}
+
+def _agg_after_write(ops: list[dict], olds: dict, prev_version, new_version):
+    # `olds`: filas antes de la escritura. El delta solo vale si los agregados están al día con la
+    # versión previa; si no, se reconstruyen en la próxima lectura.
+    holder = _agg_holder()
+    with holder["lock"], file_lock(AGG_PATH):
+        agg = _agg_load()
+        if agg is None or agg.get("version") != _version_key(prev_version): return
+        for old, new in _row_transitions(ops, olds):
+            if old is not None: _agg_add_row(agg, old, -1)
+            if new is not None: _agg_add_row(agg, new, +1)
+        agg["version"] = _version_key(new_version)
+        _agg_save(agg)
+        holder["agg"] = agg
+
+# ===================== Cohortes / conversión por periodo =====================
+# Registros, ganados, perdidos y tasa de conversión por día/semana/mes de registro, con
+# agrupación opcional (canal, responsable, interés). Una sola agregación agrupada por columnas;
+# la UI cachea el resultado por (versión de datos, rango, granularidad, agrupación).
+COHORT_FREQS  = {"Día": "D", "Semana": "W", "Mes": "M"}
+COHORT_GROUPS = {"(sin agrupar)": None, "Canal": "como_enteraste", "Responsable": "atendido_por", "Interés": "interes"}
+LOST_STAGES   = {"Lost (Perdido)", "Perdido"}
+
+@traced()
+def compute_cohorts(df: pd.DataFrame, start: date, end: date, freq: str = "W", by: str | None = None) -> pd.DataFrame:
+    cols = ["periodo"] + (["grupo"] if by else []) + ["registros","ganados","perdidos","conversion"]
+    if df.empty: return pd.DataFrame(columns=cols)
+    df = to_typed(df)
+    reg = df["fecha_registro"]
+    inside = reg.notna() & (reg >= pd.Timestamp(start)) & (reg <= pd.Timestamp(end))
+    if not inside.any(): return pd.DataFrame(columns=cols)
+    etapa = df.loc[inside, "funnel_etapas"]
+    work = pd.DataFrame({
+        "periodo": reg[inside].dt.to_period(freq).dt.start_time,
+        "won": etapa.isin(WON_STAGES),
+        "lost": etapa.isin(LOST_STAGES),
+    })
+    keys = ["periodo"]
+    if by == "interes":
+        work["grupo"] = df.loc[inside, "interes_curso(puede sellecionar varios)"].astype(str).str.split("|")
+        work = work.explode("grupo")
+        work["grupo"] = work["grupo"].str.strip().replace("", "No indicado")
+        keys.append("grupo")
+    elif by:
+        blank = "Sin asignar" if by == "atendido_por" else "No indicado"
+        work["grupo"] = df.loc[inside, by].astype(str).replace("", blank)
+        keys.append("grupo")
+    out = work.groupby(keys, sort=True, observed=True).agg(registros=("won","size"), ganados=("won","sum"), perdidos=("lost","sum")).reset_index()
+    out["conversion"] = (out["ganados"] / out["registros"]).round(4)
+    return out[cols]
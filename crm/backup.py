@@ -0,0 +1,198 @@
+# crm/backup.py — exportaciones y respaldo diario
+from __future__ import annotations
+import functools
+import gzip
+import hashlib
+import io
+import json
+import shutil
+import threading
+from datetime import datetime, date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from .config import DATA_DIR, DATA_PATH, USERS_PATH, EVENTS_PATH, BACKUP_DIR, EXPORT_DIR, now
+from .domain import enrich
+from .search import apply_filters
+from .storage import pa, get_store, _normalize_columns, _file_digest
+from .tracing import traced, file_lock
+
+# ===================== Exportaciones (snapshot = “Exportar/respaldar CSV”) =====================
+# El archivo de descarga se genera solo cuando se pide (la UI lo cachea por versión de datos,
+# formato y filtros); el snapshot en data/exports lo escribe el backend por bloques, sin serializar
+# la tabla en memoria.
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv"), "CSV comprimido (.csv.gz)": ("csv.gz", "application/gzip")}
+if pa is not None:
+    EXPORT_FORMATS["Parquet"] = ("parquet", "application/vnd.apache.parquet")
+EXPORT_CHUNK_ROWS = 20000
+
+def _export_payload(df: pd.DataFrame, ext: str) -> bytes:
+    buf = io.BytesIO()
+    if ext == "parquet":
+        df.to_parquet(buf, index=False)
+        return buf.getvalue()
+    out = gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) if ext == "csv.gz" else buf
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        out.write(df.iloc[start:start + EXPORT_CHUNK_ROWS].to_csv(index=False, header=start == 0).encode("utf-8"))
+    if out is not buf: out.close()
+    return buf.getvalue()
+
+@traced()
+def export_table(ext: str, filters: tuple | None = None) -> bytes:
+    """Contenido del archivo a descargar: tabla completa o solo la vista filtrada de Consultar."""
+    df = _normalize_columns(get_store().read())
+    if filters is not None:
+        ids = set(apply_filters(enrich(df), *filters)["id_lead"].astype(str))
+        df = df[df["id_lead"].astype(str).isin(ids)]
+    return _export_payload(df, ext)
+
+def export_snapshot_to_file(prefix: str = "leads_export") -> Path:
+    stamp = now()
+    out = EXPORT_DIR / f"{prefix}_{stamp:%Y%m%d_%H%M%S}.csv"
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    get_store().export_csv(out)  # copia/streaming por bloques desde el backend
+    register_loose_file(out, stamp.date().isoformat())
+    return out
+
+# ===================== Respaldo diario (AUTO, en segundo plano) =====================
+# data/backups/objects/<hash>.gz: contenido gzip direccionado por su hash (blake2b), así un archivo
+# que no cambió desde el día anterior no vuelve a escribirse. data/backups/manifest.json registra
+# qué objeto corresponde a cada archivo por día y los archivos sueltos (exports, respaldos viejos);
+# la retención y la verificación trabajan sobre el manifiesto sin recorrer carpetas.
+BACKUP_OBJECTS_DIR = BACKUP_DIR / "objects"
+BACKUP_MANIFEST    = BACKUP_DIR / "manifest.json"
+BACKUP_KEEP_DAYS   = 60
+
+def _manifest_load() -> dict:
+    try:
+        m = json.loads(BACKUP_MANIFEST.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        m = {}
+    if "loose" not in m:  # primera vez: se registran una sola vez los respaldos del esquema anterior
+        m["loose"] = {str(f.relative_to(DATA_DIR)): date.fromtimestamp(f.stat().st_mtime).isoformat()
+                      for f in [*BACKUP_DIR.glob("*.csv"), *BACKUP_DIR.glob("*.jsonl"), *EXPORT_DIR.glob("leads_export_*.csv")]}
+    m.setdefault("days", {}); m.setdefault("objects", {})
+    return m
+
+def _manifest_save(m: dict):
+    tmp = BACKUP_MANIFEST.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(m, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(BACKUP_MANIFEST)
+
+def register_loose_file(path: Path, day: str):
+    # Archivos sueltos (p. ej. snapshots de "Exportar") entran a la retención del manifiesto
+    with file_lock(BACKUP_MANIFEST):
+        m = _manifest_load()
+        m["loose"][str(path.relative_to(DATA_DIR))] = day
+        _manifest_save(m)
+
+def _store_object(src: Path) -> tuple[str, bool]:
+    digest = _file_digest(src)
+    obj = BACKUP_OBJECTS_DIR / f"{digest}.gz"
+    if obj.exists(): return digest, False  # mismo contenido que un respaldo anterior
+    BACKUP_OBJECTS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = obj.with_suffix(".gz.tmp")
+    with open(src, "rb") as f, gzip.open(tmp, "wb", compresslevel=6) as gz:
+        shutil.copyfileobj(f, gz, 1 << 20)
+    if not _verify_object(digest, tmp):
+        tmp.unlink(missing_ok=True)
+        raise OSError(f"El respaldo de {src.name} no pasó la verificación")
+    tmp.replace(obj)
+    return digest, True
+
+def _verify_object(digest: str, path: Path | None = None) -> bool:
+    # Descomprime completo y compara el hash: es la misma lectura que hará una restauración
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with gzip.open(path or BACKUP_OBJECTS_DIR / f"{digest}.gz", "rb") as gz:
+            for chunk in iter(lambda: gz.read(1 << 20), b""):
+                h.update(chunk)
+    except (OSError, EOFError):
+        return False
+    return h.hexdigest() == digest
+
+def _backup_retention(m: dict, day: str, keep_days: int):
+    limit = (date.fromisoformat(day) - timedelta(days=keep_days)).isoformat()
+    for d in [d for d in m["days"] if d < limit]:
+        del m["days"][d]
+    live = {h for e in m["days"].values() for h in e["files"].values()}
+    for h in [h for h in m["objects"] if h not in live]:
+        (BACKUP_OBJECTS_DIR / f"{h}.gz").unlink(missing_ok=True)
+        del m["objects"][h]
+    for rel in [r for r, d in m["loose"].items() if d < limit]:
+        (DATA_DIR / rel).unlink(missing_ok=True)
+        del m["loose"][rel]
+
+def run_backup(day: str | None = None, keep_days: int = BACKUP_KEEP_DAYS) -> dict:
+    """Respaldo del día (leads, usuarios, eventos) + retención. Idempotente por día."""
+    day = day or date.today().isoformat()  # fecha del servidor: corre fuera de cualquier sesión
+    with file_lock(BACKUP_MANIFEST):
+        m = _manifest_load()
+        if day not in m["days"]:
+            tmp = BACKUP_DIR / f".{DATA_PATH.name}.tmp"
+            entry = {"at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "files": {}, "new": []}
+            try:
+                get_store().export_csv(tmp)  # leads vía el backend (CSV compacto o exportación de SQLite)
+                for name, src in ((DATA_PATH.name, tmp), (USERS_PATH.name, USERS_PATH), (EVENTS_PATH.name, EVENTS_PATH)):
+                    if not src.exists(): continue
+                    digest, new = _store_object(src)
+                    if new:
+                        entry["new"].append(name)
+                        m["objects"][digest] = {"name": name, "size": src.stat().st_size,
+                                                "gz": (BACKUP_OBJECTS_DIR / f"{digest}.gz").stat().st_size}
+                    entry["files"][name] = digest
+            finally:
+                tmp.unlink(missing_ok=True)
+            m["days"][day] = entry
+        _backup_retention(m, day, keep_days)
+        _manifest_save(m)
+    return m["days"][day]
+
+def verify_backups() -> dict[str, bool]:
+    """Comprueba (descomprimiendo) cada objeto que sigue referenciado por el manifiesto."""
+    m = _manifest_load()
+    return {h: _verify_object(h) for h in m["objects"]}
+
+def restore_backup(name: str, day: str | None = None, dst: Path | None = None) -> Path:
+    """Restaura `name` (p. ej. "leads.csv") del día indicado, o del último, a `dst` verificando el hash."""
+    m = _manifest_load()
+    days = sorted(d for d, e in m["days"].items() if name in e["files"])
+    if not days or (day and day not in days):
+        raise FileNotFoundError(f"No hay respaldo de {name}" + (f" del {day}" if day else ""))
+    day = day or days[-1]
+    digest = m["days"][day]["files"][name]
+    dst = Path(dst or BACKUP_DIR / f"restaurado_{day}_{name}")
+    tmp = dst.with_name(dst.name + ".tmp")
+    h = hashlib.blake2b(digest_size=16)
+    with gzip.open(BACKUP_OBJECTS_DIR / f"{digest}.gz", "rb") as gz, open(tmp, "wb") as out:
+        for chunk in iter(lambda: gz.read(1 << 20), b""):
+            h.update(chunk); out.write(chunk)
+    if h.hexdigest() != digest:
+        tmp.unlink(missing_ok=True)
+        raise ValueError(f"El respaldo de {name} del {day} está dañado")
+    tmp.replace(dst)
+    return dst
+
+@functools.cache
+def _backup_worker() -> dict:
+    return {"lock": threading.Lock(), "thread": None, "last": None, "error": None}
+
+def _backup_job(w: dict, keep_days: int):
+    try:
+        w["last"], w["error"] = run_backup(keep_days=keep_days), None
+    except Exception as e:
+        w["error"] = f"{type(e).__name__}: {e}"
+
+def start_backup_worker(keep_days: int = BACKUP_KEEP_DAYS) -> bool:
+    """Lanza el respaldo del día en un hilo; la petición del usuario no lo espera."""
+    w = _backup_worker()
+    with w["lock"]:
+        if w["thread"] is not None and w["thread"].is_alive(): return False
+        w["thread"] = threading.Thread(target=_backup_job, args=(w, keep_days), name="crm-backup", daemon=True)
+        w["thread"].start()
+    return True
+
+def backup_status() -> dict:
+    w = _backup_worker()
+    return {"running": bool(w["thread"] and w["thread"].is_alive()), "last": w["last"], "error": w["error"]}
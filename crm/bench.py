@@ -0,0 +1,259 @@
+# crm/bench.py — benchmark con leads sintéticos
+from __future__ import annotations
+import json
+import os
+import time
+from datetime import datetime, date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .aggregates import build_aggregates, compute_cohorts
+from .config import BASE_DIR, DATA_DIR, PERF_DIR, STORAGE_BACKEND
+from .domain import (CAT_COMO, CAT_CURSOS, COUNTER_COLUMNS, FUNNEL_YELLOW, OUTCOME_RULES, PROJECTIONS, STALE_DAYS, _to_int,
+                     compute_color, enrich, fold_text, format_lead_id, max_lead_number, parse_date_safe)
+from .history import history_df
+from .schema import to_strings, to_typed
+from .search import LeadSearchIndex, apply_filters
+from .storage import (allocate_lead_ids, ensure_csv, get_lead, heal_and_persist, lead_version, load_data, save_data,
+                      write_lead, _normalize_columns)
+
+# ===================== Benchmark (leads sintéticos) =====================
+# `python -m crm bench --filas 1000,10000,100000` genera leads parecidos a los reales y
+# mide las rutas calientes; cada tamaño corre en un proceso nuevo con CRM_DATA_DIR en un directorio
+# temporal (no toca data/). El resultado va a data/perf/bench_<fecha>_<commit>.json.
+# La búsqueda se mide por partes: construcción del índice y consulta sobre el índice ya construido.
+BENCH_SIZES = "1000,10000,100000"
+BENCH_NOMBRES = ["María","José","Guadalupe","Juan","Ana Sofía","Luis","Azucena del Carmen","Favio","Rocío","Iñaki"]
+BENCH_APELLIDOS = ["Hernández","García","Martínez","López","Huitron Chavez","Pérez Núñez","Sánchez","Ramírez","Cruz","Peña"]
+BENCH_USUARIOS = ["Favio","Lupita","Carlos","Admin",""]
+BENCH_NOTAS = ["Llamar después de las 6","Pidió temario por WhatsApp","Interesada en beca","Número equivocado a veces"]
+BENCH_QUERIES = ["hernandez","azucena del","2891","gmail"]
+
+def synthetic_leads(n: int, seed: int = 7, ref: date | None = None) -> pd.DataFrame:
+    """n leads con los catálogos reales y los formatos "sucios" de la captura manual."""
+    rng = np.random.default_rng(seed)
+    ref = pd.Timestamp(ref or date.today())
+    def pick(vals, p=None):
+        return np.asarray(vals, dtype=object)[rng.choice(len(vals), n, p=p)]
+    def fechas(ts: pd.Series):
+        # Mezcla ISO (2025-09-09) y día/mes/año sin ceros (28/8/2025)
+        dmy = ts.dt.day.astype(str) + "/" + ts.dt.month.astype(str) + "/" + ts.dt.year.astype(str)
+        return np.where(rng.random(n) < 0.3, dmy, ts.dt.strftime("%Y-%m-%d"))
+
+    reg = pd.Series(ref - pd.to_timedelta(rng.integers(0, 540, n), unit="D")) + pd.to_timedelta(rng.integers(8*3600, 22*3600, n), unit="s")
+    last = reg + pd.to_timedelta(rng.integers(0, 60, n), unit="D")
+    last = last.where(last <= ref, ref)
+    etapas = FUNNEL_YELLOW + ["Won (Ganado)","Lost (Perdido)"]
+    etapa = pick(etapas, [0.6 / len(FUNNEL_YELLOW)] * len(FUNNEL_YELLOW) + [0.2, 0.2])
+    won, lost = etapa == "Won (Ganado)", etapa == "Lost (Perdido)"
+    abiertos = [o for o, r in OUTCOME_RULES.items() if r[0] == "🟡"]
+    outcome = np.where(won, "💳 Envió comprobante", np.where(lost, "🚫 No interesado", pick(abiertos)))
+    rule = [OUTCOME_RULES[o] for o in outcome]
+    delta = np.array([r[2] for r in rule])
+    prox = pd.Series(last.dt.normalize() + pd.to_timedelta(delta, unit="D"))
+    color = np.where(won, "🟢", np.where(lost | ((ref - last).dt.days > 30).to_numpy(), "🔴", "🟡")).astype(object)
+    bad = rng.random(n) < 0.03  # ~3% con color vacío o incoherente: trabajo para la autosanación
+    color[bad] = pick(["", "🟡", "🟢"])[bad]
+    owner = pick(BENCH_USUARIOS)
+    touches = rng.integers(1, 7, n)
+
+    num = pd.Series(rng.integers(10**9, 10**10, n).astype(str))
+    dup = rng.random(n) < 0.01  # ~1% repite el teléfono de otro lead
+    num[dup] = num.iloc[rng.integers(0, n, int(dup.sum()))].to_numpy()
+    spaced = num.str[:3] + " " + num.str[3:6] + " " + num.str[6:]  # "552 891 4380"
+    cel = np.where(rng.random(n) < 0.3, spaced, num)
+    nombre = pick(BENCH_NOMBRES)
+    base = {v: fold_text(v).split()[0] for v in BENCH_NOMBRES}
+    mail = pd.Series(nombre).map(base) + "." + pd.Series(np.arange(1, n + 1)).astype(str) + "@gmail.com"
+    curso = pick(CAT_CURSOS)
+    curso = np.where(rng.random(n) < 0.3, curso + " | " + pick(CAT_CURSOS), curso)
+
+    ts0 = reg.dt.strftime("%Y-%m-%d %H:%M:%S").tolist()
+    ts1 = last.dt.strftime("%Y-%m-%d 18:30:00").tolist()
+    nota = pick(BENCH_NOTAS)
+    hist_c, hist_a, obs = [], [], []
+    for i in range(n):  # textos multilínea heredados (historial en celdas)
+        u = owner[i] or "sin usuario"
+        hist_c.append(f"{ts0[i]} | ∅ → 🟡" + (f"\n{ts1[i]} | 🟡 → {color[i]}" if color[i] in ("🔴","🟢") else ""))
+        hist_a.append("\n".join([f"{ts0[i]} | {u} | 📵 No responde"] * (touches[i] - 1) + [f"{ts1[i]} | {u} | {outcome[i]}"]))
+        obs.append((nota[i] + "\n" if i % 2 else "") + f"{ts1[i]} | {u} | {outcome[i]}")
+
+    df = pd.DataFrame({
+        "id_lead": [format_lead_id(i) for i in range(1, n + 1)],
+        "fecha_registro": fechas(reg), "hora_registro": reg.dt.strftime("%H:%M:%S"),
+        "nombre/alias": nombre, "apellidos": pick(BENCH_APELLIDOS),
+        "genero": pick(["","Femenino","Masculino"]), "edad": np.where(rng.random(n) < 0.5, "", rng.integers(18, 66, n).astype(str)),
+        "celular": cel, "telefono": np.where(rng.random(n) < 0.5, cel, ""),
+        "correo": np.where(rng.random(n) < 0.6, mail, ""),
+        "interes_curso(puede sellecionar varios)": curso, "como_enteraste": pick(CAT_COMO),
+        "funnel_etapas": etapa, "fecha_ultimo_contacto": fechas(last),
+        "observaciones": obs, "atendido_por": owner,
+        "proxima_accion_fecha": np.where(delta > 0, fechas(prox), ""),
+        "proxima_accion_desc": [r[3] for r in rule],
+        "estado_color": color, "fecha_cambio_color": ts1,
+        "amarillo_contador": rng.integers(0, touches + 1).astype(str),
+        "historial_color": hist_c, "historial_atenciones": hist_a,
+        "total_atenciones": touches.astype(str), "row_version": "1",
+    })
+    return _normalize_columns(df)
+
+def _bench_time(fn, repeat: int = 1):
+    # Mejor de `repeat` corridas, en ms (con el resultado de la última)
+    best, out = None, None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        ms = (time.perf_counter() - t0) * 1000
+        best = ms if best is None else min(best, ms)
+    return round(best, 2), out
+
+def bench_run(n: int, repeat: int = 3, seed: int = 7) -> dict:
+    """Mide las rutas calientes sobre n leads sintéticos escritos en DATA_DIR (se sobrescribe)."""
+    if DATA_DIR == (BASE_DIR / "data").resolve():
+        raise RuntimeError("El benchmark sobrescribe los datos: usa CRM_DATA_DIR con un directorio temporal")
+    ensure_csv()
+    ms = {}
+    ms["generar"], df = _bench_time(lambda: synthetic_leads(n, seed))
+    ms["save_data"], _ = _bench_time(lambda: save_data(df))
+    ms["load_data_frio"], _ = _bench_time(lambda: (load_data.clear(), load_data())[1])
+    ms["load_data"], df = _bench_time(lambda: (load_data.clear(), load_data())[1], repeat)
+    # Proyecciones (sin los textos de historial): lo que leen Seguimiento/Consultar y el dashboard
+    ms["load_lista"], _ = _bench_time(lambda: (load_data.clear(), load_data("lista"))[1], repeat)
+    ms["load_dashboard"], _ = _bench_time(lambda: (load_data.clear(), load_data("dashboard"))[1], repeat)
+    ms["get_lead"], _ = _bench_time(lambda: get_lead(df["id_lead"].iloc[len(df) // 2]), repeat)
+    ms["enrich"], _ = _bench_time(lambda: enrich(df), repeat)
+    ms["heal_and_persist"], df = _bench_time(lambda: heal_and_persist(df))
+    # ui_filtros: índice de búsqueda + consultas + filtros de responsable/color
+    ms["indice_busqueda"], idx = _bench_time(lambda: LeadSearchIndex.build(df))
+    ms["buscar_x4"], _ = _bench_time(lambda: [idx.search(q) for q in BENCH_QUERIES], repeat)
+    ms["apply_filters"], _ = _bench_time(lambda: apply_filters(df, "", "fav", 2), repeat)
+    sample = df.sample(min(len(df), 200), random_state=seed).to_dict("records")
+    ms["history_df_x200"], _ = _bench_time(lambda: [history_df(r) for r in sample], repeat)
+    # next_lead_id ya no existe: secuencia persistente (O(1)) vs. el escaneo de ids que hacía antes
+    ms["max_lead_number"], _ = _bench_time(lambda: max_lead_number(df["id_lead"]), repeat)
+    ms["allocate_lead_ids_semilla"], _ = _bench_time(lambda: allocate_lead_ids(1))  # primera: siembra desde los ids
+    ms["allocate_lead_ids"], _ = _bench_time(lambda: allocate_lead_ids(1), repeat)
+    end = date.today(); start = end - timedelta(days=365)
+    ms["build_aggregates"], _ = _bench_time(lambda: build_aggregates(df), repeat)
+    # Tabla tipada (crm.schema) como la usa el dashboard: conversión una vez por versión, agregados sobre códigos
+    ms["tabla_tipada"], ty = _bench_time(lambda: to_typed(df[PROJECTIONS["dashboard"]]), repeat)
+    ms["build_aggregates_tipada"], _ = _bench_time(lambda: build_aggregates(ty), repeat)
+    ms["compute_cohorts_tipada"], _ = _bench_time(lambda: compute_cohorts(ty, start, end, "W"), repeat)
+    ms["compute_cohorts"], _ = _bench_time(lambda: compute_cohorts(df, start, end, "W"), repeat)
+    ms["compute_cohorts_responsable"], _ = _bench_time(lambda: compute_cohorts(df, start, end, "M", "atendido_por"), repeat)
+    rec = get_lead(sample[0]["id_lead"])
+    ms["write_lead"], _ = _bench_time(lambda: write_lead(rec["id_lead"], lead_version(rec), {"set": {"proxima_accion_desc": "Bench"}}))
+    return {"filas": n, "backend": STORAGE_BACKEND, "ms": ms}
+
+# ===================== Paridad de enrich (vectorizado vs. por fila) y de la tabla tipada =====================
+# `python -m crm paridad` compara enrich() con la versión original fila por fila (compute_color y
+# parse_date_safe por celda): estado_color, _prox, _reg, _ord y el orden final de las filas, sobre
+# leads sintéticos más casos borde (fechas vacías, inválidas y de formatos mezclados, colores con
+# espacios o inválidos, 🟡 con más de STALE_DAYS sin contacto) y, opcionalmente, sobre los datos reales.
+PARITY_COLUMNS = ["estado_color","_prox","_reg","_ord"]
+
+def enrich_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """enrich() tal como era antes de vectorizarlo: referencia para la paridad."""
+    if df.empty: return df
+    df = df.copy()
+    df["estado_color"] = df.apply(compute_color, axis=1)
+    df["_prox"] = df["proxima_accion_fecha"].apply(parse_date_safe)
+    df["_reg"]  = df["fecha_registro"].apply(parse_date_safe)
+    df["_ord"]  = df["estado_color"].map({"🔴":0,"🟡":1,"🟢":2}).fillna(9)
+    return df.sort_values(by=["_ord","_prox","_reg"], ascending=[True,True,False])
+
+def parity_cases(ref: date | None = None) -> pd.DataFrame:
+    """Casos borde de fechas y colores (una fila por caso) con el resto de columnas sintéticas."""
+    ref = ref or date.today()
+    stale = ref - timedelta(days=STALE_DAYS + 15)
+    cases = [  # (fecha, color, etapa, último contacto)
+        ("", "", FUNNEL_YELLOW[0], ""),
+        ("   ", "🟡", FUNNEL_YELLOW[1], "   "),
+        ("mañana", "", FUNNEL_YELLOW[0], "n/a"),
+        ("31/02/2025", "🟡", FUNNEL_YELLOW[2], "2025-13-01"),
+        ("2025/3/9", " 🟡 ", FUNNEL_YELLOW[0], "9/3/2025"),
+        ("09-03-2025", "🟢", FUNNEL_YELLOW[0], "2025-03-09"),
+        ("3/9/2025", "rojo", "Won (Ganado)", ""),
+        (" 2025-03-09 ", "", "Lost (Perdido)", ""),
+        ("2025-03-09 10:00", "", "Won", ""),
+        ("March 9, 2025", "", "Lost", ""),
+        (ref.isoformat(), "", FUNNEL_YELLOW[0], stale.isoformat()),
+        (ref.isoformat(), "🟡", FUNNEL_YELLOW[0], f"{stale.day}/{stale.month}/{stale.year}"),
+        ((ref - timedelta(days=1)).isoformat(), "", FUNNEL_YELLOW[1], (ref - timedelta(days=STALE_DAYS)).isoformat()),
+        ((ref + timedelta(days=2)).strftime("%d/%m/%Y"), "🔴", FUNNEL_YELLOW[1], ref.isoformat()),
+    ]
+    df = synthetic_leads(len(cases), seed=11, ref=ref)
+    for i, (fecha, color, etapa, ult) in enumerate(cases):
+        df.loc[i, ["proxima_accion_fecha","fecha_registro","estado_color","funnel_etapas","fecha_ultimo_contacto"]] = \
+            [fecha, fecha, color, etapa, ult]
+    return df
+
+def enrich_parity(df: pd.DataFrame) -> dict:
+    """{"filas", "diferencias": {columna: filas distintas}, "orden": bool}; vacío = paridad."""
+    new, old = enrich(df), enrich_reference(df)
+    diffs = {}
+    for c in PARITY_COLUMNS:
+        if c not in new.columns and c not in old.columns: continue
+        a, b = new[c].reindex(df.index).astype(object), old[c].reindex(df.index).astype(object)
+        same = (a == b) | (a.isna() & b.isna())
+        if not same.all(): diffs[c] = int((~same).sum())
+    order = new["id_lead"].tolist() == old["id_lead"].tolist()
+    return {"filas": len(df), "diferencias": diffs, "orden": order}
+
+# Textos de contador "sucios" para la tabla tipada: decimales (se truncan como _to_int), espacios,
+# ceros a la izquierda, vacío y basura
+PARITY_COUNTER_TEXTS = ["3.5", "-1.9", " 7", "07", "", "x", "2"]
+
+def schema_roundtrip(df: pd.DataFrame) -> dict:
+    """to_strings(to_typed(df)) == df y contadores tipados == _to_int del texto; mismo formato que enrich_parity."""
+    typed = to_typed(df)
+    back = to_strings(typed)
+    diffs = {c: int((back[c] != df[c]).sum()) for c in df.columns if not back[c].equals(df[c])}
+    for c in COUNTER_COLUMNS:
+        if c not in df.columns: continue
+        bad = int((typed[c].fillna(0).astype(int).to_numpy() != df[c].map(_to_int).to_numpy()).sum())
+        if bad: diffs[f"{c} (valor)"] = bad
+    return {"filas": len(df), "diferencias": diffs, "orden": back.index.equals(df.index)}
+
+def run_parity(n: int = 20000, seed: int = 7, real: pd.DataFrame | None = None) -> dict:
+    """Paridad sobre la tabla vacía, los casos borde, n leads sintéticos (+ casos) y, si se pasa, `real`;
+    además la ida y vuelta de la tabla tipada (crm.schema) sobre los casos borde y los sintéticos."""
+    synth = synthetic_leads(n, seed)
+    cases = parity_cases()
+    for i, c in enumerate(COUNTER_COLUMNS):
+        cases[c] = [PARITY_COUNTER_TEXTS[(i + j) % len(PARITY_COUNTER_TEXTS)] for j in range(len(cases))]
+    sets = {"vacia": synth.iloc[0:0], "casos_borde": cases,
+            "sinteticos": pd.concat([synth, cases.assign(id_lead=[f"X{i}" for i in range(len(cases))])], ignore_index=True)}
+    if real is not None: sets["datos"] = real
+    out = {}
+    for name, df in sets.items():
+        if df.empty:
+            out[name] = {"filas": 0, "diferencias": {}, "orden": enrich(df).equals(enrich_reference(df))}
+        else:
+            out[name] = enrich_parity(df)
+    out["tipada_casos_borde"] = schema_roundtrip(sets["casos_borde"])
+    out["tipada_sinteticos"] = schema_roundtrip(sets["sinteticos"])
+    return out
+
+def run_benchmarks(sizes: list[int], out: str | None = None, repeat: int = 3, seed: int = 7) -> Path:
+    """Corre bench_run por tamaño en procesos aislados y guarda el JSON comparable entre commits."""
+    import platform, subprocess, sys, tempfile
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory(prefix="crm-bench-") as tmp:
+            cmd = [sys.executable, "-m", "crm", "bench", "--una", str(n), "--repeticiones", str(repeat), "--semilla", str(seed)]
+            r = subprocess.run(cmd, cwd=BASE_DIR, env=dict(os.environ, CRM_DATA_DIR=tmp), capture_output=True, text=True)
+            if r.returncode != 0:
+                raise RuntimeError(f"bench {n} filas: {(r.stderr.strip().splitlines() or ['sin salida'])[-1]}")
+            results.append(json.loads(r.stdout.strip().splitlines()[-1]))
+    git = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True)
+    commit = git.stdout.strip() if git.returncode == 0 else ""
+    now = datetime.now()
+    doc = {"commit": commit, "fecha": now.isoformat(timespec="seconds"), "python": platform.python_version(),
+           "pandas": pd.__version__, "backend": STORAGE_BACKEND, "repeticiones": repeat, "semilla": seed, "resultados": results}
+    dst = Path(out) if out else PERF_DIR / f"bench_{now:%Y%m%d_%H%M%S}_{commit or 'sin-git'}.json"
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    dst.write_text(json.dumps(doc, ensure_ascii=False, indent=1), encoding="utf-8")
+    return dst
@@ -0,0 +1,47 @@
+# crm/boot.py — arranque idempotente (una vez por proceso / por cambio de datos)
+from __future__ import annotations
+import functools
+import threading
+import time
+from datetime import datetime, date
+
+from .backup import start_backup_worker
+from .config import USERS_PATH, EVENTS_MIGRATED_TAG
+from .history import migrate_history_to_events
+from .storage import data_version, ensure_csv, heal_and_persist, load_data
+from .tracing import traced, _stat_key
+from .users import ensure_users_csv
+
+# ===================== Arranque (una vez por proceso / por cambio de datos) =====================
+# Cada paso guarda la "llave" con la que corrió (huella de archivo o fecha); en los reruns
+# siguientes solo se comparan llaves (stat) y el paso se omite si nada cambió.
+_UNSET = object()  # paso que aún no corre (su llave puede ser None, p. ej. users.csv sin crear)
+
+@functools.cache
+def _boot_state() -> dict:
+    return {"lock": threading.Lock(), "keys": {}, "timings": {}}
+
+BOOT_STEPS = [
+    ("ensure_users_csv", lambda: _stat_key(USERS_PATH), ensure_users_csv),
+    ("ensure_csv",       data_version,                  ensure_csv),
+    ("migrate_history",  lambda: EVENTS_MIGRATED_TAG.exists(), migrate_history_to_events),
+    ("heal_and_persist", data_version,                  lambda: heal_and_persist(load_data("lista"))),
+    ("daily_backup",     lambda: date.today().isoformat(), start_backup_worker),  # AUTO diario, en segundo plano
+]
+
+@traced()
+def bootstrap() -> dict:
+    state = _boot_state()
+    if all(state["keys"].get(name, _UNSET) == key() for name, key, _ in BOOT_STEPS):
+        return state
+    with state["lock"]:  # sesiones concurrentes esperan a que termine el primer arranque
+        for name, key, fn in BOOT_STEPS:
+            if state["keys"].get(name, _UNSET) == key(): continue
+            t0 = time.perf_counter()
+            fn()
+            state["timings"][name] = {"ms": round((time.perf_counter() - t0) * 1000, 1), "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            state["keys"][name] = key()
+    return state
+
+def bootstrap_timings() -> dict:
+    return dict(_boot_state()["timings"])
@@ -0,0 +1,101 @@
+# crm/cli.py — línea de comandos (`python -m crm …`), sin Streamlit
+from __future__ import annotations
+import json
+from datetime import date
+
+from .backup import BACKUP_KEEP_DAYS, run_backup, verify_backups, restore_backup
+from .bench import BENCH_SIZES, bench_run, run_benchmarks, run_parity
+from .dedup import dedup_report, merge_all_duplicates
+from .domain import CAT_COMO
+from .importer import import_leads
+from .maintenance import MAINT_CHUNK_ROWS, QUEUE_PATH, run_maintenance
+from .storage import ensure_csv, load_data
+
+# ===================== Línea de comandos (sin Streamlit) =====================
+def cli(argv: list[str] | None = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m crm", description="Tareas del CRM sin interfaz web.")
+    cmds = ap.add_subparsers(dest="cmd", required=True)
+    p = cmds.add_parser("importar", help="Importa leads desde un CSV/XLSX en una sola escritura")
+    p.add_argument("archivo")
+    p.add_argument("--usuario", default="", help="Valor de atendido_por para los leads importados")
+    p.add_argument("--canal", default=CAT_COMO[0], choices=CAT_COMO, help="Canal cuando el archivo no lo indica")
+    p.add_argument("--rechazos", help="CSV para las filas rechazadas (por defecto <archivo>.rechazados.csv)")
+    p = cmds.add_parser("duplicados", help="Reporte de leads duplicados (teléfono/correo) y fusión opcional")
+    p.add_argument("--salida", help="CSV donde guardar el reporte")
+    p.add_argument("--fusionar", action="store_true", help="Fusiona cada grupo en su lead más antiguo")
+    p = cmds.add_parser("respaldo", help="Respaldo del día (si falta), retención y verificación de objetos")
+    p.add_argument("--dias", type=int, default=BACKUP_KEEP_DAYS, help="Días de retención")
+    p = cmds.add_parser("restaurar", help="Restaura un archivo respaldado (verificado por hash) a otra ruta")
+    p.add_argument("nombre", help="leads.csv, users.csv o lead_events.jsonl")
+    p.add_argument("--dia", help="YYYY-MM-DD (por defecto el último)")
+    p.add_argument("--destino", help="Ruta de salida (por defecto data/backups/restaurado_<día>_<nombre>)")
+    p = cmds.add_parser("mantenimiento", help="Recolor por bloques, cola del día por responsable y resúmenes (cron nocturno)")
+    p.add_argument("--dia", help="YYYY-MM-DD (por defecto hoy)")
+    p.add_argument("--bloque", type=int, default=MAINT_CHUNK_ROWS, help="Filas por bloque")
+    p = cmds.add_parser("bench", help="Benchmark de rutas calientes con leads sintéticos (data/perf/bench_*.json)")
+    p.add_argument("--filas", default=BENCH_SIZES, help="Tamaños separados por coma (1000 … 1000000)")
+    p.add_argument("--repeticiones", type=int, default=3, help="Corridas por medición (se guarda la mejor)")
+    p.add_argument("--semilla", type=int, default=7)
+    p.add_argument("--salida", help="JSON de resultados (por defecto data/perf/bench_<fecha>_<commit>.json)")
+    p.add_argument("--una", type=int, help=argparse.SUPPRESS)  # proceso hijo: un tamaño, JSON por stdout
+    p = cmds.add_parser("paridad", help="Compara enrich() vectorizado con la versión fila por fila y la ida y vuelta de la tabla tipada (sale con 1 si difieren)")
+    p.add_argument("--filas", type=int, default=20000, help="Leads sintéticos")
+    p.add_argument("--semilla", type=int, default=7)
+    p.add_argument("--datos", action="store_true", help="Incluye la tabla real (solo lectura)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "importar":
+        ensure_csv()
+        res = import_leads(args.archivo, args.archivo, args.usuario, args.canal)
+        rango = f" ({res['ids'][0]} … {res['ids'][1]})" if res["ids"] else ""
+        print(f"Importados: {res['importados']}{rango} en {res['segundos']} s")
+        bad = res["rechazados"]
+        if not bad.empty:
+            dst = args.rechazos or f"{args.archivo}.rechazados.csv"
+            bad.to_csv(dst, index=False, encoding="utf-8")
+            print(f"Rechazados: {len(bad)} → {dst}")
+    elif args.cmd == "duplicados":
+        ensure_csv()
+        rep_df = dedup_report()
+        print(f"Grupos: {rep_df['grupo'].nunique()} · leads: {len(rep_df)}")
+        if args.salida:
+            rep_df.to_csv(args.salida, index=False, encoding="utf-8")
+        if args.fusionar:
+            print(f"Fusionados: {merge_all_duplicates('cli')}")
+    elif args.cmd == "respaldo":
+        ensure_csv()
+        entry = run_backup(keep_days=args.dias)
+        print(f"Respaldo {entry['at']} · nuevos: {', '.join(entry['new']) or 'ninguno (sin cambios)'}")
+        bad = [h for h, ok in verify_backups().items() if not ok]
+        print("Verificación: OK" if not bad else f"Verificación: {len(bad)} objetos dañados ({', '.join(bad)})")
+        return 1 if bad else 0
+    elif args.cmd == "restaurar":
+        print(f"Restaurado en {restore_backup(args.nombre, args.dia, args.destino)}")
+    elif args.cmd == "mantenimiento":
+        ensure_csv()
+        res = run_maintenance(date.fromisoformat(args.dia) if args.dia else None, args.bloque)
+        print(f"Mantenimiento {res['dia']}: {res['filas']} leads · {res['recoloreados']} recoloreados · "
+              f"{res['pasadas']} pasada(s) en {res['segundos']} s")
+        for owner, (hoy, venc) in res["colas"].items():
+            print(f"  {owner}: {hoy} hoy · {venc} vencidos")
+        print(f"Cola → {QUEUE_PATH}" + ("" if res["al_dia"] else " (desactualizada: hubo escrituras durante la pasada)"))
+    elif args.cmd == "bench":
+        if args.una:
+            print(json.dumps(bench_run(args.una, args.repeticiones, args.semilla)))
+            return 0
+        dst = run_benchmarks([int(x) for x in args.filas.split(",") if x.strip()], args.salida, args.repeticiones, args.semilla)
+        for r in json.loads(dst.read_text(encoding="utf-8"))["resultados"]:
+            print(f"{r['filas']:>8} filas · " + " · ".join(f"{k} {v} ms" for k, v in r["ms"].items()))
+        print(f"Resultados → {dst}")
+    elif args.cmd == "paridad":
+        real = None
+        if args.datos:
+            ensure_csv()
+            real = load_data("lista")
+        res = run_parity(args.filas, args.semilla, real)
+        for name, r in res.items():
+            ok = not r["diferencias"] and r["orden"]
+            print(f"{name}: {r['filas']} filas · " + ("OK" if ok else f"DIFIEREN {r['diferencias']} · orden {'igual' if r['orden'] else 'distinto'}"))
+        return 0 if all(not r["diferencias"] and r["orden"] for r in res.values()) else 1
+    return 0
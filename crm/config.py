@@ -0,0 +1,61 @@
+# crm/config.py — rutas, variables de entorno y reloj
+# Importar este módulo no crea carpetas ni archivos: cada escritura crea la suya al primer uso.
+from __future__ import annotations
+import os
+from datetime import datetime, date
+from pathlib import Path
+
+# ===================== Config & Paths (rutas absolutas + carpeta data/) =====================
+BASE_DIR  = Path(__file__).resolve().parent.parent
+DATA_DIR  = Path(os.environ.get("CRM_DATA_DIR") or (BASE_DIR / "data")).resolve()  # CRM_DATA_DIR: otro directorio (benchmarks)
+
+DATA_PATH   = DATA_DIR / "leads.csv"
+USERS_PATH  = DATA_DIR / "users.csv"
+BACKUP_DIR  = DATA_DIR / "backups"           # Respaldos dentro de /data
+EXPORT_DIR  = DATA_DIR / "exports"           # Snapshots tipo "Exportar CSV"
+QUEUE_DIR   = DATA_DIR / "queues"            # Colas del día por responsable (mantenimiento nocturno)
+
+# Bitácora (journal) de cambios: cada alta/edición/atención se agrega como una línea JSON
+# y se "compacta" de vuelta a leads.csv al superar el umbral o en el respaldo diario.
+JOURNAL_PATH          = DATA_DIR / "leads.journal.jsonl"
+JOURNAL_ENABLED       = os.environ.get("CRM_JOURNAL", "1") != "0"
+JOURNAL_COMPACT_BYTES = int(os.environ.get("CRM_JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+# Backend de almacenamiento de leads: "csv" (leads.csv + bitácora) o "sqlite" (data/leads.sqlite3)
+STORAGE_BACKEND = os.environ.get("CRM_STORAGE", "csv").strip().lower()
+DB_PATH         = DATA_DIR / "leads.sqlite3"
+LEAD_SEQ_PATH   = DATA_DIR / "lead_id.seq"       # último número de id_lead asignado (backend CSV)
+
+# Historial normalizado: eventos append-only por lead (reemplaza los textos historial_*/observaciones)
+EVENTS_PATH         = DATA_DIR / "lead_events.jsonl"
+EVENTS_MIGRATED_TAG = DATA_DIR / ".events_migrated"
+EVENTS_MIGRATING_TAG = DATA_DIR / ".events_migrating"  # migración empezada y sin terminar
+
+# Snapshot Arrow (Feather sin compresión, memory-mapped) de leads.csv, ligado a su huella de archivo;
+# también guarda los agregados y el índice de eventos (y sus locks)
+SNAPSHOT_DIR = DATA_DIR / ".snapshots"
+
+# Cada cuántos segundos una sesión abierta revisa si otro usuario/proceso cambió los datos (0 = nunca)
+WATCH_SECONDS = float(os.environ.get("CRM_WATCH_SECONDS", "5"))
+
+# Trazas de rendimiento y resultados de benchmark
+PERF_DIR        = DATA_DIR / "perf"
+TRACE_PATH      = PERF_DIR / "trace.jsonl"
+TRACE_ENABLED   = os.environ.get("CRM_TRACE", "1") != "0"
+TRACE_MAX_BYTES = int(os.environ.get("CRM_TRACE_MAX_BYTES", str(2 * 1024 * 1024)))
+TRACE_KEEP      = 3
+
+# ===================== Reloj =====================
+# Hora del servidor por defecto (CLI, tareas); la UI instala la hora local del navegador de la sesión.
+_clock = {"now": datetime.now}
+
+def set_clock(now_fn=None):
+    _clock["now"] = now_fn or datetime.now
+
+def now() -> datetime: return _clock["now"]()
+def today() -> date: return now().date()
+def ts_now() -> str: return now().strftime("%Y-%m-%d %H:%M:%S")
+
+def timestamp_pair():
+    dt = now()
+    return dt.date().isoformat(), dt.strftime("%H:%M:%S")
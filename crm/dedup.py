@@ -0,0 +1,62 @@
+# crm/dedup.py — duplicados: reporte y fusión
+from __future__ import annotations
+from datetime import datetime
+
+import pandas as pd
+
+from .domain import COLUMNS_BASE, COLUMNS_EXTRA, make_event, _to_int
+from .history import read_events, append_events
+from .search import get_search_index
+from .storage import get_store, data_version, load_data, _versioned_ops, _after_write
+
+# ---------- Duplicados: reporte y fusión ----------
+# Los grupos salen del índice de llaves (teléfono/correo); la fusión conserva el id más antiguo,
+# completa sus campos vacíos, suma contadores, copia los eventos y da de baja los demás.
+DUP_MERGE_SUM  = ("total_atenciones","amarillo_contador")
+DUP_MERGE_JOIN = ("historial_color","historial_atenciones","observaciones")
+DUP_REPORT_COLS = ["id_lead","fecha_registro","nombre/alias","apellidos","celular","telefono","correo","atendido_por","funnel_etapas"]
+
+def dedup_report() -> pd.DataFrame:
+    """Una fila por lead en grupos de probables duplicados; `conservar` marca el más antiguo."""
+    groups = get_search_index().duplicate_groups()
+    if not groups: return pd.DataFrame(columns=["grupo","conservar"] + DUP_REPORT_COLS)
+    recs = load_data("lista").drop_duplicates("id_lead").set_index("id_lead", drop=False)
+    rows = [{"grupo": n, "conservar": j == 0, **recs.loc[lid, DUP_REPORT_COLS].to_dict()}
+            for n, g in enumerate(groups, 1) for j, lid in enumerate(g) if lid in recs.index]
+    return pd.DataFrame(rows, columns=["grupo","conservar"] + DUP_REPORT_COLS)
+
+def merge_leads(keep: str, dups: list[str], user: str = "", ts: str | None = None) -> bool:
+    """Fusiona `dups` en `keep` en una sola transacción; los eventos de historial pasan a `keep`."""
+    keep = str(keep)
+    dups = [str(d) for d in dups if str(d) != keep]
+    with get_store().transaction() as tx:
+        prev = data_version()
+        cur = tx.get_many([keep, *dups])
+        others = [cur[d] for d in dups if d in cur]
+        if keep not in cur or not others: return False
+        base, sets = cur[keep], {}
+        for c in COLUMNS_BASE + COLUMNS_EXTRA:
+            if c in ("id_lead","row_version") or c in DUP_MERGE_SUM: continue
+            if c in DUP_MERGE_JOIN:
+                parts = [r.get(c,"") for r in [base, *others] if r.get(c,"")]
+                if len(parts) > 1: sets[c] = "\n".join(parts)
+            elif not str(base.get(c,"")).strip():
+                fill = next((r[c] for r in others if str(r.get(c,"")).strip()), "")
+                if fill: sets[c] = fill
+        incr = {c: n for c in DUP_MERGE_SUM if (n := sum(_to_int(r.get(c)) for r in others))}
+        ops = [{"op":kind,"id":keep,"values":vals} for kind, vals in (("set", sets), ("incr", incr)) if vals]
+        ops = _versioned_ops(ops, cur) + [{"op":"delete","id":r["id_lead"]} for r in others]
+        tx.apply(ops)
+    _after_write(ops, cur, prev, tx.version)
+    ts = ts or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    events = [{**e, "lead_id": keep} for r in others for e in read_events(r["id_lead"])]
+    events += [make_event(keep, ts, "fusion", user or "sistema", f"Fusionado con {r['id_lead']}") for r in others]
+    append_events(events)
+    return True
+
+def merge_all_duplicates(user: str = "", ts: str | None = None) -> int:
+    """Fusiona cada grupo de duplicados en su lead más antiguo. Devuelve cuántos leads se dieron de baja."""
+    gone = 0
+    for g in get_search_index().duplicate_groups():
+        if merge_leads(g[0], g[1:], user, ts): gone += len(g) - 1
+    return gone
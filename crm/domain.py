@@ -0,0 +1,232 @@
+# crm/domain.py — catálogos y reglas del lead (funciones puras, sin E/S)
+from __future__ import annotations
+import re
+import unicodedata
+from datetime import datetime, date, timedelta
+
+import pandas as pd
+
+from .config import today, ts_now
+from .tracing import traced
+
+# ===================== Constantes & Catálogos =====================
+COLUMNS_BASE = [
+    "id_lead","fecha_registro","hora_registro","nombre/alias","apellidos","genero","edad","celular",
+    "telefono","correo","interes_curso(puede sellecionar varios)","como_enteraste","funnel_etapas",
+    "fecha_ultimo_contacto","observaciones","atendido_por","proxima_accion_fecha","proxima_accion_desc"
+]
+COLUMNS_EXTRA = [
+    "estado_color","fecha_cambio_color","amarillo_contador",
+    "historial_color","historial_atenciones","total_atenciones","row_version"
+]
+COUNTER_COLUMNS = ("amarillo_contador","total_atenciones","row_version")  # enteros, vacío = "0"
+
+# Proyecciones de columnas: cada vista lee solo lo que usa. Los textos heredados de historial
+# (multilínea, crecen con cada atención) solo se leen en "completo" o al pedir un lead por id.
+# row_version va en todas: la bitácora la usa para no aplicar dos veces una op ya integrada.
+HEAVY_COLUMNS = ("observaciones","historial_color","historial_atenciones")
+PROJECTIONS = {
+    "completo":  COLUMNS_BASE + COLUMNS_EXTRA,
+    "lista":     ["id_lead","fecha_registro","hora_registro","nombre/alias","apellidos","celular","telefono","correo",
+                  "interes_curso(puede sellecionar varios)","como_enteraste","funnel_etapas","fecha_ultimo_contacto",
+                  "atendido_por","proxima_accion_fecha","proxima_accion_desc","estado_color","amarillo_contador",
+                  "total_atenciones","row_version"],
+    "dashboard": ["id_lead","fecha_registro","interes_curso(puede sellecionar varios)","como_enteraste","funnel_etapas",
+                  "atendido_por","proxima_accion_fecha","total_atenciones","row_version"],
+}
+CAT_CURSOS = [
+    "IA profesionales inmobiliarios","IA educación básica","IA educación universitaria",
+    "IA empresas","IA para gobierno","Inglés","Polivirtual Bach.","Polivirtual Lic."
+]
+CAT_COMO = [
+    "Facebook","Instagram","WhatsApp","Correo electrónico","Sitio web",
+    "Recomendación","Volante/Impreso","Evento/Conferencia","Otro",
+]
+FUNNEL_YELLOW = [
+    "Follow-up (Seguimiento)","Materials (Materiales/flyer/videos)","Bank details (Datos bancarios)",
+    "Proposal (Propuesta)","Negotiation (Negociación)","Nurturing (Nutrición)",
+]
+STAGE_DESC = {
+    "Follow-up (Seguimiento)": "Primeras interacciones y agendar siguiente contacto.",
+    "Materials (Materiales/flyer/videos)": "Se enviaron temarios, flyers o videos.",
+    "Bank details (Datos bancarios)": "Se compartieron datos para pago/inscripción.",
+    "Proposal (Propuesta)": "Propuesta formal enviada.",
+    "Negotiation (Negociación)": "Ajustes/condiciones finales.",
+    "Nurturing (Nutrición)": "Aún no listo; nutrir con contenido.",
+    "Won (Ganado)": "Cerrado con pago.",
+    "Lost (Perdido)": "Descartado o sin interés.",
+    "Contacted (Contactado)": "Contacto inicial.",
+}
+STAGE_COLORS = {
+    "Follow-up (Seguimiento)": "#3b82f6","Materials (Materiales/flyer/videos)": "#10b981","Bank details (Datos bancarios)": "#f59e0b",
+    "Proposal (Propuesta)": "#8b5cf6","Negotiation (Negociación)": "#ef4444","Nurturing (Nutrición)": "#6b7280",
+    "Won (Ganado)": "#22c55e","Lost (Perdido)": "#ef4444","Contacted (Contactado)": "#eab308",
+}
+CONTACT_OUTCOMES = [
+    "📵 No responde","ℹ️ Pide información","✅ Interesado (propuesta)","💳 Envió comprobante","🚫 No interesado",
+]
+STALE_DAYS = 30  # días sin contacto para que un lead abierto pase a 🔴
+OUTCOME_RULES = {
+    "📵 No responde": ("🟡","Follow-up (Seguimiento)",2,"Reintentar contacto"),
+    "ℹ️ Pide información": ("🟡","Materials (Materiales/flyer/videos)",1,"Enviar materiales"),
+    "✅ Interesado (propuesta)": ("🟡","Bank details (Datos bancarios)",1,"Enviar datos bancarios"),
+    "💳 Envió comprobante": ("🟢","Won (Ganado)",0,"Pago confirmado"),
+    "🚫 No interesado": ("🔴","Lost (Perdido)",0,"Cierre por no interés"),
+}
+
+# ===================== Utilidades =====================
+def parse_date_safe(s):
+    if s is None: return None
+    s_str = str(s).strip()
+    if not s_str: return None
+    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%d-%m-%Y"):
+        try:
+            return datetime.strptime(s_str, fmt).date()
+        except ValueError:
+            pass
+    ts = pd.to_datetime(s_str, dayfirst=True, errors="coerce")
+    return ts.date() if pd.notna(ts) else None
+
+_DATE_FORMATS = ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%d-%m-%Y")
+
+def parse_dates_vec(values: pd.Series) -> pd.Series:
+    # Versión por columna de parse_date_safe: una pasada vectorizada por formato y, para lo que
+    # quede sin reconocer, parse_date_safe una sola vez por valor distinto. Devuelve date/None.
+    txt = values.fillna("").astype(str).str.strip()
+    out = pd.Series([None] * len(values), index=values.index, dtype=object)
+    pending = txt != ""
+    for fmt in _DATE_FORMATS:
+        if not pending.any(): break
+        parsed = pd.to_datetime(txt[pending], format=fmt, errors="coerce")
+        hit = parsed.notna()
+        if hit.any():
+            out[hit[hit].index] = parsed[hit].dt.date
+            pending[hit[hit].index] = False
+    if pending.any():
+        rest = txt[pending]
+        memo = {v: parse_date_safe(v) for v in rest.unique()}
+        out[rest.index] = [memo[v] for v in rest]  # lista: conserva None (map() lo volvería NaN)
+    return out
+
+def str_to_list(s: str) -> list[str]:
+    if not s or pd.isna(s): return []
+    return [x.strip() for x in str(s).split("|") if x.strip()]
+
+def list_to_str(vals: list[str]) -> str:
+    return " | ".join([v for v in vals if v])
+
+def clean_space_only(s: str) -> str:
+    if s is None: return ""
+    return re.sub(r"\s+", "", str(s))
+
+def _to_int(s) -> int:
+    try:
+        return int(float(str(s or "0") or 0))
+    except ValueError:
+        return 0
+
+def fold_text(s) -> str:
+    s = unicodedata.normalize("NFKD", str(s or ""))
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).lower().strip()
+
+def digits_only(s) -> str:
+    return re.sub(r"\D", "", str(s or ""))
+
+# ---------- Formato de id_lead (la secuencia vive en storage) ----------
+def format_lead_id(n: int) -> str:
+    return f"L{n:04d}"  # L0001 … L9999, L10000 …
+
+def max_lead_number(ids) -> int:
+    # Semilla de la secuencia: mayor sufijo numérico (o cantidad de ids si ninguno es numérico)
+    s = pd.Series(list(ids), dtype=object).astype(str)
+    nums = pd.to_numeric(s.str.extract(r"(\d+)$", expand=False), errors="coerce").dropna()
+    return int(nums.max()) if len(nums) else len(s)
+
+# ---------- Eventos de historial (una línea de data/lead_events.jsonl) ----------
+def make_event(lead_id: str, ts: str, kind: str, user: str = "", detail: str = "", de: str = "", a: str = "") -> dict:
+    return {"lead_id": str(lead_id), "ts": ts, "type": kind, "user": user, "detail": detail, "from": de, "to": a}
+
+# ===================== Lógica de estado/orden =====================
+def etapa_is_won(etapa: str) -> bool:
+    e = str(etapa or "")
+    return ("Ganado" in e) or e.startswith("Won")
+
+def etapa_is_lost(etapa: str) -> bool:
+    e = str(etapa or "")
+    return ("Perdido" in e) or e.startswith("Lost")
+
+def compute_color(row) -> str:
+    color = str(row.get("estado_color","")).strip()
+    if color in {"🔴","🟡","🟢"}:
+        return color
+    etapa = str(row.get("funnel_etapas","")).strip()
+    ult = parse_date_safe(row.get("fecha_ultimo_contacto",""))
+    if etapa_is_won(etapa): return "🟢"
+    if etapa_is_lost(etapa): return "🔴"
+    if ult and (today() - ult).days > STALE_DAYS: return "🔴"
+    return "🟡"
+
+def compute_colors(df: pd.DataFrame, ref: date | None = None) -> pd.Series:
+    # compute_color para toda la tabla con máscaras: color válido > Won > Lost > STALE_DAYS sin contacto
+    def col(name):
+        return df[name].fillna("").astype(str) if name in df.columns else pd.Series("", index=df.index)
+    color = col("estado_color").str.strip()
+    etapa = col("funnel_etapas").str.strip()
+    won  = etapa.str.contains("Ganado", regex=False) | etapa.str.startswith("Won")
+    lost = etapa.str.contains("Perdido", regex=False) | etapa.str.startswith("Lost")
+    ult  = pd.to_datetime(parse_dates_vec(col("fecha_ultimo_contacto")), errors="coerce")
+    stale = (pd.Timestamp(ref or today()) - ult).dt.days > STALE_DAYS
+    out = pd.Series("🟡", index=df.index, dtype=object)
+    out[stale] = "🔴"
+    out[lost] = "🔴"
+    out[won] = "🟢"
+    valid = color.isin(["🔴","🟡","🟢"])
+    out[valid] = color[valid]
+    return out
+
+def recolor_targets(df: pd.DataFrame, ref: date | None = None) -> pd.Series:
+    # Color que debe quedar guardado: Won → 🟢, Lost → 🔴 y los 🟡 (o sin color válido) se recalculan,
+    # así un lead abierto con más de STALE_DAYS sin contacto pasa a 🔴. Un 🔴/🟢 puesto a mano en un
+    # lead abierto se respeta.
+    color = df["estado_color"].fillna("").astype(str)
+    etapa = df["funnel_etapas"].fillna("").astype(str)
+    won  = etapa.str.contains("Ganado", regex=False) | etapa.str.startswith("Won")
+    lost = etapa.str.contains("Perdido", regex=False) | etapa.str.startswith("Lost")
+    target = color.copy()
+    target[won] = "🟢"
+    target[~won & lost] = "🔴"
+    redo = ~won & ~lost & ~color.isin(["🔴","🟢"])
+    if redo.any():
+        target[redo] = compute_colors(df[redo].assign(estado_color=""), ref)
+    return target
+
+@traced()
+def enrich(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty: return df
+    df = df.copy(deep=False)  # solo se reemplazan/agregan columnas: el original no cambia
+    df["estado_color"] = compute_colors(df)
+    df["_prox"] = parse_dates_vec(df["proxima_accion_fecha"])
+    df["_reg"]  = parse_dates_vec(df["fecha_registro"])
+    df["_ord"]  = df["estado_color"].map({"🔴":0,"🟡":1,"🟢":2}).fillna(9)
+    df = df.sort_values(by=["_ord","_prox","_reg"], ascending=[True,True,False])
+    return df
+
+def add_attention(lead_id: str, old_c: str, new_c: str, nota: str, user: str):
+    # Parche de la atención (contadores como incrementos, no valores absolutos) + eventos de historial
+    ts = ts_now()
+    lid = str(lead_id)
+    patch = {"set": {}, "incr": {"total_atenciones": 1}}
+    events = []
+    if old_c != new_c:
+        events.append(make_event(lid, ts, "color", detail=f"{old_c} → {new_c}", de=old_c, a=new_c))
+        patch["set"]["fecha_cambio_color"] = ts
+    if new_c == "🟡": patch["incr"]["amarillo_contador"] = 1
+    events.append(make_event(lid, ts, "atencion", user or "sin usuario", nota or "sin nota"))
+    return patch, events
+
+def apply_outcome(row, outcome: str, nota: str, user: str):
+    color, stage, delta, desc = OUTCOME_RULES[outcome]
+    next_date = today() + timedelta(days=delta) if delta > 0 else None
+    next_desc = (row.get("proxima_accion_desc","") or desc)
+    nota_final = nota or outcome
+    return color, stage, next_date, next_desc, nota_final
@@ -0,0 +1,194 @@
+# crm/history.py — historial del lead: textos heredados y almacén de eventos
+from __future__ import annotations
+import functools
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from .backup import run_backup
+from .config import EVENTS_PATH, EVENTS_MIGRATED_TAG, EVENTS_MIGRATING_TAG, SNAPSHOT_DIR, ts_now
+from .domain import make_event
+from .storage import commit_ops, load_data
+from .tracing import traced, trace_io, file_lock
+
+# ---------- Historial unificado ----------
+_TS = r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})"
+def _rows_color(t):
+    out=[]
+    for s in (t or "").splitlines():
+        s=s.strip()
+        if not s: continue
+        m=re.match(rf"^{_TS}\s*\|\s*(.+)$",s)
+        if m:
+            ts,rest=m.groups(); m2=re.search(r"([🔴🟡🟢])\s*→\s*([🔴🟡🟢])",rest)
+            out.append({"Fecha":ts,"Tipo":"Cambio de color","Usuario":"","Detalle":rest,"De":(m2.group(1) if m2 else ""),"A":(m2.group(2) if m2 else "")})
+        else:
+            out.append({"Fecha":"","Tipo":"Cambio de color","Usuario":"","Detalle":s,"De":"","A":""})
+    return out
+
+def _rows_att(t):
+    out=[]
+    for s in (t or "").splitlines():
+        s=s.strip()
+        if not s: continue
+        m=re.match(rf"^{_TS}\s*\|\s*([^|]+)\|\s*(.*)$",s)
+        if m:
+            ts,u,nota=m.groups()
+            out.append({"Fecha":ts,"Tipo":"Atención","Usuario":u.strip(),"Detalle":nota.strip(),"De":"","A":""})
+        else:
+            out.append({"Fecha":"","Tipo":"Atención","Usuario":"","Detalle":s,"De":"","A":""})
+    return out
+
+def _rows_obs(t):
+    out=[]; first=True
+    for s in (t or "").splitlines():
+        s=s.rstrip()
+        if not s: continue
+        if first and not re.match(rf"^{_TS}",s):
+            out.append({"Fecha":"","Tipo":"Observación","Usuario":"","Detalle":s,"De":"","A":""}); first=False; continue
+        first=False
+        m=re.match(rf"^{_TS}\s*\|\s*([^|]+)\|\s*(.*)$",s)
+        if m:
+            ts,u,obs=m.groups()
+            out.append({"Fecha":ts,"Tipo":"Observación","Usuario":u.strip(),"Detalle":obs.strip(),"De":"","A":""})
+        else:
+            out.append({"Fecha":"","Tipo":"Observación","Usuario":"","Detalle":s,"De":"","A":""})
+    return out
+
+@traced()
+def history_df(row) -> pd.DataFrame:
+    # Eventos del lead (lectura por offset) + lo que quede en los textos heredados sin migrar
+    rows = [{"Fecha": e.get("ts",""), "Tipo": EVENT_TYPES.get(e.get("type"), e.get("type","")), "Usuario": e.get("user",""),
+             "Detalle": e.get("detail",""), "De": e.get("from",""), "A": e.get("to","")} for e in read_events(row.get("id_lead",""))]
+    rows += _rows_color(row.get("historial_color","")) + _rows_att(row.get("historial_atenciones","")) + _rows_obs(row.get("observaciones",""))
+    dfh = pd.DataFrame(rows, columns=["Fecha","Tipo","Usuario","Detalle","De","A"])
+    if dfh.empty: return dfh
+    dfh["Fecha"] = pd.to_datetime(dfh["Fecha"], errors="coerce")
+    order = {"Atención":0,"Cambio de color":1,"Observación":2}
+    dfh["__ord"] = dfh["Tipo"].map(order).fillna(9).astype(int)
+    dfh = dfh.sort_values(["Fecha","__ord"], ascending=[False,True], na_position="last").drop(columns="__ord")
+    return dfh
+
+# ---------- Almacén de eventos (historial normalizado) ----------
+# data/lead_events.jsonl: una línea por evento {lead_id, ts, type, user, detail, from, to}, solo se
+# agrega. El índice por lead (offsets de byte) vive en memoria del proceso, se pone al día leyendo
+# solo la cola nueva del archivo y se guarda en data/.snapshots para arranques en frío.
+EVENT_TYPES = {"atencion": "Atención", "color": "Cambio de color", "observacion": "Observación", "fusion": "Fusión"}
+_EVENT_FROM_TIPO = {v: k for k, v in EVENT_TYPES.items()}
+EVENTS_INDEX_PATH = SNAPSHOT_DIR / "lead_events.idx.json"
+
+
+def append_events(events: list[dict]):
+    events = [e for e in events if e]
+    if not events: return
+    with file_lock(EVENTS_PATH):
+        with open(EVENTS_PATH, "ab") as f:
+            for e in events:
+                f.write((json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            trace_io(written=f.tell())
+
+@functools.cache
+def _events_index() -> dict:
+    idx = {"lock": threading.Lock(), "size": 0, "offsets": defaultdict(list)}
+    try:
+        saved = json.loads(EVENTS_INDEX_PATH.read_text(encoding="utf-8"))
+        size = int(saved["size"])
+        with open(EVENTS_PATH, "rb") as f:  # válido solo si el archivo sigue conteniendo ese prefijo
+            f.seek(size - 1)
+            if size and f.read(1) == b"\n":
+                idx["size"] = size
+                idx["offsets"].update({k: [tuple(x) for x in v] for k, v in saved["offsets"].items()})
+    except Exception:
+        pass
+    return idx
+
+def _events_catch_up(idx: dict):
+    if not EVENTS_PATH.exists(): return
+    size = EVENTS_PATH.stat().st_size
+    if size < idx["size"]:  # archivo reemplazado: se reindexa completo
+        idx["size"], idx["offsets"] = 0, defaultdict(list)
+    if size == idx["size"]: return
+    start = idx["size"]
+    with open(EVENTS_PATH, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if not line.endswith(b"\n"): break  # escritura en curso: se indexa en la siguiente pasada
+            try:
+                idx["offsets"][str(json.loads(line)["lead_id"])].append((pos, len(line)))
+            except (ValueError, KeyError):
+                pass
+            pos += len(line)
+    idx["size"] = pos
+    if pos - start > (1 << 20):  # se persiste solo tras ponerse al día con una cola grande
+        try:
+            SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = EVENTS_INDEX_PATH.with_suffix(".json.tmp")
+            tmp.write_text(json.dumps({"size": pos, "offsets": idx["offsets"]}), encoding="utf-8")
+            tmp.replace(EVENTS_INDEX_PATH)
+        except Exception:
+            pass
+
+def read_events(lead_id: str) -> list[dict]:
+    # Solo se leen los bytes de los eventos de este lead (seek por offset)
+    idx = _events_index()
+    with idx["lock"]:
+        _events_catch_up(idx)
+        spans = list(idx["offsets"].get(str(lead_id), []))
+    if not spans: return []
+    out = []
+    with open(EVENTS_PATH, "rb") as f:
+        for off, ln in spans:
+            f.seek(off)
+            out.append(json.loads(f.read(ln)))
+    return out
+
+HISTORY_COLUMNS = ["historial_color","historial_atenciones","observaciones"]
+
+def _event_key(e: dict) -> tuple:
+    return tuple(str(e.get(k,"")) for k in ("lead_id","ts","type","user","detail","from","to"))
+
+def _stored_event_keys() -> Counter:
+    if not EVENTS_PATH.exists(): return Counter()
+    with open(EVENTS_PATH, "rb") as f:
+        return Counter(_event_key(json.loads(line)) for line in f if line.endswith(b"\n"))
+
+def migrate_history_to_events() -> int:
+    """Migración única: pasa historial_color / historial_atenciones / observaciones a eventos.
+
+    Antes de vaciar los textos se asegura el respaldo del día (síncrono: lo que se borra queda en él).
+    Un lock evita dos migraciones a la vez, y si una anterior se cortó (queda EVENTS_MIGRATING_TAG)
+    no se vuelven a agregar los eventos que ya llegaron al almacén."""
+    if EVENTS_MIGRATED_TAG.exists(): return 0
+    with file_lock(EVENTS_MIGRATED_TAG):
+        if EVENTS_MIGRATED_TAG.exists(): return 0  # la terminó otro arranque mientras se esperaba
+        df = load_data("completo")
+        events, ops = [], []
+        for rec in df[["id_lead"] + HISTORY_COLUMNS].to_dict("records"):
+            rows = _rows_color(rec["historial_color"]) + _rows_att(rec["historial_atenciones"]) + _rows_obs(rec["observaciones"])
+            for r in rows:
+                events.append(make_event(rec["id_lead"], r["Fecha"], _EVENT_FROM_TIPO[r["Tipo"]], r["Usuario"], r["Detalle"], r["De"], r["A"]))
+            if any(rec[c] for c in HISTORY_COLUMNS):
+                ops.append({"op":"set","id":rec["id_lead"],"values":{c: "" for c in HISTORY_COLUMNS}})
+        if ops:
+            run_backup()
+            if EVENTS_MIGRATING_TAG.exists():
+                seen = _stored_event_keys()
+                pending = []
+                for e in events:
+                    k = _event_key(e)
+                    if seen[k]: seen[k] -= 1
+                    else: pending.append(e)
+                events = pending
+            EVENTS_MIGRATING_TAG.write_text(ts_now(), encoding="utf-8")
+            append_events(events)
+            commit_ops(ops)  # solo las filas con historial, por lead: no pisa escrituras concurrentes
+        EVENTS_MIGRATED_TAG.write_text(ts_now(), encoding="utf-8")
+        EVENTS_MIGRATING_TAG.unlink(missing_ok=True)
+    return len(events)
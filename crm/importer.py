@@ -0,0 +1,160 @@
+# crm/importer.py — importación masiva CSV/XLSX
+from __future__ import annotations
+import re
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from .domain import COLUMNS_BASE, CAT_CURSOS, CAT_COMO, fold_text, list_to_str, parse_dates_vec, make_event
+from .history import append_events
+from .storage import allocate_lead_ids, insert_leads
+
+# ===================== Importación masiva (CSV / XLSX) =====================
+# Exportaciones de campañas (Facebook/Instagram/…): se leen por bloques, los encabezados se mapean a
+# COLUMNS_BASE, teléfonos y catálogos se normalizan por columna y el lote completo se escribe de una
+# sola vez con ids reservados en bloque. Las filas inválidas se reportan con su línea y el motivo.
+IMPORT_CHUNK_ROWS = 5000
+INTERES_COL = "interes_curso(puede sellecionar varios)"
+IMPORT_ALIASES = {  # columna destino → encabezados aceptados (sin acentos/mayúsculas/espacios)
+    "fecha_registro": ["fecha","created_time","created_at","date"],
+    "hora_registro": ["hora","time"],
+    "nombre/alias": ["nombre","alias","name","first_name","full_name","nombre_completo"],
+    "apellidos": ["apellido","last_name","surname"],
+    "genero": ["sexo","gender"],
+    "edad": ["age"],
+    "celular": ["movil","whatsapp","phone","phone_number","mobile"],
+    "telefono": ["tel","telefono_fijo","landline"],
+    "correo": ["email","e_mail","correo_electronico","mail"],
+    INTERES_COL: ["interes","interes_curso","curso","cursos","course"],
+    "como_enteraste": ["canal","fuente","source","platform","plataforma"],
+    "observaciones": ["notas","nota","comentarios","notes"],
+    "proxima_accion_fecha": [],
+    "proxima_accion_desc": [],
+}
+IMPORT_COMO_ALIASES = {"fb": "Facebook", "ig": "Instagram", "wa": "WhatsApp", "email": "Correo electrónico",
+                       "correo": "Correo electrónico", "web": "Sitio web", "referido": "Recomendación"}
+
+def _import_key(s) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", fold_text(s)).strip("_")
+
+def import_mapping(headers) -> dict[str, str]:
+    """Encabezado de origen → columna de COLUMNS_BASE (si dos encabezados apuntan a la misma, gana el primero)."""
+    lookup = {}
+    for col, aliases in IMPORT_ALIASES.items():
+        for a in [col] + aliases:
+            lookup.setdefault(_import_key(a), col)
+    out = {}
+    for h in headers:
+        col = lookup.get(_import_key(h))
+        if col and col not in out.values():
+            out[h] = col
+    return out
+
+def _cell_str(v) -> str:
+    if v is None: return ""
+    if isinstance(v, float) and v.is_integer(): return str(int(v))  # teléfonos leídos como número
+    return str(v)
+
+def _import_chunks(src, name: str, chunksize: int):
+    if str(name).lower().endswith((".xlsx", ".xlsm")):
+        try:
+            import openpyxl
+        except ImportError:
+            raise RuntimeError("Para importar .xlsx se requiere openpyxl (pip install openpyxl).")
+        wb = openpyxl.load_workbook(src, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [_cell_str(h) for h in next(rows, ())]
+            buf = []
+            for r in rows:
+                buf.append([_cell_str(v) for v in (list(r) + [None] * len(header))[:len(header)]])
+                if len(buf) >= chunksize:
+                    yield pd.DataFrame(buf, columns=header); buf = []
+            if buf: yield pd.DataFrame(buf, columns=header)
+        finally:
+            wb.close()
+    else:
+        yield from pd.read_csv(src, dtype=str, keep_default_na=False, encoding="utf-8-sig", chunksize=chunksize)
+
+def _catalog_map(values: pd.Series, parse) -> list:
+    # Una validación por valor distinto (las campañas repiten pocos valores miles de veces)
+    memo = {v: parse(v) for v in values.unique()}
+    return [memo[v] for v in values]  # lista: conserva None (map() lo volvería NaN)
+
+def _import_chunk(raw: pd.DataFrame, mapping: dict, como_default: str, fecha: str, hora: str):
+    # Devuelve las filas ya mapeadas a COLUMNS_BASE y el motivo de rechazo por fila ("" = válida)
+    df = pd.DataFrame({c: "" for c in COLUMNS_BASE}, index=raw.index)
+    for src, col in mapping.items():
+        df[col] = raw[src].fillna("").astype(str).str.strip()
+    motivo = pd.Series("", index=raw.index)
+    def reject(mask, why):
+        motivo[mask & (motivo == "")] = why
+
+    for c in ("celular", "telefono"):
+        df[c] = df[c].str.replace(r"\s+", "", regex=True)  # mismas reglas que clean_space_only
+    reject((df[["nombre/alias","celular","telefono","correo"]] == "").all(axis=1), "sin nombre ni contacto")
+    reject((df["correo"] != "") & ~df["correo"].str.contains("@", regex=False), "correo inválido")
+
+    cursos = {fold_text(c): c for c in CAT_CURSOS}
+    def parse_interes(v):
+        hits = [cursos.get(fold_text(x)) for x in re.split(r"[|,;]", v) if x.strip()]
+        return None if None in hits else list_to_str(hits)
+    interes = pd.Series(_catalog_map(df[INTERES_COL], parse_interes), index=df.index, dtype=object)
+    reject(interes.isna(), "interés fuera de catálogo")
+    df[INTERES_COL] = interes.fillna("")
+
+    canales = {fold_text(c): c for c in CAT_COMO} | IMPORT_COMO_ALIASES
+    como = pd.Series(_catalog_map(df["como_enteraste"], lambda v: canales.get(fold_text(v)) if v else como_default),
+                     index=df.index, dtype=object)
+    reject(como.isna(), "canal fuera de catálogo")
+    df["como_enteraste"] = como.fillna("")
+
+    raw_fecha = df["fecha_registro"]
+    parsed = parse_dates_vec(raw_fecha.str.slice(0, 10))
+    reject((raw_fecha != "") & parsed.isna(), "fecha_registro inválida")
+    df["fecha_registro"] = [d.isoformat() if d else fecha for d in parsed]
+    hora_src = raw_fecha.str.extract(r"(\d{1,2}:\d{2}(?::\d{2})?)", expand=False).fillna("")
+    df["hora_registro"] = df["hora_registro"].where(df["hora_registro"] != "", hora_src).replace("", hora)
+    return df, motivo
+
+def import_leads(src, name: str, user: str = "", como_default: str = CAT_COMO[0], now: datetime | None = None,
+                 chunksize: int = IMPORT_CHUNK_ROWS) -> dict:
+    """Importa leads desde un CSV/XLSX (ruta o archivo subido) en una sola escritura.
+
+    Devuelve {"importados", "ids", "rechazados" (DataFrame con linea/motivo), "mapeo", "segundos"}."""
+    t0 = time.perf_counter()
+    now = now or datetime.now()
+    fecha, hora, ts = now.date().isoformat(), now.strftime("%H:%M:%S"), now.strftime("%Y-%m-%d %H:%M:%S")
+    mapping, ok_parts, bad_parts, line = None, [], [], 2  # línea 1 = encabezados
+    for raw in _import_chunks(src, name, chunksize):
+        raw.index = pd.RangeIndex(line, line + len(raw)); line += len(raw)
+        if mapping is None:
+            mapping = import_mapping(raw.columns)
+            if not mapping:
+                raise ValueError("No se reconoció ninguna columna (nombre, celular, correo, …).")
+        rows, motivo = _import_chunk(raw, mapping, como_default, fecha, hora)
+        bad = motivo != ""
+        ok_parts.append(rows[~bad])
+        if bad.any():
+            bad_parts.append(raw[bad].assign(motivo=motivo[bad]))
+    rows = pd.concat(ok_parts, ignore_index=True) if ok_parts else pd.DataFrame(columns=COLUMNS_BASE)
+    rejected = (pd.concat(bad_parts).rename_axis("linea").reset_index() if bad_parts
+                else pd.DataFrame(columns=["linea","motivo"]))
+    ids = allocate_lead_ids(len(rows)) if len(rows) else []
+    if ids:
+        prox = (now.date() + timedelta(days=3)).isoformat()
+        obs = rows["observaciones"]
+        rows = rows.assign(
+            id_lead=ids, funnel_etapas="Follow-up (Seguimiento)", fecha_ultimo_contacto=rows["fecha_registro"],
+            observaciones="", atendido_por=user,
+            proxima_accion_fecha=rows["proxima_accion_fecha"].replace("", prox),
+            estado_color="🟡", fecha_cambio_color=ts, amarillo_contador="1",
+            historial_color="", historial_atenciones="", total_atenciones="0", row_version="0",
+        )
+        insert_leads(rows)
+        events = [make_event(lid, ts, "color", detail="∅ → 🟡", de="∅", a="🟡") for lid in ids]
+        events += [make_event(lid, ts, "observacion", user or "importación", o) for lid, o in zip(ids, obs) if o]
+        append_events(events)
+    return {"importados": len(ids), "ids": (ids[0], ids[-1]) if ids else None, "rechazados": rejected,
+            "mapeo": mapping or {}, "segundos": round(time.perf_counter() - t0, 2)}
@@ -0,0 +1,187 @@
+# crm/maintenance.py — mantenimiento nocturno: recolor por bloques y colas del día por responsable
+from __future__ import annotations
+import json
+import re
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime, date
+
+import pandas as pd
+
+from .config import QUEUE_DIR
+from .domain import fold_text, make_event, parse_date_safe, parse_dates_vec, compute_color, recolor_targets
+from .history import append_events
+from .storage import (get_store, data_version, compact_journal, _versioned_ops, _after_write, _row_transitions,
+                      _version_key)
+from .tracing import file_lock, _stat_key
+
+# ===================== Mantenimiento nocturno (recolor + colas por responsable) =====================
+# `python -m crm mantenimiento` (cron, p. ej. a las 02:00) recorre la tabla por bloques, guarda solo
+# los leads cuyo color cambió (Won/Lost incoherentes, 🟡 con más de STALE_DAYS sin contacto → 🔴, con
+# su evento de historial) y escribe la cola del día en data/queues/queue.json: por responsable, los
+# ids con próxima acción hoy o vencida, más los totales por color. Seguimiento lee esa cola en vez
+# de recalcularla; cada guardado la mantiene al día por delta (como los agregados del dashboard).
+# Además deja un resumen de texto por responsable en data/queues/<día>/<responsable>.txt.
+MAINT_CHUNK_ROWS = 20000
+QUEUE_PATH = QUEUE_DIR / "queue.json"
+QUEUE_KEEP_DAYS = 14
+QUEUE_LABELS = {"overdue": "Vencidos", "today": "Hoy"}
+
+def _owner(r) -> str:
+    return str(r.get("atendido_por","") or "") or "Sin asignar"
+
+def _bucket(prox: date | None, day: date) -> str | None:
+    if prox is None or prox > day: return None
+    return "today" if prox == day else "overdue"
+
+def _queue_empty(day: date) -> dict:
+    return {"day": day.isoformat(), "at": "", "version": None, "colors": {}, "owners": {}}
+
+def _queue_bump(q: dict, r: dict, sign: int):
+    # Suma (sign=+1) o quita (sign=-1) un lead de su cubeta y de los totales por color
+    c = compute_color(r)
+    q["colors"][c] = q["colors"].get(c, 0) + sign
+    b = _bucket(parse_date_safe(r.get("proxima_accion_fecha","")), date.fromisoformat(q["day"]))
+    if b is None: return
+    lid, owner = str(r.get("id_lead","")), _owner(r)
+    ids = q["owners"].setdefault(owner, {"today": [], "overdue": []})[b]
+    if sign > 0 and lid not in ids: ids.append(lid)
+    elif sign < 0 and lid in ids: ids.remove(lid)
+
+def _queue_load() -> dict | None:
+    try:
+        return json.loads(QUEUE_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+def _queue_save(q: dict):
+    QUEUE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = QUEUE_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(q, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(QUEUE_PATH)
+
+_queue_cache = {"key": None, "q": None}
+
+def read_queue() -> dict | None:
+    # Se relee solo si queue.json cambió (huella stat); el dict es compartido, de solo lectura
+    key = _stat_key(QUEUE_PATH)
+    if key is None: return None
+    if _queue_cache["key"] != key:
+        _queue_cache["q"], _queue_cache["key"] = _queue_load(), key
+    return _queue_cache["q"]
+
+def current_queue(day: date) -> dict | None:
+    """La cola si es la de `day` y está al día con los datos; si no, None (el llamador recalcula)."""
+    q = read_queue()
+    if q is None or q.get("day") != day.isoformat() or q.get("version") != _version_key(data_version()):
+        return None
+    return q
+
+def queue_ids(q: dict, bucket: str, owner: str | None = None) -> list[str]:
+    owners = [owner] if owner else list(q["owners"])
+    return [lid for o in owners for lid in q["owners"].get(o, {}).get(bucket, [])]
+
+def _queue_after_write(ops: list[dict], olds: dict, prev_version, new_version):
+    # Mismo criterio que _agg_after_write: solo si la cola estaba al día con la versión previa
+    if not QUEUE_PATH.exists(): return
+    with file_lock(QUEUE_PATH):
+        q = _queue_load()
+        if q is None or q.get("version") != _version_key(prev_version): return
+        for old, new in _row_transitions(ops, olds):
+            if old is not None: _queue_bump(q, old, -1)
+            if new is not None: _queue_bump(q, new, +1)
+        q["version"] = _version_key(new_version)
+        _queue_save(q)
+
+def _persist_colors(ids: list[str], day: date, ts: str) -> tuple[int, tuple | None, tuple | None]:
+    # Recalcula sobre el estado actual de cada lead (dentro de la transacción), no sobre el bloque
+    # leído: un guardado concurrente no se pisa. Devuelve (recoloreados, huella antes, huella después),
+    # ambas medidas con el lock tomado; sin cambios, (0, None, None).
+    with get_store().transaction() as tx:
+        prev = data_version()
+        cur = tx.get_many(ids)
+        if not cur: return 0, None, None
+        rows = pd.DataFrame(list(cur.values()))
+        target = recolor_targets(rows, day)
+        changed = [(lid, old, new) for lid, old, new in zip(rows["id_lead"], rows["estado_color"], target) if old != new]
+        if not changed: return 0, None, None
+        ops = _versioned_ops([{"op":"set","id":lid,"values":{"estado_color":new,"fecha_cambio_color":ts}}
+                              for lid, _, new in changed], cur)
+        tx.apply(ops)
+    _after_write(ops, cur, prev, tx.version)
+    append_events([make_event(lid, ts, "color", "sistema", f"{old or '∅'} → {new} (mantenimiento)", old or "∅", new)
+                   for lid, old, new in changed])
+    return len(changed), prev, tx.version
+
+def _digest_slug(owner: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", fold_text(owner)).strip("_") or "sin_asignar"
+
+def _write_digests(q: dict, lines: dict):
+    # Un .txt por responsable con sus pendientes (vencidos primero, por fecha)
+    out = QUEUE_DIR / q["day"]
+    if out.exists(): shutil.rmtree(out)
+    out.mkdir(parents=True)
+    for owner in q["owners"]:
+        txt = [f"Pendientes de {owner} — {q['day']} (generado {q['at']})", ""]
+        for b, label in QUEUE_LABELS.items():
+            items = sorted(lines[owner][b])
+            txt.append(f"{label} ({len(items)})")
+            txt += [f"  {prox}  {lid}  {desc}" for prox, lid, desc in items] or ["  —"]
+            txt.append("")
+        (out / f"{_digest_slug(owner)}.txt").write_text("\n".join(txt), encoding="utf-8")
+
+def _prune_digests(day: date, keep_days: int):
+    if not QUEUE_DIR.exists(): return
+    for d in QUEUE_DIR.iterdir():
+        try:
+            old = (day - date.fromisoformat(d.name)).days > keep_days
+        except ValueError:
+            continue
+        if old and d.is_dir(): shutil.rmtree(d, ignore_errors=True)
+
+def run_maintenance(day: date | None = None, chunksize: int = MAINT_CHUNK_ROWS, passes: int = 3) -> dict:
+    """Recolor por bloques + cola del día y resúmenes por responsable.
+
+    Si otro proceso escribe durante la pasada, se repite (hasta `passes`); la cola solo queda marcada
+    como al día con una pasada sin escrituras ajenas."""
+    t0 = time.perf_counter()
+    day = day or date.today()  # fecha del servidor: corre fuera de cualquier sesión
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    store = get_store()
+    store.ensure()
+    recolored = 0
+    for n in range(1, passes + 1):
+        compact_journal()
+        ver = data_version()
+        q, lines, rows, moved = _queue_empty(day), defaultdict(lambda: {"today": [], "overdue": []}), 0, []
+        for chunk in store.iter_chunks(chunksize):
+            rows += len(chunk)
+            target = recolor_targets(chunk, day)
+            moved += chunk.loc[target != chunk["estado_color"], "id_lead"].astype(str).tolist()
+            chunk = chunk.assign(estado_color=target)
+            for c, k in chunk["estado_color"].value_counts().items():
+                q["colors"][c] = q["colors"].get(c, 0) + int(k)
+            prox = parse_dates_vec(chunk["proxima_accion_fecha"])
+            due = prox.map(lambda d: d is not None and d <= day).astype(bool)
+            for r, p in zip(chunk[due].to_dict("records"), prox[due]):
+                b, owner = _bucket(p, day), _owner(r)
+                q["owners"].setdefault(owner, {"today": [], "overdue": []})[b].append(r["id_lead"])
+                desc = " · ".join(x for x in (f"{r['nombre/alias']} {r['apellidos']}".strip(), r["celular"] or r["telefono"],
+                                              r["proxima_accion_desc"]) if x)
+                lines[owner][b].append((p.isoformat(), r["id_lead"], desc))
+        # Se guardan al terminar de leer (con el lector cerrado), por bloques de `chunksize` ids
+        for i in range(0, len(moved), chunksize):
+            n_rec, before, after = _persist_colors(moved[i:i + chunksize], day, ts)
+            recolored += n_rec
+            if before is not None and before == ver: ver = after  # las escrituras propias no invalidan la pasada
+        if data_version() == ver: break
+    q["at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with file_lock(QUEUE_PATH):
+        q["version"] = _version_key(ver) if data_version() == ver else None  # None: la UI recalcula
+        _queue_save(q)
+    _write_digests(q, lines)
+    _prune_digests(day, QUEUE_KEEP_DAYS)
+    return {"dia": q["day"], "filas": rows, "recoloreados": recolored, "pasadas": n, "al_dia": q["version"] is not None,
+            "colas": {o: (len(b["today"]), len(b["overdue"])) for o, b in sorted(q["owners"].items())},
+            "segundos": round(time.perf_counter() - t0, 2)}
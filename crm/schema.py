@@ -0,0 +1,90 @@
+# crm/schema.py — representación tipada de la tabla de leads (solo en memoria; en disco todo es texto)
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .domain import COUNTER_COLUMNS, parse_dates_vec
+
+# ===================== Esquema tipado =====================
+# Columnas de pocos valores distintos → category (value_counts/groupby sobre códigos), contadores →
+# Int64 y fechas → datetime64. El CSV guarda textos "sucios" ("", "3/9/2025", " 7"): lo que no
+# coincide con su forma canónica se guarda aparte (el texto original y el valor tipado de ese
+# momento) y to_strings lo devuelve tal cual, salvo que el valor se haya editado después.
+CATEGORY_COLUMNS = ("estado_color","funnel_etapas","atendido_por","como_enteraste","genero",
+                    "interes_curso(puede sellecionar varios)")
+DATE_COLUMNS = ("fecha_registro","fecha_ultimo_contacto","proxima_accion_fecha")
+
+class _RawText:
+    """Textos originales que difieren de la forma canónica: col → (texto, valor tipado al cargar)."""
+    def __init__(self, cols: dict):
+        self.cols = cols
+
+    def __deepcopy__(self, memo):
+        return self  # inmutable: pandas copia los attrs en cada operación y no hace falta duplicarlo
+
+def _canonical(s: pd.Series) -> pd.Series:
+    # Texto que escribiría to_strings para cada valor tipado
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.astype(object).where(s.notna(), "")
+    if pd.api.types.is_datetime64_any_dtype(s.dtype) or isinstance(s.dtype, pd.Int64Dtype):
+        codes, uniq = pd.factorize(s, use_na_sentinel=False)  # se formatea cada valor distinto una vez
+        uniq = pd.Series(uniq, dtype=s.dtype)
+        txt = uniq.dt.strftime("%Y-%m-%d") if uniq.dtype.kind == "M" else uniq.astype("string")
+        return pd.Series(txt.fillna("").astype(object).to_numpy()[codes], index=s.index, name=s.name)
+    return s
+
+def is_typed(df: pd.DataFrame) -> bool:
+    return "crm_raw" in df.attrs
+
+def _typed_by_value(txt: pd.Series, conv) -> tuple[pd.Series, pd.Series]:
+    # Se convierte cada texto distinto una sola vez (fechas y contadores repiten mucho) y se
+    # expande por código; devuelve (valores tipados, máscara de textos no canónicos)
+    codes, uniq = pd.factorize(txt)
+    tu = conv(pd.Series(uniq, dtype=object))
+    typed = pd.Series(tu.array.take(codes), index=txt.index, name=txt.name)
+    odd = (pd.Series(uniq, dtype=object) != _canonical(tu)).to_numpy()[codes]
+    return typed, pd.Series(odd, index=txt.index)
+
+def _to_counter(u: pd.Series) -> pd.Series:
+    # Como domain._to_int: "3.5" → 3 (trunca); texto no numérico, inf o fuera de int64 → <NA>
+    x = np.trunc(pd.to_numeric(u.str.strip().replace("", "0"), errors="coerce").astype(float))
+    return x.where(np.isfinite(x) & (x.abs() < 2.0**63)).astype("Int64")
+
+_CONVERTERS = {
+    **{c: _to_counter for c in COUNTER_COLUMNS},
+    **{c: lambda u: pd.to_datetime(parse_dates_vec(u), errors="coerce") for c in DATE_COLUMNS},
+}
+
+def to_typed(df: pd.DataFrame) -> pd.DataFrame:
+    """Tabla de textos (como sale del almacenamiento) → tipos compactos; reversible con to_strings."""
+    if is_typed(df): return df
+    out, raw = df.copy(deep=False), {}  # solo se reemplazan columnas completas
+    for c in df.columns:
+        if c not in CATEGORY_COLUMNS and c not in _CONVERTERS: continue
+        txt = df[c].fillna("").astype(str)
+        if c in CATEGORY_COLUMNS:
+            out[c] = txt.astype("category")
+            continue
+        out[c], odd = _typed_by_value(txt, _CONVERTERS[c])
+        if odd.any(): raw[c] = (txt[odd], out[c][odd])
+    out.attrs["crm_raw"] = _RawText(raw)
+    return out
+
+def to_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """Inversa de to_typed: columnas tipadas → texto, con los textos originales no editados intactos."""
+    typed = [c for c in df.columns if isinstance(df[c].dtype, (pd.CategoricalDtype, pd.Int64Dtype))
+             or pd.api.types.is_datetime64_any_dtype(df[c].dtype)]
+    if not typed and not is_typed(df): return df
+    out = df.copy()
+    out.attrs.pop("crm_raw", None)
+    for c in typed:
+        out[c] = _canonical(df[c])
+    held = df.attrs.get("crm_raw")
+    for c, (txt, was) in (held.cols.items() if held else ()):
+        if c not in df.columns: continue
+        idx = txt.index.intersection(df.index)
+        cur, was = df.loc[idx, c], was.loc[idx]
+        same = (cur == was).fillna(False).astype(bool) | (cur.isna() & was.isna())
+        out.loc[idx[same.to_numpy()], c] = txt.loc[idx[same.to_numpy()]]
+    return out
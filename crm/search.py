@@ -0,0 +1,183 @@
+# crm/search.py — índice de búsqueda, duplicados por llave y filtros de la lista
+from __future__ import annotations
+import functools
+import re
+import threading
+from collections import defaultdict
+
+import pandas as pd
+
+from .domain import fold_text, digits_only
+from .storage import data_version, _cached_table
+from .tracing import span, traced
+
+# ===================== Índice de búsqueda (trigramas) =====================
+# Índice invertido por versión de datos: trigramas de nombre/apellidos/correo (sin acentos, en
+# minúsculas) y de los teléfonos solo-dígitos. Una consulta intersecta las listas de sus trigramas
+# y verifica la subcadena solo en los candidatos; se actualiza en sitio cuando se guarda un lead.
+# El mismo índice lleva un hash de llaves de duplicado (teléfono normalizado / correo).
+SEARCH_FIELDS = ["nombre/alias","apellidos","correo","celular","telefono"]
+
+def _trigrams(s: str) -> set[str]:
+    return {s[i:i+3] for i in range(len(s) - 2)}
+
+def dup_keys(rec) -> set[str]:
+    # "951 160 4693", "+52 9511604693" y "9511604693" comparten llave; correos sin mayúsculas
+    keys = set()
+    for c in ("celular","telefono"):
+        d = digits_only(rec.get(c))
+        if len(d) >= 7: keys.add("tel:" + d[-10:])
+    mail = str(rec.get("correo") or "").strip().lower()
+    if "@" in mail: keys.add("mail:" + mail)
+    return keys
+
+class LeadSearchIndex:
+    def __init__(self):
+        self.docs: dict[str, dict] = {}    # id → campos crudos (para actualizar por parche)
+        self.keys: dict[str, tuple] = {}   # id → (textos normalizados, teléfonos solo-dígitos)
+        self.seq: dict[str, int] = {}      # id → posición (desempate estable del ranking)
+        self.text_grams: dict[str, set] = defaultdict(set)
+        self.phone_grams: dict[str, set] = defaultdict(set)
+        self.dup_keys: dict[str, set] = {}                  # id → llaves de duplicado
+        self.dup_index: dict[str, set] = defaultdict(set)   # llave → ids
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "LeadSearchIndex":
+        idx = cls()
+        cols = [c for c in SEARCH_FIELDS if c in df.columns]
+        for rec in df[["id_lead"] + cols].astype(str).to_dict("records"):
+            idx.upsert(rec["id_lead"], rec)
+        return idx
+
+    def _drop_grams(self, lead_id: str):
+        texts, phones = self.keys.pop(lead_id, ((), ()))
+        for g in set().union(*map(_trigrams, texts)):
+            self.text_grams[g].discard(lead_id)
+        for g in set().union(*map(_trigrams, phones)):
+            self.phone_grams[g].discard(lead_id)
+        for k in self.dup_keys.pop(lead_id, ()):
+            self.dup_index[k].discard(lead_id)
+
+    def upsert(self, lead_id: str, values: dict):
+        lead_id = str(lead_id)
+        doc = {**self.docs.get(lead_id, {}), **{k: str(values[k]) for k in SEARCH_FIELDS if k in values}}
+        self._drop_grams(lead_id)
+        nombre, apellidos = fold_text(doc.get("nombre/alias")), fold_text(doc.get("apellidos"))
+        texts = tuple(t for t in (nombre, apellidos, fold_text(doc.get("correo")), f"{nombre} {apellidos}".strip()) if t)
+        phones = tuple(p for p in (digits_only(doc.get("celular")), digits_only(doc.get("telefono"))) if p)
+        self.docs[lead_id], self.keys[lead_id] = doc, (texts, phones)
+        self.seq.setdefault(lead_id, len(self.seq))
+        for g in set().union(*map(_trigrams, texts)):
+            self.text_grams[g].add(lead_id)
+        for g in set().union(*map(_trigrams, phones)):
+            self.phone_grams[g].add(lead_id)
+        self.dup_keys[lead_id] = dup_keys(doc)
+        for k in self.dup_keys[lead_id]:
+            self.dup_index[k].add(lead_id)
+
+    def remove(self, lead_id: str):
+        self._drop_grams(str(lead_id))
+        self.docs.pop(str(lead_id), None)
+
+    def _candidates(self, grams: dict, q: str):
+        if len(q) < 3: return None  # consultas cortas: se verifican todos los documentos
+        posts = sorted((grams.get(g, set()) for g in _trigrams(q)), key=len)
+        return set.intersection(*posts) if posts else set()
+
+    def search(self, q: str, limit: int | None = None) -> list[str]:
+        """Ids que contienen `q` como subcadena, ordenados: exacto < prefijo < subcadena."""
+        qt, qd = fold_text(q), digits_only(q)
+        if not qt: return []
+        found: dict[str, int] = {}
+        cand = self._candidates(self.text_grams, qt)
+        for lid in (self.keys if cand is None else cand):
+            texts = self.keys[lid][0]
+            if any(qt == t for t in texts): found[lid] = 0
+            elif any(t.startswith(qt) for t in texts): found[lid] = 1
+            elif any(qt in t for t in texts): found[lid] = 2
+        if qd and re.fullmatch(r"[\d\s\-.()+]+", str(q).strip()):  # consulta tipo teléfono
+            cand = self._candidates(self.phone_grams, qd)
+            for lid in (self.keys if cand is None else cand):
+                phones = self.keys[lid][1]
+                rank = 0 if qd in phones else 1 if any(p.startswith(qd) for p in phones) else 2 if any(qd in p for p in phones) else None
+                if rank is not None: found[lid] = min(rank, found.get(lid, 9))
+        out = sorted(found, key=lambda lid: (found[lid], self.seq.get(lid, 0)))
+        return out[:limit] if limit else out
+
+    def _age(self, lead_id: str) -> tuple:
+        m = re.search(r"(\d+)$", lead_id)
+        return (int(m.group(1)) if m else float("inf"), self.seq.get(lead_id, 0))
+
+    def duplicates_of(self, values: dict, exclude: str = "") -> list[str]:
+        """Leads que comparten teléfono o correo con `values`, del más antiguo al más nuevo."""
+        ids = set().union(*(self.dup_index.get(k, set()) for k in dup_keys(values))) - {str(exclude)}
+        return sorted(ids, key=self._age)
+
+    def duplicate_groups(self) -> list[list[str]]:
+        # Componentes conexos de las llaves compartidas (unión-búsqueda), sin comparar pares de leads
+        parent: dict[str, str] = {}
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]; x = parent[x]
+            return x
+        for ids in self.dup_index.values():
+            if len(ids) < 2: continue
+            first, *rest = ids
+            parent.setdefault(first, first)
+            for o in rest:
+                parent.setdefault(o, o)
+                a, b = find(first), find(o)
+                if a != b: parent[b] = a
+        groups = defaultdict(list)
+        for x in parent:
+            groups[find(x)].append(x)
+        return sorted((sorted(g, key=self._age) for g in groups.values()), key=lambda g: self._age(g[0]))
+
+@functools.cache
+def _search_holder() -> dict:
+    return {"lock": threading.Lock(), "version": None, "index": None}
+
+def get_search_index() -> LeadSearchIndex:
+    holder = _search_holder()
+    with holder["lock"]:
+        ver = data_version()
+        if holder["index"] is None or holder["version"] != ver:
+            with span("search_index.build"):
+                holder["index"] = LeadSearchIndex.build(_cached_table("lista"))
+            holder["version"] = ver
+        return holder["index"]
+
+@traced()
+def search_ids(q: str, limit: int | None = None) -> list[str]:
+    return get_search_index().search(q, limit)
+
+def find_duplicates(values: dict, exclude: str = "") -> list[str]:
+    return get_search_index().duplicates_of(values, exclude)
+
+def _search_apply_ops(ops: list[dict], prev_version, new_version):
+    # Mantiene el índice al día tras un guardado propio sin reconstruirlo
+    holder = _search_holder()
+    with holder["lock"]:
+        idx = holder["index"]
+        if idx is None or holder["version"] != prev_version:
+            return
+        for op in ops:
+            if op.get("op") == "insert":
+                row = op.get("row") or {}
+                idx.upsert(row.get("id_lead",""), row)
+            elif op.get("op") == "set":
+                vals = {k: v for k, v in (op.get("values") or {}).items() if k in SEARCH_FIELDS}
+                if vals: idx.upsert(op.get("id",""), vals)
+            elif op.get("op") == "delete":
+                idx.remove(op.get("id",""))
+        holder["version"] = new_version
+
+# ---------- Filtros de la lista (búsqueda / responsable / color) ----------
+FILTER_COLORS = ["(Todos)","🔴 Rojo","🟡 Amarillo","🟢 Verde"]
+
+def apply_filters(df: pd.DataFrame, q: str, rp: str, color_idx: int) -> pd.DataFrame:
+    if q:
+        df = df[df["id_lead"].astype(str).isin(set(search_ids(q)))]
+    if rp: df = df[df["atendido_por"].str.lower().str.contains(rp, na=False)]
+    if color_idx: df = df[df["estado_color"] == FILTER_COLORS[color_idx].split(" ")[0]]
+    return df
@@ -0,0 +1,777 @@
+# crm/storage.py — almacenamiento de leads (CSV + bitácora / SQLite) y escrituras por lead
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager, closing
+from pathlib import Path
+
+import pandas as pd
+
+from .config import (DATA_PATH, JOURNAL_PATH, JOURNAL_ENABLED, JOURNAL_COMPACT_BYTES, STORAGE_BACKEND,
+                     DB_PATH, LEAD_SEQ_PATH, SNAPSHOT_DIR)
+from .domain import (COLUMNS_BASE, COLUMNS_EXTRA, COUNTER_COLUMNS, PROJECTIONS, _to_int, compute_colors, format_lead_id,
+                     max_lead_number)
+from .schema import to_strings, to_typed
+from .tracing import traced, trace_io, file_lock, _file_size, _stat_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except Exception:
+    pa = pc = feather = None
+
+# ===================== IO CSV Leads (asegurar columnas + guardado atómico) =====================
+def _replace_csv(df: pd.DataFrame, path: Path):
+    # Escribe a .tmp y renombra; el llamador debe tener el lock de `path`
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    df.to_csv(tmp, index=False, encoding="utf-8")
+    trace_io(written=_file_size(tmp))
+    Path(tmp).replace(path)
+
+def _atomic_to_csv(df: pd.DataFrame, path: Path):
+    with file_lock(path):
+        _replace_csv(df, path)
+
+# ---------- Journal (bitácora append-only) ----------
+# Operaciones soportadas (una por línea JSON):
+#   {"op":"insert","row":{...}}                      → alta de lead
+#   {"op":"set","id":"L0001","values":{col: valor}}  → reemplaza campos
+#   {"op":"append","id":"L0001","values":{col: línea}} → agrega una línea a un campo multilínea
+#   {"op":"incr","id":"L0001","values":{col: n}}     → suma n a un contador
+#   {"op":"delete","id":"L0002"}                     → baja del lead (fusión de duplicados)
+# Las ops por lead llevan "v" (la row_version que dejan) y solo se aplican si la fila aún está por
+# debajo; así el replay es idempotente ante una compactación interrumpida (incr incluido). Un insert
+# de un id ya existente se ignora y un append cuya línea ya cierra el campo no se repite.
+def _journal_read(path: Path = JOURNAL_PATH) -> list[dict]:
+    if not path.exists(): return []
+    ops = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                pass  # línea truncada por un corte a mitad de escritura
+    return ops
+
+def _append_line(cur: str, line: str) -> str:
+    cur = str(cur or "")
+    if cur == line or cur.endswith("\n" + line): return cur
+    return cur + ("\n" if cur else "") + line
+
+
+def _op_value(kind: str, cur, v) -> str:
+    if kind == "append": return _append_line(cur, str(v))
+    if kind == "incr": return str(_to_int(cur) + _to_int(v))
+    return str(v)
+
+def _op_id(op: dict) -> str:
+    return str(op.get("id") or (op.get("row") or {}).get("id_lead",""))
+
+def _apply_ops(df: pd.DataFrame, ops: list[dict]) -> pd.DataFrame:
+    if not ops: return df
+    # Copia superficial: el frame recibido (p. ej. la instantánea compartida) no se toca; cada
+    # columna editada se copia entera antes de escribir en ella (ver `own`)
+    df = df.copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
+    owned: set[str] = set()
+    def own(k):
+        if k not in owned:
+            df[k] = df[k].to_numpy(dtype=object, copy=True) if k in df.columns else ""
+            owned.add(k)
+    hit = df.index[df["id_lead"].astype(str).isin({_op_id(op) for op in ops})]
+    pos = dict(zip(df.loc[hit, "id_lead"].astype(str), hit))
+    new_rows: dict[str, dict] = {}
+    deleted: set[str] = set()
+    for op in ops:
+        kind = op.get("op")
+        if kind == "insert":
+            row = {c: str(v if v is not None else "") for c, v in (op.get("row") or {}).items()}
+            lid = str(row.get("id_lead",""))
+            if lid and lid not in pos and lid not in new_rows:
+                new_rows[lid] = row
+            continue
+        if kind == "delete":
+            deleted.add(str(op.get("id","")))
+            continue
+        lid = str(op.get("id",""))
+        vals = op.get("values") or {}
+        v = op.get("v")
+        if lid in new_rows:
+            rec = new_rows[lid]
+            if v is not None and _to_int(rec.get("row_version")) >= int(v): continue
+            for k, x in vals.items():
+                rec[k] = _op_value(kind, rec.get(k,""), x)
+        elif lid in pos:
+            i = pos[lid]
+            if v is not None and "row_version" in df.columns and _to_int(df.at[i, "row_version"]) >= int(v): continue
+            for k, x in vals.items():
+                own(k)
+                df.at[i, k] = _op_value(kind, df.at[i, k], x)
+    if new_rows:
+        add = pd.DataFrame(list(new_rows.values())).reindex(columns=df.columns, fill_value="")
+        df = pd.concat([df, add], ignore_index=True)
+    if deleted:
+        df = df[~df["id_lead"].astype(str).isin(deleted)].reset_index(drop=True)
+    return df
+
+def _normalize_columns(df: pd.DataFrame, columns: list[str] | None = None) -> pd.DataFrame:
+    columns = columns or COLUMNS_BASE + COLUMNS_EXTRA
+    df = to_strings(df)  # una tabla tipada (crm.schema) vuelve a su texto original
+    for c in columns:
+        if c not in df.columns:
+            df[c] = "0" if c in COUNTER_COLUMNS else ""
+    return df[columns].fillna("")
+
+# ---------- Snapshot Arrow de CSV (huella: mtime, tamaño, hash) ----------
+def _file_digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _snapshot_meta_path(path: Path) -> Path:
+    return SNAPSHOT_DIR / f"{path.name}.json"
+
+def _snapshot_write(path: Path, df: pd.DataFrame, digest: str | None = None):
+    # Se escribe primero el .arrow (nombre único por hash) y luego el .json que lo apunta
+    if feather is None: return
+    try:
+        stt = path.stat()
+        digest = digest or _file_digest(path)
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        arrow = SNAPSHOT_DIR / f"{path.name}.{digest}.arrow"
+        if not arrow.exists():
+            tmp = arrow.with_suffix(".arrow.tmp")
+            feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), tmp, compression="uncompressed")
+            tmp.replace(arrow)
+        meta = {"mtime_ns": stt.st_mtime_ns, "size": stt.st_size, "hash": digest, "file": arrow.name}
+        tmp_meta = _snapshot_meta_path(path).with_suffix(".json.tmp")
+        tmp_meta.write_text(json.dumps(meta), encoding="utf-8")
+        tmp_meta.replace(_snapshot_meta_path(path))
+        for old in SNAPSHOT_DIR.glob(f"{path.name}.*.arrow"):
+            if old.name != arrow.name:
+                old.unlink(missing_ok=True)
+    except Exception:
+        pass  # el snapshot es solo una caché: si falla, se vuelve a leer el CSV
+
+def _snapshot_table(path: Path):
+    if feather is None: return None
+    try:
+        meta = json.loads(_snapshot_meta_path(path).read_text(encoding="utf-8"))
+        arrow = SNAPSHOT_DIR / meta["file"]
+        stt = path.stat()
+        if (stt.st_mtime_ns, stt.st_size) != (meta["mtime_ns"], meta["size"]):
+            # Archivo tocado: solo es válido si el contenido (hash) no cambió
+            if stt.st_size != meta["size"] or _file_digest(path) != meta["hash"]:
+                return None
+            meta.update(mtime_ns=stt.st_mtime_ns)
+            _snapshot_meta_path(path).write_text(json.dumps(meta), encoding="utf-8")
+        return feather.read_table(arrow, memory_map=True)
+    except Exception:
+        return None
+
+def _snapshot_read(path: Path, columns: list[str] | None = None) -> pd.DataFrame | None:
+    # Con `columns` solo se convierten esas columnas del Arrow memory-mapped (el resto ni se toca)
+    table = _snapshot_table(path)
+    if table is None: return None
+    if columns is not None: table = table.select([c for c in columns if c in table.column_names])
+    return table.to_pandas(use_threads=True)
+
+def read_csv_cached(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    df = _snapshot_read(path, columns)
+    if df is None:
+        df = pd.read_csv(path, dtype=str).fillna("")
+        _snapshot_write(path, df)  # completo: el snapshot sirve a todas las proyecciones
+        if columns is not None: df = df[[c for c in columns if c in df.columns]]
+    return df
+
+def read_csv_rows(path: Path, ids: set[str]) -> pd.DataFrame:
+    # Solo las filas de `ids`: filtro sobre el snapshot memory-mapped, sin convertir la tabla entera
+    table = _snapshot_table(path)
+    if table is not None:
+        try:
+            return table.filter(pc.is_in(table["id_lead"], value_set=pa.array(sorted(ids), pa.string()))).to_pandas()
+        except Exception:
+            pass
+    df = read_csv_cached(path)
+    return df[df["id_lead"].astype(str).isin(ids)].reset_index(drop=True)
+
+# ===================== Backends de almacenamiento (CSV / SQLite) =====================
+# Ambos exponen la misma interfaz: ensure / read(columns) / get / write_all / apply(ops) / compact / iter_chunks /
+# export_csv. read(columns) lee solo esas columnas (ver PROJECTIONS); get trae el registro completo de un lead.
+class CsvLeadStore:
+    name = "csv"
+
+    def __init__(self, path: Path = DATA_PATH, journal: Path = JOURNAL_PATH, seq: Path = LEAD_SEQ_PATH):
+        self.path, self.journal, self.seq = path, journal, seq
+
+    def ensure(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            with file_lock(self.path):
+                pd.DataFrame(columns=COLUMNS_BASE + COLUMNS_EXTRA).to_csv(self.path, index=False, encoding="utf-8")
+        else:
+            header = pd.read_csv(self.path, dtype=str, nrows=0).columns
+            if any(c not in header for c in COLUMNS_BASE + COLUMNS_EXTRA):
+                df = pd.read_csv(self.path, dtype=str).fillna("")
+                _atomic_to_csv(_normalize_columns(df), self.path)
+
+    def _read_base(self, columns: list[str] | None = None) -> pd.DataFrame:
+        return read_csv_cached(self.path, columns)
+
+    def _replace(self, df: pd.DataFrame):
+        # Reescritura completa (con lock tomado) + snapshot ya listo para la siguiente lectura
+        _replace_csv(df, self.path)
+        _snapshot_write(self.path, df)
+
+    def read(self, columns: list[str] | None = None) -> pd.DataFrame:
+        trace_io(read=_file_size(self.path) + _file_size(self.journal))
+        df = _apply_ops(self._read_base(columns), _journal_read(self.journal))
+        return df if columns is None else _normalize_columns(df, columns)
+
+    def get(self, lead_id: str) -> dict | None:
+        # Registro completo (con historial heredado) de un solo lead: filtro sobre el snapshot + su bitácora
+        return self._get_many([lead_id]).get(str(lead_id))
+
+    def write_all(self, df: pd.DataFrame):
+        # Guardado completo: el DataFrame ya trae el estado final, la bitácora queda integrada
+        with file_lock(self.path):
+            self._replace(df)
+            self.journal.unlink(missing_ok=True)
+
+    def _get_many(self, ids) -> dict[str, dict]:
+        # Estado en disco de unos pocos leads (con lock tomado): base filtrada + sus ops de la bitácora
+        ids = {str(i) for i in ids}
+        if not ids: return {}
+        ops = [op for op in _journal_read(self.journal) if _op_id(op) in ids]
+        df = _normalize_columns(_apply_ops(read_csv_rows(self.path, ids), ops))
+        return {str(r["id_lead"]): r for r in df.to_dict("records")}
+
+    def _apply_locked(self, ops: list[dict]):
+        if not ops: return
+        if JOURNAL_ENABLED:
+            with open(self.journal, "ab") as f:
+                for op in ops:
+                    f.write((json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                trace_io(written=f.tell())
+        else:
+            self._replace(_normalize_columns(_apply_ops(self._read_base(), ops)))
+
+    def _insert_many_locked(self, df: pd.DataFrame):
+        # Alta masiva: se agregan las filas al final de leads.csv (mismo orden de columnas que el archivo)
+        if df.empty: return
+        header = list(pd.read_csv(self.path, dtype=str, nrows=0).columns)
+        start = _file_size(self.path)
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            df.reindex(columns=header, fill_value="").to_csv(f, index=False, header=False)
+            f.flush()
+            os.fsync(f.fileno())
+        trace_io(written=_file_size(self.path) - start)
+
+    @contextmanager
+    def transaction(self):
+        """Lock exclusivo de leads.csv: leer-comparar-escribir sin que otro proceso se cuele."""
+        with file_lock(self.path):
+            tx = StoreTx(self._get_many, self._apply_locked, self._insert_many_locked)
+            yield tx
+            tx.version = self.version()
+        if JOURNAL_ENABLED and (_stat_key(self.journal) or (0, 0))[1] >= JOURNAL_COMPACT_BYTES:
+            self.compact()
+
+    def apply(self, ops: list[dict]):
+        with self.transaction() as tx:
+            tx.apply(ops)
+
+    def compact(self) -> bool:
+        """Integra la bitácora en leads.csv (una sola reescritura) y la vacía."""
+        if not self.journal.exists(): return False
+        with file_lock(self.path):
+            prev = self.version()
+            ops = _journal_read(self.journal)
+            if ops:
+                self._replace(_normalize_columns(_apply_ops(self._read_base(), ops)))
+            self.journal.unlink(missing_ok=True)
+            new = self.version()
+        # Mismo contenido con otra huella: índice, agregados y cola solo cambian de versión
+        if ops: _after_write([], {}, prev, new)
+        return bool(ops)
+
+    def version(self) -> tuple:
+        return (_stat_key(self.path), _stat_key(self.journal))
+
+    def iter_chunks(self, chunksize: int):
+        """Recorre la tabla por bloques sin cargarla completa (la bitácora se integra antes)."""
+        self.compact()
+        trace_io(read=_file_size(self.path))
+        for chunk in pd.read_csv(self.path, dtype=str, chunksize=chunksize):
+            yield _normalize_columns(chunk)
+
+    def _seq_last(self) -> int | None:
+        try:
+            return int(self.seq.read_text(encoding="utf-8").strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def allocate_ids(self, n: int) -> int:
+        # Reserva n números consecutivos y devuelve el primero; se siembra una vez desde el máximo
+        with file_lock(self.seq):
+            last = self._seq_last()
+            if last is None: last = max_lead_number(self.read(["id_lead","row_version"])["id_lead"])
+            tmp = self.seq.with_suffix(self.seq.suffix + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(str(last + n)); f.flush(); os.fsync(f.fileno())
+            tmp.replace(self.seq)
+        return last + 1
+
+    def peek_id(self) -> int:
+        last = self._seq_last()
+        return self.allocate_ids(0) if last is None else last + 1
+
+    def export_csv(self, dst: Path) -> Path:
+        self.compact()
+        with file_lock(self.path):
+            shutil.copy2(self.path, dst)
+        return dst
+
+class StoreTx:
+    """Operaciones disponibles dentro de `store.transaction()` (lock/BEGIN IMMEDIATE ya tomado).
+
+    Al salir del bloque, `version` es la huella del almacenamiento con esta escritura y ninguna otra
+    (tomada antes de soltar el lock)."""
+    def __init__(self, get_many, apply, insert_many):
+        self.get_many, self.apply, self.insert_many = get_many, apply, insert_many
+        self.version = None
+
+
+def _q(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+SQLITE_INDEXED = ["proxima_accion_fecha","atendido_por","estado_color","funnel_etapas"]
+
+class SqliteLeadStore:
+    name = "sqlite"
+
+    def __init__(self, path: Path = DB_PATH):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(str(self.path), timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _select(self, columns: list[str] | None = None) -> str:
+        return "SELECT " + ", ".join(_q(c) for c in columns or COLUMNS_BASE + COLUMNS_EXTRA) + " FROM leads"
+
+    def ensure(self, migrate: bool = True):
+        fresh = not self.path.exists()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        cols = ", ".join(f"{_q(c)} TEXT NOT NULL DEFAULT ''" for c in COLUMNS_BASE + COLUMNS_EXTRA if c != "id_lead")
+        with closing(self._connect()) as con, con:
+            con.execute(f"CREATE TABLE IF NOT EXISTS leads (id_lead TEXT PRIMARY KEY, {cols})")
+            have = {r[1] for r in con.execute("PRAGMA table_info(leads)")}
+            for c in COLUMNS_BASE + COLUMNS_EXTRA:
+                if c not in have:
+                    dflt = "0" if c in COUNTER_COLUMNS else ""
+                    con.execute(f"ALTER TABLE leads ADD COLUMN {_q(c)} TEXT NOT NULL DEFAULT '{dflt}'")
+            for c in SQLITE_INDEXED:
+                con.execute(f"CREATE INDEX IF NOT EXISTS {_q('ix_leads_' + c)} ON leads ({_q(c)})")
+            con.execute("CREATE TABLE IF NOT EXISTS lead_seq (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        if fresh and migrate and DATA_PATH.exists():
+            migrate_csv_to_sqlite(DATA_PATH, self.path)
+
+    def read(self, columns: list[str] | None = None) -> pd.DataFrame:
+        trace_io(read=_file_size(self.path))  # aproximado: tamaño de la base
+        with closing(self._connect()) as con:
+            df = pd.read_sql_query(self._select(columns) + " ORDER BY rowid", con, dtype=str)
+        return df.fillna("")
+
+    def get(self, lead_id: str) -> dict | None:
+        with closing(self._connect()) as con:
+            r = con.execute(self._select() + " WHERE id_lead = ?", (str(lead_id),)).fetchone()
+        return None if r is None else dict(zip(COLUMNS_BASE + COLUMNS_EXTRA, r))
+
+    def _insert_sql(self) -> str:
+        cols = COLUMNS_BASE + COLUMNS_EXTRA
+        return f"INSERT OR IGNORE INTO leads ({', '.join(_q(c) for c in cols)}) VALUES ({', '.join('?' * len(cols))})"
+
+    def write_all(self, df: pd.DataFrame):
+        rows = df[COLUMNS_BASE + COLUMNS_EXTRA].astype(str).itertuples(index=False, name=None)
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM leads")
+            con.executemany(self._insert_sql(), rows)
+
+    def _get_many(self, con: sqlite3.Connection, ids) -> dict[str, dict]:
+        ids, out = sorted({str(i) for i in ids}), {}
+        for k in range(0, len(ids), 500):
+            chunk = ids[k:k + 500]
+            for r in con.execute(self._select() + f" WHERE id_lead IN ({', '.join('?' * len(chunk))})", chunk):
+                out[r[0]] = dict(zip(COLUMNS_BASE + COLUMNS_EXTRA, r))
+        return out
+
+    def _apply_ops(self, con: sqlite3.Connection, ops: list[dict]):
+        # Cada op se traduce a un INSERT/UPDATE de una sola fila; "v" filtra por row_version
+        cols = set(COLUMNS_BASE + COLUMNS_EXTRA)
+        for op in ops:
+            kind, lid = op.get("op"), str(op.get("id",""))
+            if kind == "insert":
+                row = op.get("row") or {}
+                con.execute(self._insert_sql(), [str(row.get(c,"") or "") for c in COLUMNS_BASE + COLUMNS_EXTRA])
+                continue
+            if kind == "delete":
+                con.execute("DELETE FROM leads WHERE id_lead = ?", (lid,))
+                continue
+            vals = {k: str(v) for k, v in (op.get("values") or {}).items() if k in cols}
+            if not vals: continue
+            if kind == "append":
+                sets = ", ".join(f"{_q(k)} = CASE WHEN {_q(k)} = '' THEN ? ELSE {_q(k)} || char(10) || ? END" for k in vals)
+                params = [x for v in vals.values() for x in (v, v)]
+            elif kind == "incr":
+                sets = ", ".join(f"{_q(k)} = CAST(CAST({_q(k)} AS INTEGER) + ? AS TEXT)" for k in vals)
+                params = [_to_int(v) for v in vals.values()]
+            else:
+                sets = ", ".join(f"{_q(k)} = ?" for k in vals)
+                params = list(vals.values())
+            where, wparams = "id_lead = ?", [lid]
+            if op.get("v") is not None:
+                where, wparams = where + " AND CAST(row_version AS INTEGER) < ?", wparams + [int(op["v"])]
+            con.execute(f"UPDATE leads SET {sets} WHERE {where}", params + wparams)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE: toma el lock de escritura antes de leer, para comparar-y-escribir.
+
+        El COMMIT suelta el lock de SQLite antes de poder medir la huella; el lock de archivo
+        (mismo que el backend CSV) la mantiene libre de escrituras ajenas hasta medirla."""
+        with file_lock(self.path):
+            con = self._connect()
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                tx = StoreTx(lambda ids: self._get_many(con, ids), lambda ops: self._apply_ops(con, ops),
+                             lambda df: con.executemany(self._insert_sql(), df[COLUMNS_BASE + COLUMNS_EXTRA].astype(str).itertuples(index=False, name=None)))
+                yield tx
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+            finally:
+                con.close()
+            tx.version = self.version()
+
+    def apply(self, ops: list[dict]):
+        with self.transaction() as tx:
+            tx.apply(ops)
+
+    def compact(self) -> bool:
+        return False
+
+    def allocate_ids(self, n: int) -> int:
+        with closing(self._connect()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            r = con.execute("SELECT value FROM lead_seq WHERE name = 'id_lead'").fetchone()
+            last = r[0] if r else max_lead_number(x for (x,) in con.execute("SELECT id_lead FROM leads"))
+            con.execute("INSERT OR REPLACE INTO lead_seq (name, value) VALUES ('id_lead', ?)", (last + n,))
+        return last + 1
+
+    def peek_id(self) -> int:
+        with closing(self._connect()) as con:
+            r = con.execute("SELECT value FROM lead_seq WHERE name = 'id_lead'").fetchone()
+        return self.allocate_ids(0) if r is None else r[0] + 1
+
+    def version(self) -> tuple:
+        # Un -wal vacío (lo crea cualquier conexión abierta, p. ej. dentro de una transacción) no es un cambio
+        wal = _stat_key(self.path.with_name(self.path.name + "-wal"))
+        return (_stat_key(self.path), wal if wal and wal[1] else None)
+
+    def iter_chunks(self, chunksize: int):
+        with closing(self._connect()) as con:
+            for chunk in pd.read_sql_query(self._select() + " ORDER BY rowid", con, dtype=str, chunksize=chunksize):
+                yield chunk.fillna("")
+
+    def export_csv(self, dst: Path, chunksize: int = 20000) -> Path:
+        tmp = dst.with_suffix(dst.suffix + ".tmp")
+        with closing(self._connect()) as con, open(tmp, "w", encoding="utf-8", newline="") as f:
+            first = True
+            for chunk in pd.read_sql_query(self._select() + " ORDER BY rowid", con, dtype=str, chunksize=chunksize):
+                chunk.fillna("").to_csv(f, index=False, header=first)
+                first = False
+            if first:
+                pd.DataFrame(columns=COLUMNS_BASE + COLUMNS_EXTRA).to_csv(f, index=False)
+        tmp.replace(dst)
+        return dst
+
+def migrate_csv_to_sqlite(csv_path: Path = DATA_PATH, db_path: Path = DB_PATH) -> int:
+    """Copia única de leads.csv (+ bitácora pendiente) a SQLite. Devuelve cuántos leads migró."""
+    journal = csv_path.with_name(csv_path.stem + ".journal.jsonl")
+    src = CsvLeadStore(csv_path, journal, csv_path.with_name(LEAD_SEQ_PATH.name))
+    df = _normalize_columns(src.read())
+    dst = SqliteLeadStore(db_path)
+    dst.ensure(migrate=False)
+    dst.write_all(df)
+    last = src._seq_last()
+    if last is not None:  # conserva la secuencia (ids de leads ya borrados no se reutilizan)
+        with closing(dst._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO lead_seq (name, value) VALUES ('id_lead', ?)", (last,))
+    return len(df)
+
+def get_store():
+    return SqliteLeadStore() if STORAGE_BACKEND == "sqlite" else CsvLeadStore()
+
+def ensure_csv():
+    get_store().ensure()
+
+def compact_journal() -> bool:
+    return get_store().compact()  # las tablas en caché solo cambian de versión (ver _publish_ops)
+
+# ---------- Escrituras por lead con versión de fila (compare-and-swap) ----------
+class LeadConflictError(Exception):
+    """El lead cambió en disco desde que se leyó y el guardado pisaría esos mismos campos."""
+    def __init__(self, lead_id: str, fields: list[str]):
+        super().__init__(f"{lead_id}: {', '.join(fields) or 'lead inexistente'}")
+        self.lead_id, self.fields = lead_id, fields
+
+def lead_version(rec) -> int:
+    return _to_int((rec or {}).get("row_version"))
+
+def _versioned_ops(ops: list[dict], cur: dict) -> list[dict]:
+    # Cada lead tocado sube su row_version y todas sus ops llevan la versión nueva ("v")
+    inserted = {_op_id(op): op.get("row") or {} for op in ops if op.get("op") == "insert"}
+    out, bumped = [], {}
+    for op in ops:
+        if op.get("op") in ("insert", "delete"):  # ya idempotentes por id
+            out.append(op); continue
+        lid = str(op.get("id",""))
+        rec = cur.get(lid) or inserted.get(lid)
+        if rec is None: continue  # lead inexistente
+        out.append({**op, "v": bumped.setdefault(lid, lead_version(rec) + 1)})
+    out += [{"op":"set","id":lid,"values":{"row_version":str(v)},"v":v} for lid, v in bumped.items()]
+    return out
+
+def _version_key(v) -> list:
+    return json.loads(json.dumps(v))  # tuplas → listas, igual que al leer el JSON
+
+def _record_apply(rec: dict, op: dict) -> dict:
+    rec = dict(rec)
+    for k, v in (op.get("values") or {}).items():
+        rec[k] = _op_value(op.get("op"), rec.get(k,""), v)
+    return rec
+
+def _row_transitions(ops: list[dict], olds: dict):
+    # (fila anterior, fila nueva) por op, encadenando las ops de un mismo lead; None = no existe
+    cur = dict(olds)
+    for op in ops:
+        if op.get("op") == "insert":
+            row = op.get("row") or {}
+            lid = str(row.get("id_lead",""))
+            if lid in cur: continue
+            cur[lid] = row
+            yield None, row
+            continue
+        lid = str(op.get("id",""))
+        old = cur.get(lid)
+        if old is None: continue
+        cur[lid] = None if op.get("op") == "delete" else _record_apply(old, op)
+        yield old, cur[lid]
+
+def _after_write(ops: list[dict], olds: dict, prev, new):
+    # `prev`/`new`: huellas medidas con el lock tomado, antes y después de esta escritura. Releerla
+    # aquí (ya sin lock) podría incluir la de otro proceso, y los derivados quedarían marcados al
+    # día sin su cambio. Índice de búsqueda, agregados y cola del día dependen de este módulo: se
+    # importan al primer guardado.
+    from .aggregates import _agg_after_write
+    from .maintenance import _queue_after_write
+    from .search import _search_apply_ops
+    _publish_ops(ops, prev, new)
+    _search_apply_ops(ops, prev, new)
+    _agg_after_write(ops, olds, prev, new)
+    _queue_after_write(ops, olds, prev, new)
+
+@traced()
+def commit_ops(ops: list[dict]):
+    """Persiste cambios por lead: con bitácora o SQLite cuesta lo que mide el cambio, no la tabla."""
+    ops = [op for op in ops if op]
+    if not ops: return
+    with get_store().transaction() as tx:
+        prev = data_version()
+        cur = tx.get_many({_op_id(op) for op in ops if op.get("op") != "insert"})
+        ops = _versioned_ops(ops, cur)
+        tx.apply(ops)
+    _after_write(ops, cur, prev, tx.version)
+
+@traced()
+def insert_leads(rows: pd.DataFrame):
+    """Alta masiva en una sola escritura (append a leads.csv / executemany en SQLite)."""
+    rows = _normalize_columns(rows)
+    if rows.empty: return
+    with get_store().transaction() as tx:
+        prev = data_version()
+        tx.insert_many(rows)
+    ops = [{"op":"insert","row":r} for r in rows.to_dict("records")]
+    _after_write(ops, {}, prev, tx.version)
+
+@traced()
+def write_lead(lead_id: str, expected_version: int, patch: dict, base: dict | None = None) -> int:
+    """Aplica `patch` ({"set":{}, "append":{}, "incr":{}}) si el lead sigue en `expected_version`.
+
+    Si otro guardado se adelantó y se conoce la fila leída (`base`), se fusiona cuando los campos
+    que cambiaron en disco no chocan con los de `set`; si chocan, LeadConflictError. Devuelve la
+    nueva row_version."""
+    lid = str(lead_id)
+    sets = {k: str(v) for k, v in (patch.get("set") or {}).items()}
+    with get_store().transaction() as tx:
+        prev = data_version()
+        cur = tx.get_many([lid])
+        rec = cur.get(lid)
+        if rec is None: raise LeadConflictError(lid, [])
+        if lead_version(rec) != int(expected_version):
+            if base is None: raise LeadConflictError(lid, sorted(sets) or ["row_version"])
+            moved = {k for k in rec if k != "row_version" and str(rec.get(k,"")) != str(base.get(k,"") or "")}
+            clash = sorted(k for k in moved & sets.keys() if sets[k] != str(rec.get(k,"")))
+            if clash: raise LeadConflictError(lid, clash)
+        ops = [{"op":kind,"id":lid,"values":vals}
+               for kind, vals in (("set", sets), ("append", patch.get("append")), ("incr", patch.get("incr"))) if vals]
+        if not ops: return lead_version(rec)
+        ops = _versioned_ops(ops, cur)
+        tx.apply(ops)
+    _after_write(ops, cur, prev, tx.version)
+    return lead_version(rec) + 1
+
+def data_version() -> tuple:
+    # Huella barata (stat) del almacenamiento: cambia con cualquier escritura
+    return get_store().version()
+
+def get_lead(lead_id: str) -> dict | None:
+    return get_store().get(lead_id)
+
+# Tabla en memoria del proceso, una por proyección (PROJECTIONS), ligada a la huella del
+# almacenamiento: una escritura de otro proceso cambia data_version() y la siguiente lectura
+# recarga. Si "completo" ya está cargada en esa versión, las demás salen de ella sin leer disco.
+# Es una instantánea compartida por todas las sesiones y nunca se modifica: cada guardado de este
+# proceso publica una nueva (versión, df) = la anterior + sus ops, reemplazando la tupla de una vez;
+# _apply_ops solo copia las columnas tocadas y quien ya tenía la anterior la conserva.
+_table_cache = {"lock": threading.Lock(), "views": {}}  # vista → (versión, df)
+
+def _cached_table(view: str = "completo") -> pd.DataFrame:
+    # Tabla compartida (no modificar): lecturas puntuales e índices
+    return _cached_entry(view)[1]
+
+def _cached_entry(view: str) -> tuple:
+    # (versión, df) de la vista; la versión es la que se midió al cargarla
+    cols = PROJECTIONS[view]
+    with _table_cache["lock"]:
+        views, ver = _table_cache["views"], data_version()
+        hit = views.get(view)
+        if hit is None or hit[0] != ver:
+            full = views.get("completo")
+            if full is not None and full[0] == ver:
+                hit = (ver, full[1][cols])
+            else:
+                store = get_store()
+                store.ensure()
+                ver = data_version()
+                hit = (ver, store.read(None if view == "completo" else cols))
+            views[view] = hit
+        return hit
+
+def _view_ops(ops: list[dict], columns) -> list[dict]:
+    # Solo los valores de las columnas de la vista: _apply_ops no le agrega columnas (y no hace falta
+    # reseleccionarlas, que copiaría la tabla entera)
+    cols = set(columns)
+    return [{**op, "values": {k: v for k, v in op["values"].items() if k in cols}} if op.get("values") else op
+            for op in ops]
+
+def _publish_ops(ops: list[dict], prev, new):
+    # Tras un guardado propio: solo avanzan las vistas que estaban en `prev` (si no, se descartan y
+    # se releen). Sin ops (compactación) el contenido es el mismo y solo cambia la versión.
+    with _table_cache["lock"]:
+        views = _table_cache["views"]
+        for key, (ver, df) in list(views.items()):
+            if ver != prev or (ops and not isinstance(key, str)):  # las tipadas se recalculan al pedirlas
+                del views[key]
+            elif ops:
+                views[key] = (new, _apply_ops(df, _view_ops(ops, df.columns)))
+            else:
+                views[key] = (new, df)
+
+def _clear_table_cache():
+    with _table_cache["lock"]:
+        _table_cache["views"].clear()
+
+@traced()
+def load_data(view: str = "completo") -> pd.DataFrame:
+    """Tabla de leads con las columnas de `view`. Copia superficial de la instantánea en caché: el
+    llamador puede agregar o reemplazar columnas completas; para editar celdas en sitio, .copy() antes."""
+    return _cached_table(view).copy(deep=False)
+
+load_data.clear = _clear_table_cache
+
+def load_typed(view: str = "dashboard") -> pd.DataFrame:
+    """Tabla tipada (category / Int64 / datetime64, ver crm.schema) compartida, de solo lectura."""
+    ver, df = _cached_entry(view)
+    key = ("tipada", view)
+    with _table_cache["lock"]:
+        hit = _table_cache["views"].get(key)
+        if hit is not None and hit[0] == ver: return hit[1]
+    typed = to_typed(df)  # fuera del lock: las demás sesiones siguen leyendo
+    with _table_cache["lock"]:
+        views = _table_cache["views"]
+        if views.get(view, (None,))[0] == ver:  # si se publicó otra versión en medio, no se guarda
+            views[key] = (ver, typed)
+    return typed
+
+def load_rows(ids, view: str = "lista") -> pd.DataFrame:
+    """Solo las filas de `ids` (sin copiar la tabla completa)."""
+    df = _cached_table(view)
+    return df[df["id_lead"].isin({str(i) for i in ids})]
+
+@traced()
+def save_data(df: pd.DataFrame):
+    from .aggregates import rebuild_aggregates
+    df = _normalize_columns(df)
+    get_store().write_all(df)
+    load_data.clear()
+    rebuild_aggregates(df)
+
+def allocate_lead_ids(n: int = 1) -> list[str]:
+    """Reserva n ids consecutivos de forma atómica (alta individual o importación masiva)."""
+    first = get_store().allocate_ids(n)
+    return [format_lead_id(first + i) for i in range(n)]
+
+def peek_lead_id() -> str:
+    # Solo informativo: el id definitivo se reserva al guardar
+    return format_lead_id(get_store().peek_id())
+
+# ===================== Autosanación color/etapa =====================
+@traced()
+def heal_and_persist(df: pd.DataFrame) -> pd.DataFrame:
+    # Detecta con máscaras las filas inconsistentes (Won≠🟢, Lost≠🔴, color vacío/inválido)
+    # y persiste solo esas filas; si no hay nada que corregir no escribe.
+    if df.empty: return df
+    etapa = df["funnel_etapas"].fillna("").astype(str)
+    color = df["estado_color"].fillna("").astype(str)
+    won  = etapa.str.contains("Ganado", regex=False) | etapa.str.startswith("Won")
+    lost = etapa.str.contains("Perdido", regex=False) | etapa.str.startswith("Lost")
+    target = color.copy()
+    target[won & (color != "🟢")] = "🟢"
+    target[~won & lost & (color != "🔴")] = "🔴"
+    empty = ~target.isin(["🔴","🟡","🟢"])
+    if empty.any():
+        target[empty] = compute_colors(df[empty].assign(estado_color=target[empty]))
+    changed = target != color
+    if not changed.any():
+        return df
+    df2 = df.copy()
+    df2.loc[changed, "estado_color"] = target[changed]
+    ids = df2.loc[changed, "id_lead"].astype(str)
+    commit_ops([{"op":"set","id":lid,"values":{"estado_color":c}} for lid, c in zip(ids, target[changed])])
+    return df2
@@ -0,0 +1,176 @@
+# crm/tracing.py — spans por rerun y lock de archivo
+from __future__ import annotations
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from .config import PERF_DIR, TRACE_PATH, TRACE_ENABLED, TRACE_MAX_BYTES, TRACE_KEEP
+
+# ===================== Trazas de rendimiento (spans por rerun) =====================
+# Cada rerun abre una traza (página, usuario) en el hilo del script; las funciones calientes abren
+# spans con su duración, bytes leídos/escritos y, en los locks, espera vs. tiempo retenido. Al
+# terminar el rerun la traza se agrega como una línea JSON a data/perf/trace.jsonl, que rota al
+# superar TRACE_MAX_BYTES (trace.jsonl.1 … .TRACE_KEEP). Fuera de un rerun los spans no hacen nada.
+_trace_local = threading.local()
+
+def _trace_cur() -> dict | None:
+    return getattr(_trace_local, "trace", None)
+
+@contextmanager
+def span(name: str, **attrs):
+    tr = _trace_cur()
+    if tr is None:
+        yield {}
+        return
+    s = {"name": name, "depth": len(tr["stack"]), **attrs}
+    tr["stack"].append(s)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        tr["stack"].pop()
+        tr["spans"].append(s)
+
+def traced(name: str | None = None):
+    """Decorador: la llamada completa es un span (conserva .clear de las funciones cacheadas)."""
+    def deco(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        if hasattr(fn, "clear"): wrapper.clear = fn.clear
+        return wrapper
+    return deco
+
+def trace_io(read: int = 0, written: int = 0):
+    # Bytes leídos/escritos: se suman al span abierto más interno y al total del rerun
+    tr = _trace_cur()
+    if tr is None: return
+    for s in [tr] + tr["stack"][-1:]:
+        if read: s["rb"] = s.get("rb", 0) + int(read)
+        if written: s["wb"] = s.get("wb", 0) + int(written)
+
+def trace_tag(**attrs):
+    tr = _trace_cur()
+    if tr is not None: tr.update(attrs)
+
+def _trace_write(tr: dict):
+    PERF_DIR.mkdir(parents=True, exist_ok=True)
+    line = json.dumps(tr, ensure_ascii=False) + "\n"
+    with file_lock(TRACE_PATH):
+        if _file_size(TRACE_PATH) + len(line) > TRACE_MAX_BYTES:
+            for i in range(TRACE_KEEP - 1, 0, -1):
+                old = TRACE_PATH.with_name(f"{TRACE_PATH.name}.{i}")
+                if old.exists(): old.replace(TRACE_PATH.with_name(f"{TRACE_PATH.name}.{i + 1}"))
+            if TRACE_PATH.exists(): TRACE_PATH.replace(TRACE_PATH.with_name(f"{TRACE_PATH.name}.1"))
+        with open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+
+@contextmanager
+def trace_rerun(**attrs):
+    if not TRACE_ENABLED or _trace_cur() is not None:
+        yield
+        return
+    tr = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "pid": os.getpid(), **attrs, "spans": [], "stack": []}
+    _trace_local.trace = tr
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _trace_local.trace = None  # st.rerun()/st.stop() también cierran la traza
+        tr["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        del tr["stack"]
+        try:
+            _trace_write(tr)
+        except OSError:
+            pass
+
+def read_traces(max_bytes: int = 1024 * 1024) -> list[dict]:
+    """Trazas más recientes (cola de trace.jsonl y, si no alcanza, del archivo rotado anterior)."""
+    out, budget = [], max_bytes
+    for path in (TRACE_PATH, TRACE_PATH.with_name(f"{TRACE_PATH.name}.1")):
+        size = _file_size(path)
+        if not size or budget <= 0: continue
+        with open(path, "rb") as f:
+            f.seek(max(0, size - budget))
+            chunk = f.read()
+        budget -= len(chunk)
+        lines = chunk.splitlines()[(1 if size > len(chunk) else 0):]  # la primera puede venir cortada
+        batch = []
+        for ln in lines:
+            try:
+                batch.append(json.loads(ln))
+            except ValueError:
+                continue
+        out = batch + out
+    return out
+
+def trace_summary(traces: list[dict]):
+    """(p50/p95 por span, reruns más lentos) para el panel de Admin."""
+    import pandas as pd  # solo el panel lo usa: este módulo no arrastra pandas
+    rows = [s for tr in traces for s in tr.get("spans", [])]
+    spans = pd.DataFrame(rows, columns=["name","ms","wait_ms","hold_ms","rb","wb"])
+    per = pd.DataFrame(columns=["span","n","p50_ms","p95_ms","max_ms","espera_p95_ms","kb_leidos","kb_escritos"])
+    if not spans.empty:
+        g = spans.groupby("name")
+        per = pd.DataFrame({
+            "n": g.size(), "p50_ms": g["ms"].quantile(0.5), "p95_ms": g["ms"].quantile(0.95), "max_ms": g["ms"].max(),
+            "espera_p95_ms": g["wait_ms"].quantile(0.95),
+            "kb_leidos": g["rb"].sum() / 1024, "kb_escritos": g["wb"].sum() / 1024,
+        }).round(1).rename_axis("span").reset_index().sort_values("p95_ms", ascending=False)
+    slow = pd.DataFrame([{
+        "fecha": tr.get("ts",""), "pagina": tr.get("page",""), "usuario": tr.get("user",""), "ms": tr.get("ms", 0),
+        "span_mayor": max((s for s in tr.get("spans", []) if s.get("depth") == 0), key=lambda s: s.get("ms", 0), default={}).get("name",""),
+    } for tr in traces], columns=["fecha","pagina","usuario","ms","span_mayor"])
+    return per, slow.sort_values("ms", ascending=False).head(10)
+
+# ===================== Bloqueo de archivo (best-effort) =====================
+@contextmanager
+def file_lock(lock_path: Path):
+    lock_file = lock_path.with_suffix(lock_path.suffix + ".lock")
+    fd = None
+    with span("lock:" + lock_path.name) as s:
+        t0 = time.perf_counter()
+        try:
+            lock_file.parent.mkdir(parents=True, exist_ok=True)  # las carpetas de data/ se crean al primer uso
+            fd = os.open(str(lock_file), os.O_CREAT | os.O_RDWR)
+            try:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except Exception:
+                pass
+            s["wait_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            yield
+        finally:
+            try:
+                if fd is not None:
+                    try:
+                        import fcntl
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                    except Exception:
+                        pass
+                    os.close(fd)
+            except Exception:
+                pass
+            s["hold_ms"] = round((time.perf_counter() - t0) * 1000 - s.get("wait_ms", 0), 2)
+
+# ---------- Huellas de archivo (stat) ----------
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+def _stat_key(path: Path):
+    try:
+        stt = path.stat()
+        return (stt.st_mtime_ns, stt.st_size)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,57 @@
+# crm/users.py — usuarios y login
+from __future__ import annotations
+import hashlib
+
+import pandas as pd
+
+from .config import USERS_PATH
+from .tracing import file_lock, _stat_key
+
+# ===================== Usuarios (default + helpers) =====================
+DEFAULT_USER_ROWS = [
+    ["admin","Admin","Admin","ba26148e3bc77341163135d123a4dc26664ff0497da04c0b3e83218c97f70c45"],
+    ["director","Director","Director","c34926c2783dca6cf34d1160ed5a04e1615cb813d3b5798efc29cc590cce4c91"],
+    ["subdirector","Subdirector","Subdirector","58845944d08671209339de539469a100c8e9d6e17dcee9a447c7751937f7cb48"],
+    ["favio","Favio","Ventas","e28ebb5d991f9ebbc5f2d26b199586e9bfb8fffd3b76dca200efd75eb68e999d"],
+    ["nancy","Nancy","Ventas","64b1bce63509372952ad7191af86bddcb9939772404c236ff67b89d0442496d0"],
+    ["rosario","Rosario","Ventas","706f42010b29d6376c768d717a19b49dc50b8b7133bffa1ae36d0fbbc32d59bc"],
+    ["haydee","Haydee","Comunicación","6b90d996f7c98698cd95d0d86f1298dbb9df89df34f16136b259a4efcaba04d8"],
+    ["nora","Nora","Comunicación","f54fd67046eeca39cd1f760730d3b48b1c00d3830f0c5b9fa5ace0a7683a22058"],
+]
+USER_COLUMNS = ["username","name","role","password_hash"]
+
+def sha256_hex(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+def ensure_users_csv():
+    USERS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    if not USERS_PATH.exists():
+        with file_lock(USERS_PATH):
+            pd.DataFrame(DEFAULT_USER_ROWS, columns=USER_COLUMNS).to_csv(USERS_PATH, index=False, encoding="utf-8")
+    elif list(pd.read_csv(USERS_PATH, dtype=str, nrows=0).columns) != USER_COLUMNS:
+        # Solo se reescribe si el encabezado no coincide con el esquema esperado
+        dfu = pd.read_csv(USERS_PATH, dtype=str).fillna("")
+        for c in USER_COLUMNS:
+            if c not in dfu.columns:
+                dfu[c] = ""
+        dfu = dfu[USER_COLUMNS]
+        with file_lock(USERS_PATH):
+            dfu.to_csv(USERS_PATH, index=False, encoding="utf-8")
+
+_users_cache = {"key": None, "df": None}
+
+def load_users() -> pd.DataFrame:
+    # Se relee solo si users.csv cambió (huella stat); la tabla es compartida, de solo lectura
+    key = _stat_key(USERS_PATH)
+    if key is None or _users_cache["key"] != key:
+        ensure_users_csv()
+        _users_cache["df"], _users_cache["key"] = pd.read_csv(USERS_PATH, dtype=str).fillna(""), _stat_key(USERS_PATH)
+    return _users_cache["df"]
+
+def try_login(username: str, password: str):
+    users = load_users()
+    row = users[users["username"].str.lower() == (username or "").strip().lower()]
+    if row.empty: return None
+    ok = (row.iloc[0]["password_hash"] == sha256_hex(password or ""))
+    if not ok: return None
+    return {"username": row.iloc[0]["username"], "name": row.iloc[0]["name"], "role": row.iloc[0]["role"]}